@@ -1,14 +1,41 @@
 #include "ICM_20948_WDC.h"
 
 #define OUTPUT_FORMAT 0
+// Last trailer byte, tells the host which hand this glove is on. 0 = right, 1 = left
+#define GLOVE_SIDE 0
+// 1 sends the DMP's raw Q1-Q3 instead of yaw/pitch/roll, the host does the conversion.
+// Saves the trig on every loop and keeps the full orientation, flagged in bit 1 of the last trailer byte
+#define SEND_QUATERNION 0
+#define TRAILER_FLAGS (GLOVE_SIDE | (SEND_QUATERNION << 1))
+// 2 sends 40 byte frames with a header, sequence number, micros() timestamp and CRC so the host
+// can tell lost and corrupted frames apart and measure latency. 1 is the original 32 byte frame
+#define FRAME_VERSION 1
 
 // Address pin should be connected to ground
 ICM_20948_I2C myICM;
 double quats[4];
 double ypr[3];
+int32_t quatRaw[3];
 
 int16_t offsets[6];
 
+#if FRAME_VERSION == 2
+uint8_t frame[40];
+uint16_t frameSeq = 0;
+
+// CRC-16/CCITT-FALSE, the same as PacketDecoder.crc16
+uint16_t crc16(const uint8_t *data, size_t len) {
+    uint16_t crc = 0xFFFF;
+    for (size_t i = 0; i < len; i++) {
+        crc ^= (uint16_t) data[i] << 8;
+        for (int b = 0; b < 8; b++) {
+            crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+        }
+    }
+    return crc;
+}
+#endif
+
 // note currently thumb back and palm aren't differentiated at all. SHould eventually differentiate them and then on python side reunite if desired
 const int pin_PALM = 18;
 const int pin_THUMB = 19;
@@ -295,6 +322,11 @@ void loop() {
 
       //Serial.printf("Quat9 data is: Q1:%ld Q2:%ld Q3:%ld Accuracy:%d\r\n", data.Quat9.Data.Q1, data.Quat9.Data.Q2, data.Quat9.Data.Q3, data.Quat9.Data.Accuracy);
 
+#if SEND_QUATERNION == 1 && OUTPUT_FORMAT == 0
+      quatRaw[0] = data.Quat9.Data.Q1;
+      quatRaw[1] = data.Quat9.Data.Q2;
+      quatRaw[2] = data.Quat9.Data.Q3;
+#else
       // Scale to +/- 1
       quats[1] = ((double)data.Quat9.Data.Q1) / 1073741824.0; // Convert to double. Divide by 2^30
       quats[2] = ((double)data.Quat9.Data.Q2) / 1073741824.0; // Convert to double. Divide by 2^30
@@ -302,6 +334,7 @@ void loop() {
       quats[0] = sqrt(1.0 - ((quats[1] * quats[1]) + (quats[2] * quats[2]) + (quats[3] * quats[3])));
 
       quatsToYPR(quats, ypr);
+#endif
     }
 
 
@@ -319,17 +352,46 @@ void loop() {
       #endif
   }
 
-#if OUTPUT_FORMAT == 0
+#if OUTPUT_FORMAT == 0 && FRAME_VERSION == 2
+            {
+                uint32_t now = micros();
+                frame[0] = 0xA5;
+                frame[1] = 0x5A;
+                frame[2] = 2;
+                frame[3] = TRAILER_FLAGS;
+                memcpy(frame + 4, &frameSeq, 2);
+                memcpy(frame + 6, &now, 4);
+                frame[10] = (uint8_t) indexFinger.connection_route;
+                frame[11] = (uint8_t) middleFinger.connection_route;
+                frame[12] = (uint8_t) ringFinger.connection_route;
+                frame[13] = (uint8_t) pinkyFinger.connection_route;
+#if SEND_QUATERNION == 1
+                memcpy(frame + 14, quatRaw, 12);
+#else
+                float yprf[3] = {(float) ypr[0], (float) ypr[1], (float) ypr[2]};
+                memcpy(frame + 14, yprf, 12);
+#endif
+                memcpy(frame + 26, offsets, 12);
+                uint16_t crc = crc16(frame + 2, 36);
+                memcpy(frame + 38, &crc, 2);
+                Serial.write(frame, 40);
+                frameSeq++;
+            }
+#elif OUTPUT_FORMAT == 0
             Serial.write((uint8_t) indexFinger.connection_route);
             Serial.write((uint8_t) middleFinger.connection_route);
             Serial.write((uint8_t) ringFinger.connection_route);
             Serial.write((uint8_t) pinkyFinger.connection_route);
+#if SEND_QUATERNION == 1
+            Serial.write((byte*)quatRaw, 12);
+#else
             Serial.write((byte*)ypr, 12);
+#endif
             Serial.write((byte*)offsets, 12);
             Serial.write(3);
             Serial.write(2);
             Serial.write(1);
-            Serial.write(0);
+            Serial.write(TRAILER_FLAGS);
 #else
             // Serial.print(F("Q1:"));
             // Serial.print(quats[1], 3);
@@ -1,4 +1,4 @@
-from pubsub import pub
+from EventBus import pub
 
 from BoardInteraction import BoardInteractor
 
@@ -20,18 +20,28 @@ def printGyroDataAll(roll, pitch, yaw, rollChanged, pitchChanged, yawChanged):
     print("roll: {}\tpitch: {}\tyaw: {}".format(roll, pitch, yaw))
 
 
-def printDataToConsole():
+def printGyroBatch(t, rpy, connections, quat):
+    for i in range(len(t)):
+        print("{:.3f}\troll: {}\tpitch: {}\tyaw: {}".format(t[i], rpy[i, 0], rpy[i, 1], rpy[i, 2]))
+
+
+def printDataToConsole(lossless=False):
     pub.subscribe(printFingerConnection, 'FingerConnection')
-    pub.subscribe(printGyroDataAll, 'LGyro')
-    pub.subscribe(printGyroDataAll, 'RGyro')
+    if lossless:
+        pub.subscribe(printGyroBatch, 'LGyroBatch')
+        pub.subscribe(printGyroBatch, 'RGyroBatch')
+    else:
+        pub.subscribe(printGyroDataAll, 'LGyro')
+        pub.subscribe(printGyroDataAll, 'RGyro')
     # pub.subscribe(printGyroDataOnlyChange, 'LGyro')
     # pub.subscribe(printGyroDataOnlyChange, 'RGyro')
 
-    b = BoardInteractor()
+    b = BoardInteractor(lossless=lossless)
     b.start()
 
     input("Press Enter to stop")
     b.stop()
+    print(b.getFrameCounts())
 
 
 if __name__ == "__main__":
@@ -1,31 +1,15 @@
-from pubsub import pub
+from EventBus import pub
 import numpy as np
 from enum import Enum
+from collections import deque
 import time
 import serial
-import struct
 import matplotlib.pyplot as plt
 
 import ThreadExtension
-
-
-class Fingers(Enum):
-    LIT = 0
-    LMT = 1
-    LRT = 2
-    LPT = 3
-    LIP = 4
-    LMP = 5
-    LRP = 6
-    LPP = 7
-    RIT = 8
-    RMT = 9
-    RRT = 10
-    RPT = 11
-    RIP = 12
-    RMP = 13
-    RRP = 14
-    RPP = 15
+import PacketDecoder
+from PacketDecoder import Fingers
+from BoardManager import discoverBoardPorts
 
 
 class HapticMotors(Enum):
@@ -51,15 +35,24 @@ class BoardInteractor(ThreadExtension.StoppableThread):
     # CONSTANTS
     HAPTIC_LEN_LONG = 0.3
     HAPTIC_LEN_SHORT = 0.1
+    READ_RETRY_DELAY = 0.1
+    CONNECT_RETRY_DELAY = 1.0
 
     # MAIN LIFECYCLE
 
-    def __init__(self, plotOutput=False, publishOutput=True):
+    def __init__(self, plotOutput=False, publishOutput=True, lossless=False, port=None, recorder=None):
         super().__init__()
+        self.port = port
+        # a SessionRecording.SessionRecorder or SessionArchive.SessionArchiveWriter to save every frame to
+        self.recorder = recorder
         self.publishOutput = publishOutput
         self.plotOutput = plotOutput
+        # lossless: every frame is queued and published as a batch on 'LGyroBatch'/'RGyroBatch'
+        # in addition to the usual latest value messages
+        self.lossless = lossless
 
-        self.packetSize = 32  # bytes
+        self.packetSize = PacketDecoder.FRAME_DTYPE.itemsize  # 32 bytes
+        self._decoder = PacketDecoder.PacketDecoder()
         self.FINGER_THUMB_CON = 1
         self.FINGER_PALM_CON = 2
 
@@ -69,6 +62,8 @@ class BoardInteractor(ThreadExtension.StoppableThread):
         self._rroll = 0.0
         self._rpitch = 0.0
         self._ryaw = 0.0
+        self._lquat = np.array([1.0, 0.0, 0.0, 0.0])
+        self._rquat = np.array([1.0, 0.0, 0.0, 0.0])
         self._connections = [False] * 16
 
         self._lroll_old = 0.0
@@ -78,6 +73,10 @@ class BoardInteractor(ThreadExtension.StoppableThread):
         self._rpitch_old = 0.0
         self._ryaw_old = 0.0
         self._connections_old = [False] * 16
+        # when the samples behind the values above were made, see PacketDecoder.newestFrameTime
+        self._lsampleTime = None
+        self._rsampleTime = None
+        self._connectionsTime = None
 
         self.haptic_state = [False] * 10
         self.haptic_off_time = [0] * 10
@@ -91,13 +90,16 @@ class BoardInteractor(ThreadExtension.StoppableThread):
         self.last_lgyro_time = 0
         self.last_rgyro_time = 0
 
-    def run(self):
-        if not self._isconnected:
-            r = self.connectToBoard()
-            if r != 0:
-                print("BoardInteractor couldn't connect to board, return val {}".format(r))
+        # each entry is (side, arrival times, rpy, connections, quaternions) for one read from the board
+        self.sampleQueue = deque()
+        self.framesReceived = 0
+        self.framesCoalesced = 0  # decoded but skipped because a newer frame was in the same read
+        self.framesThrottled = 0  # latest values replaced before GYRO_MIN_DELAY let them be published
+        self._gyroPending = {"L": False, "R": False}
 
-            self._isconnected = True
+    def run(self):
+        if not self.waitForBoard():
+            return
 
         if self.plotOutput:
             plt.ion()
@@ -115,13 +117,26 @@ class BoardInteractor(ThreadExtension.StoppableThread):
         while not self.req_stop():
             readres = self.parseBoardMsg()
             if readres != 0:
-                print("Reading from board failed with code {}, trying again in 1 second".format(readres))
-                time.sleep(1)
-                self._board.flushInput()
+                # corrupt frames are handled by the decoder, this is only for errors from the port itself
+                print("Reading from board failed with code {}, trying again".format(readres))
+                time.sleep(self.READ_RETRY_DELAY)
+                try:
+                    self._board.reset_input_buffer()
+                except (serial.SerialException, OSError):
+                    # the port went away, open it again once it's back
+                    self._board.close()
+                    self._isconnected = False
+                    if not self.waitForBoard():
+                        return
                 self.alignSerialInput()
                 continue
             self.sendBoardHapticData()
 
+            if self.publishOutput:
+                self.publishSampleQueue()
+            else:
+                self.sampleQueue.clear()
+
             if self.plotOutput:
                 for i in range(3):
                     self.ls[i].set_ydata(self.plotVals[i, :])
@@ -134,7 +149,7 @@ class BoardInteractor(ThreadExtension.StoppableThread):
                     if self._connections_old[i] != self._connections[i]:
                         self._connections_old[i] = self._connections[i]
                         fname = Fingers(i).name
-                        pub.sendMessage('FingerConnection', con=self._connections[i], finger=fname)
+                        pub.publishAt(self._connectionsTime, 'FingerConnection', self._connections[i], fname)
 
                         # hlen = self.HAPTIC_LEN_LONG
                         # if not self._connections[i]:
@@ -143,8 +158,10 @@ class BoardInteractor(ThreadExtension.StoppableThread):
 
                 if time.time() * 1000 - self.last_lgyro_time > self.GYRO_MIN_DELAY:
                     if self._lroll != self._lroll_old or self._lpitch != self._lpitch_old or self._lyaw != self._lyaw_old:
-                        pub.sendMessage('LGyro', roll=self._lroll, pitch=self._lpitch, yaw=self._lyaw,
-                                        rollChanged=self._lroll != self._lroll_old, pitchChanged=self._lpitch != self._lpitch_old, yawChanged=self._lyaw != self._lyaw_old)
+                        pub.publishAt(self._lsampleTime, 'LGyro', self._lroll, self._lpitch, self._lyaw,
+                                    self._lroll != self._lroll_old, self._lpitch != self._lpitch_old, self._lyaw != self._lyaw_old)
+                        pub.publishAt(self._lsampleTime, 'LQuat', self._lquat)
+                        self._gyroPending["L"] = False
                         self._lroll_old = self._lroll
                         self._lpitch_old = self._lpitch
                         self._lyaw_old = self._lyaw
@@ -152,8 +169,10 @@ class BoardInteractor(ThreadExtension.StoppableThread):
 
                 if time.time() * 1000 - self.last_rgyro_time > self.GYRO_MIN_DELAY:
                     if self._rroll != self._rroll_old or self._rpitch != self._rpitch_old or self._ryaw != self._ryaw_old:
-                        pub.sendMessage('RGyro', roll=self._rroll, pitch=self._rpitch, yaw=self._ryaw,
-                                        rollChanged=self._rroll != self._rroll_old, pitchChanged=self._rpitch != self._rpitch_old, yawChanged=self._ryaw != self._ryaw_old)
+                        pub.publishAt(self._rsampleTime, 'RGyro', self._rroll, self._rpitch, self._ryaw,
+                                    self._rroll != self._rroll_old, self._rpitch != self._rpitch_old, self._ryaw != self._ryaw_old)
+                        pub.publishAt(self._rsampleTime, 'RQuat', self._rquat)
+                        self._gyroPending["R"] = False
                         self._rroll_old = self._rroll
                         self._rpitch_old = self._rpitch
                         self._ryaw_old = self._ryaw
@@ -161,11 +180,37 @@ class BoardInteractor(ThreadExtension.StoppableThread):
 
     # COMMUNICATION FUNCTIONS WITH BOARD
 
+    def waitForBoard(self):
+        """
+        Tries to connect until it works or the thread is asked to stop, returns False if stopped
+        """
+        while not self._isconnected:
+            r = self.connectToBoard()
+            if r == 0:
+                self._isconnected = True
+                break
+            print("BoardInteractor couldn't connect to board, return val {}, trying again in {} s".format(
+                r, self.CONNECT_RETRY_DELAY))
+            # waits on the stop event so stopping doesn't have to sit out the delay
+            if self._stop_event.wait(self.CONNECT_RETRY_DELAY):
+                return False
+        return True
+
     def connectToBoard(self):
+        port = self.port
+        if port is None:
+            ports = discoverBoardPorts()
+            if len(ports) == 0:
+                print("No boards found")
+                return 1
+            port = ports[0]
+
         try:
-            self._board = serial.Serial(port="/dev/ttyACM0", baudrate=115200)
-        except:
-            self._board = serial.Serial(port="COM9", baudrate=115200)
+            self._board = serial.Serial(port=port, baudrate=115200)
+        except (serial.SerialException, OSError) as e:
+            # busy, unplugged or not ours to open
+            print("Couldn't open {}: {}".format(port, e))
+            return 2
 
         print("board: {}".format(self._board))
         if self._board is None:
@@ -175,75 +220,83 @@ class BoardInteractor(ThreadExtension.StoppableThread):
             return 0
 
     def alignSerialInput(self):
-        print("Aligning serial input")
-        while True:
-            vals = np.array(struct.unpack(str(self.packetSize) +
-                            'b', self._board.read(self.packetSize)))
-            print(vals)
-            if vals[-1] == 0 and vals[-2] == 1 and vals[-3] == 2 and vals[-4] == 3:
-                break
-
-            for i in range(len(vals)):
-                if vals[i] == 3 and vals[(i+1) % len(vals)] == 2 and vals[(i+2) % len(vals)] == 1 and vals[(i+3) % len(vals)] == 0:
-                    self._board.read(i + 4)
-                    break
+        # the decoder finds the next frame boundary itself as bytes come in
+        self._decoder.reset()
 
     def parseBoardMsg(self):
-        dat = self._board.read(self.packetSize)
-        while self._board.in_waiting >= self.packetSize:
-            dat = self._board.read(self.packetSize)
-
-        vals = struct.unpack('4b3f6h4b', dat)
-        # vals = struct.unpack('bbbb4f', dat)
-        # valtest = struct.unpack('bbbbfffbbbb', dat)
-        if not (vals[-1] == 0 and vals[-2] == 1 and vals[-3] == 2 and vals[-4] == 3):
-            print(vals)
+        try:
+            self._decoder.readFrom(self._board)
+        except serial.SerialException as e:
+            print(e)
             return 1
-        gyrovals = np.array(vals[4:7])
-        p = 3.1415926
-        self._rroll = (gyrovals[2] + p/2.0) / (2.0*p)
-        self._rpitch = (gyrovals[1] + p/2.0) / (2.0*p)
-        self._ryaw = (gyrovals[0] + p/2.0) / (2.0*p)
+        t = time.time()
+
+        frames = self._decoder.decode(hostTime=t)
+        if len(frames) == 0:
+            return 0
+
+        self.framesReceived += len(frames)
+        if self.recorder is not None:
+            self.recorder.write(frames, t, self._decoder.sequence, self._decoder.boardTime)
+        side = PacketDecoder.frameSide(frames[-1])
+        # when the newest frame was made, the messages about it are published with this time
+        made = self._decoder.newestFrameTime(t)
+        if self.lossless:
+            rpy = PacketDecoder.normalizeGyro(PacketDecoder.frameYPR(frames))
+            cons = PacketDecoder.fingerConnections(frames['routes'], side=side)
+            quats = PacketDecoder.frameQuaternions(frames)
+            times = PacketDecoder.frameTimes(made, len(frames), self._decoder.boardTime)
+            self.sampleQueue.append((side, times, rpy, cons, quats))
+        else:
+            self.framesCoalesced += len(frames) - 1
+
+        # only the newest frame is used for the latest value messages
+        gyrovals = PacketDecoder.frameYPR(frames[-1:])[0]
+        quat = PacketDecoder.frameQuaternions(frames[-1:])[0]
+        if side == "L":
+            self._lroll, self._lpitch, self._lyaw = PacketDecoder.normalizeGyro(gyrovals.reshape((1, 3)))[0]
+            self._lquat = quat
+            self._lsampleTime = made
+        else:
+            self._rroll, self._rpitch, self._ryaw = PacketDecoder.normalizeGyro(gyrovals.reshape((1, 3)))[0]
+            self._rquat = quat
+            self._rsampleTime = made
+
+        if not self.lossless:
+            # the previous latest value of this side never got past GYRO_MIN_DELAY before this one replaced it
+            if self._gyroPending[side]:
+                self.framesThrottled += 1
+            if side == "L":
+                old = (self._lroll_old, self._lpitch_old, self._lyaw_old)
+                new = (self._lroll, self._lpitch, self._lyaw)
+            else:
+                old = (self._rroll_old, self._rpitch_old, self._ryaw_old)
+                new = (self._rroll, self._rpitch, self._ryaw)
+            self._gyroPending[side] = new != old
 
         # print(self.plotVals)
         if self.plotOutput:
             self.plotVals = np.roll(self.plotVals, -1, axis=1)
             self.plotVals[0:3, -1] = gyrovals[0:3]
             # self.plotVals[3:6, -1] = vals[4:7]
-            print(vals[7:13])
+            print(frames['raw'][-1])
 
-        self._connections = [False] * 16
-        if vals[0] == 1:
-            self._connections[Fingers['RIT'].value] = True
-        elif vals[0] == 2:
-            self._connections[Fingers['RIP'].value] = True
-        elif vals[0] == 3:
-            self._connections[Fingers['RIP'].value] = True
-            self._connections[Fingers['RIT'].value] = True
-        if vals[1] == 1:
-            self._connections[Fingers['RMT'].value] = True
-        elif vals[1] == 2:
-            self._connections[Fingers['RMP'].value] = True
-        elif vals[1] == 3:
-            self._connections[Fingers['RMP'].value] = True
-            self._connections[Fingers['RMT'].value] = True
-        if vals[2] == 1:
-            self._connections[Fingers['RRT'].value] = True
-        elif vals[2] == 2:
-            self._connections[Fingers['RRP'].value] = True
-        elif vals[2] == 3:
-            self._connections[Fingers['RRT'].value] = True
-            self._connections[Fingers['RRP'].value] = True
-        if vals[3] == 1:
-            self._connections[Fingers['RPT'].value] = True
-        elif vals[3] == 2:
-            self._connections[Fingers['RPP'].value] = True
-        elif vals[3] == 3:
-            self._connections[Fingers['RPT'].value] = True
-            self._connections[Fingers['RPP'].value] = True
+        self._connections = PacketDecoder.fingerConnections(frames['routes'][-1:], side=side)[0].tolist()
+        self._connectionsTime = made
 
         return 0
 
+    def publishSampleQueue(self):
+        while len(self.sampleQueue) > 0:
+            side, t, rpy, cons, quats = self.sampleQueue.popleft()
+            pub.publishAt(t[-1], side + 'GyroBatch', t, rpy, cons, quats)
+
+    def getFrameCounts(self):
+        counts = {"received": self.framesReceived, "coalesced": self.framesCoalesced,
+                  "throttled": self.framesThrottled}
+        counts.update(self._decoder.getCounts())
+        return counts
+
     def sendBoardHapticData(self):
         # TODO implement
         # Note if board read fails this is never called ... need to change for arduino to work properly?
@@ -277,6 +330,12 @@ class BoardInteractor(ThreadExtension.StoppableThread):
     def getRYaw(self):
         return self._ryaw
 
+    def getLQuat(self):
+        return self._lquat
+
+    def getRQuat(self):
+        return self._rquat
+
 
 if __name__ == "__main__":
     bi = BoardInteractor(plotOutput=True, publishOutput=False)
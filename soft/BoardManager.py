@@ -0,0 +1,93 @@
+"""
+Finds every glove plugged in and runs them all from one asyncio loop on a single thread.
+Each glove says which hand it is in its frame trailer, so the port order doesn't matter.
+"""
+
+import asyncio
+
+from serial.tools import list_ports
+
+import ThreadExtension
+import BoardTransport
+import SessionArchive
+import SessionRecording
+
+
+def discoverBoardPorts():
+    """
+    Device names of all USB serial ports, which is where the gloves show up
+    (/dev/ttyACM* on linux, COM* on windows)
+    """
+    return sorted([p.device for p in list_ports.comports() if p.vid is not None])
+
+
+class BoardManager(ThreadExtension.StoppableThread):
+    """
+    Connects to every board on ports (or every discovered one) and publishes LGyro/RGyro
+    and FingerConnection from whichever glove actually sent them.
+    With recordPath everything the boards send is also saved there, as a SessionArchive if it ends
+    in .arc, with replayPath the boards are replaced by that recording played back at replaySpeed
+    (see SessionRecording).
+    """
+
+    STOP_POLL_DELAY = 0.1  # seconds
+
+    def __init__(self, ports=None, baudrate=115200, recordPath=None, replayPath=None, replaySpeed=1.0):
+        super().__init__()
+        self.ports = ports
+        self.baudrate = baudrate
+        self.recordPath = recordPath
+        self.replayPath = replayPath
+        self.replaySpeed = replaySpeed
+        self.recorder = None
+        self.connections = dict()
+
+    def run(self):
+        asyncio.run(self._runBoards())
+
+    async def _runBoards(self):
+        if self.replayPath is not None:
+            print("Replaying {}".format(self.replayPath))
+            self.connections[self.replayPath] = SessionRecording.ReplayConnection(self.replayPath,
+                                                                                 speed=self.replaySpeed)
+        else:
+            await self._openBoards()
+
+        tasks = [asyncio.create_task(c.publish()) for c in self.connections.values()]
+        while not self.req_stop() and not all([t.done() for t in tasks]):
+            await asyncio.sleep(self.STOP_POLL_DELAY)
+
+        for c in self.connections.values():
+            c.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.recorder is not None:
+            self.recorder.close()
+
+    async def _openBoards(self):
+        ports = self.ports
+        if ports is None:
+            ports = discoverBoardPorts()
+        print("Connecting to boards on {}".format(ports))
+
+        if self.recordPath is not None and self.recordPath.endswith(".arc"):
+            self.recorder = SessionArchive.SessionArchiveWriter(self.recordPath)
+        elif self.recordPath is not None:
+            self.recorder = SessionRecording.SessionRecorder(self.recordPath)
+        for port in ports:
+            try:
+                self.connections[port] = await BoardTransport.openSerialBoard(port, baudrate=self.baudrate)
+                self.connections[port].protocol.recorder = self.recorder
+            except Exception as e:
+                print("Couldn't connect to board on {}: {}".format(port, e))
+
+    def getBoard(self, side):
+        """
+        The connection for the "L" or "R" glove, None if it isn't connected or hasn't sent anything yet
+        """
+        for c in self.connections.values():
+            if c.side == side:
+                return c
+        return None
+
+    def getFrameCounts(self):
+        return {port: c.protocol.getFrameCounts() for port, c in self.connections.items()}
@@ -0,0 +1,346 @@
+"""
+Headless stand in for the gloves: writes frames in the real serial format to a pty or a TCP
+socket, so BoardInteractor (given the pty as its port), BoardManager and BoardTransport connect to
+it exactly as they would to a board.
+
+Each SimulatedGlove has its own rate (100 Hz to 10 kHz is fine), frame version, motion profile and
+finger pattern, and can add noise to the angles and raw readings and corrupt bytes on the wire.
+Motion profiles give roll, pitch, yaw in the same normalized turns the interactors publish (0.25 is
+0 radians), they're turned back into the radians the board would have sent.
+
+    SineMotion          a sine per axis
+    RandomWalkMotion    bounded random walk
+    RecordedMotion      loops a SessionArchive or SessionRecording file
+
+Frames are written once per TICK with all the frames due since the last one, like USB serial
+delivers them, so high rates don't need a sleep per frame.
+"""
+
+import os
+import pty
+import socket
+import sys
+import time
+import tty
+
+import numpy as np
+
+import PacketDecoder
+import ThreadExtension
+
+
+def rpyToBoardYPR(rpy):
+    """
+    Inverse of PacketDecoder.normalizeGyro
+    """
+    p = 3.1415926
+    return np.asarray(rpy, dtype=float)[:, ::-1] * (2.0 * p) - p / 2.0
+
+
+class SineMotion:
+    def __init__(self, amplitude=(0.1, 0.1, 0.1), frequency=(0.5, 0.3, 0.2), center=(0.25, 0.25, 0.25), phase=(0, 0, 0)):
+        self.amplitude = np.asarray(amplitude, dtype=float)
+        self.frequency = np.asarray(frequency, dtype=float)
+        self.center = np.asarray(center, dtype=float)
+        self.phase = np.asarray(phase, dtype=float)
+
+    def sample(self, t):
+        """
+        (n, 3) roll, pitch, yaw at times t (seconds since the glove started)
+        """
+        return self.center + self.amplitude * np.sin(2.0 * np.pi * (self.frequency * t[:, None] + self.phase))
+
+
+class RandomWalkMotion:
+    def __init__(self, stepStd=0.2, low=0.1, high=0.4, seed=None):
+        """
+        stepStd is the spread after one second, in turns. The walk reflects off low and high, the
+        defaults keep it within the quarter turn either way of level that quaternions round trip in.
+        """
+        self.stepStd = stepStd
+        self.low = low
+        self.high = high
+        self.rng = np.random.default_rng(seed)
+        self._pos = np.full(3, (low + high) / 2.0)
+        self._lastT = None
+
+    def sample(self, t):
+        if len(t) == 0:
+            return np.empty((0, 3))
+        dt = np.diff(t, prepend=t[0] if self._lastT is None else self._lastT)
+        steps = self.rng.normal(0.0, 1.0, (len(t), 3)) * (self.stepStd * np.sqrt(dt))[:, None]
+        pos = self._pos + np.cumsum(steps, axis=0)
+        # fold back into [low, high]
+        span = self.high - self.low
+        pos = self.low + span - np.abs(np.mod(pos - self.low, 2.0 * span) - span)
+        self._pos = pos[-1]
+        self._lastT = t[-1]
+        return pos
+
+
+class RecordedMotion:
+    def __init__(self, path, side="R"):
+        """
+        Loops one glove's roll, pitch, yaw from a SessionArchive (.arc) or SessionRecording file
+        """
+        if path.endswith(".arc"):
+            import SessionArchive
+
+            w = SessionArchive.SessionArchive(path).sideWindow(side)
+            self.t = w['t'] - w['t'][0]
+            self.rpy = w['rpy'].astype(float)
+        else:
+            import SessionRecording
+
+            r = SessionRecording.loadRecording(path)
+            r = r[(r['frame']['trailer'][:, 3] & PacketDecoder.SIDE_MASK) == (side == "L")]
+            self.t = r['t'] - r['t'][0]
+            self.rpy = PacketDecoder.normalizeGyro(PacketDecoder.frameYPR(r['frame']))
+        if len(self.t) == 0:
+            raise ValueError("{} has no samples from the {} glove".format(path, side))
+        self.duration = self.t[-1] + (np.median(np.diff(self.t)) if len(self.t) > 1 else 0.01)
+
+    def sample(self, t):
+        i = np.searchsorted(self.t, np.mod(t, self.duration), side='right') - 1
+        return self.rpy[np.maximum(i, 0)]
+
+
+class FingerPattern:
+    """
+    Finger routes over time. Each finger taps with its route for duty of every period seconds,
+    staggered by offset. period 0 leaves that finger open.
+    """
+
+    def __init__(self, period=(1.0, 0, 0, 0), duty=0.5, offset=(0, 0.25, 0.5, 0.75),
+                 route=PacketDecoder.ROUTE_THUMB):
+        self.period = np.asarray(period, dtype=float)
+        self.duty = duty
+        self.offset = np.asarray(offset, dtype=float)
+        self.route = route
+
+    def routes(self, t):
+        safe = np.where(self.period > 0, self.period, 1.0)
+        phase = np.mod(t[:, None] / safe - self.offset, 1.0)
+        on = (phase < self.duty) & (self.period > 0)
+        return np.where(on, self.route, PacketDecoder.ROUTE_NONE).astype(np.int8)
+
+
+class SimulatedGlove:
+    def __init__(self, side="R", rate=100.0, motion=None, fingers=None, frameVersion=1, quaternion=False,
+                 angleNoise=0.0, rawNoise=0.0, corruption=0.0, seed=None):
+        """
+        angleNoise is the std of noise added to the angles in turns, rawNoise the std added to the
+        raw readings, corruption the probability of each byte getting a bit flipped
+        """
+        self.side = side
+        self.rate = rate
+        self.motion = motion if motion is not None else SineMotion()
+        self.fingers = fingers if fingers is not None else FingerPattern()
+        self.frameVersion = frameVersion
+        self.flags = (PacketDecoder.SIDE_LEFT if side == "L" else PacketDecoder.SIDE_RIGHT) | \
+            (PacketDecoder.FLAG_QUAT if quaternion else 0)
+        self.angleNoise = angleNoise
+        self.rawNoise = rawNoise
+        self.corruption = corruption
+        self.rng = np.random.default_rng(seed)
+
+        self.framesSent = 0
+        self.bytesCorrupted = 0
+
+    def frames(self, n):
+        """
+        The next n frames as bytes
+        """
+        i = self.framesSent + np.arange(n)
+        t = i / self.rate
+        rpy = self.motion.sample(t)
+        if self.angleNoise > 0:
+            rpy = rpy + self.rng.normal(0.0, self.angleNoise, rpy.shape)
+        ypr = rpyToBoardYPR(rpy)
+        if self.flags & PacketDecoder.FLAG_QUAT:
+            import Orientation
+
+            q = Orientation.yprToQuat(ypr)
+            q = q * np.where(q[:, 0:1] < 0, -1.0, 1.0)
+            ypr = np.round(q[:, 1:] * Orientation.QUAT_SCALE)
+        raw = np.zeros((n, 6))
+        if self.rawNoise > 0:
+            raw = self.rng.normal(0.0, self.rawNoise, (n, 6))
+        frames = PacketDecoder.encodeFrames(self.fingers.routes(t), ypr, np.clip(raw, -32768, 32767), self.flags)
+        if self.frameVersion == PacketDecoder.V2_VERSION:
+            frames = PacketDecoder.encodeFramesV2(frames, i, np.round(t * 1e6))
+        data = frames.tobytes()
+        self.framesSent += n
+
+        if self.corruption > 0:
+            b = np.frombuffer(data, dtype=np.uint8).copy()
+            hit = np.flatnonzero(self.rng.random(len(b)) < self.corruption)
+            b[hit] ^= (1 << self.rng.integers(0, 8, len(hit))).astype(np.uint8)
+            self.bytesCorrupted += len(hit)
+            data = b.tobytes()
+        return data
+
+
+class PtyOutput:
+    """
+    A pty whose other end, portName, opens like a serial port
+    """
+
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        # no echo or newline translation, the frames are binary
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.portName = os.ttyname(self.slave)
+        self.bytesDropped = 0
+
+    def write(self, data):
+        try:
+            n = os.write(self.master, data)
+        except BlockingIOError:
+            n = 0
+        # a reader that falls behind loses bytes, the decoder has to resync like on a real port
+        self.bytesDropped += len(data) - n
+        try:
+            # haptic commands from the host, nothing to do with them
+            os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class SocketOutput:
+    """
+    A TCP server at host:port sending the glove's frames to every client connected
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.server.setblocking(False)
+        self.host, self.port = self.server.getsockname()
+        self.portName = "{}:{}".format(self.host, self.port)
+        self.clients = []
+        self.bytesDropped = 0
+
+    def write(self, data):
+        try:
+            c, _ = self.server.accept()
+            c.setblocking(False)
+            self.clients.append(c)
+        except BlockingIOError:
+            pass
+        for c in list(self.clients):
+            try:
+                self.bytesDropped += len(data) - c.send(data)
+            except BlockingIOError:
+                self.bytesDropped += len(data)
+            except OSError:
+                self.clients.remove(c)
+                c.close()
+                continue
+            try:
+                if len(c.recv(4096)) == 0:
+                    # the host hung up
+                    self.clients.remove(c)
+                    c.close()
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.clients.remove(c)
+                c.close()
+
+    def close(self):
+        for c in self.clients:
+            c.close()
+        self.server.close()
+
+
+class BoardSimulator(ThreadExtension.StoppableThread):
+    """
+    Runs gloves, each on its own output (PtyOutput or SocketOutput), until stopped
+    """
+
+    TICK = 0.001  # seconds
+
+    def __init__(self, gloves, outputs):
+        super().__init__()
+        self.gloves = gloves
+        self.outputs = outputs
+
+    def run(self):
+        start = time.perf_counter()
+        startFrames = [g.framesSent for g in self.gloves]
+        while not self.req_stop():
+            elapsed = time.perf_counter() - start
+            for g, o, s in zip(self.gloves, self.outputs, startFrames):
+                n = int(elapsed * g.rate) - (g.framesSent - s)
+                if n > 0:
+                    o.write(g.frames(n))
+            time.sleep(self.TICK)
+
+    def close(self):
+        self.stop()
+        if self.is_alive():
+            self.join()
+        for o in self.outputs:
+            o.close()
+
+    def getCounts(self):
+        return [{"side": g.side, "port": o.portName, "sent": g.framesSent, "corruptedBytes": g.bytesCorrupted,
+                 "droppedBytes": o.bytesDropped} for g, o in zip(self.gloves, self.outputs)]
+
+
+def simulate(gloves, useSocket=False):
+    outputs = [SocketOutput() if useSocket else PtyOutput() for _ in gloves]
+    sim = BoardSimulator(gloves, outputs)
+    sim.start()
+    return sim
+
+
+def loadTest(rate=1000.0, duration=5.0, frameVersion=2, corruption=0.0):
+    """
+    Two gloves into two BoardInteractors over ptys, counts what gets through
+    """
+    from BoardInteraction import BoardInteractor
+
+    gloves = [SimulatedGlove("L", rate, RandomWalkMotion(seed=0), frameVersion=frameVersion, corruption=corruption),
+              SimulatedGlove("R", rate, SineMotion(), frameVersion=frameVersion, corruption=corruption)]
+    sim = simulate(gloves)
+    readers = [BoardInteractor(lossless=True, port=o.portName) for o in sim.outputs]
+    for r in readers:
+        r.start()
+    time.sleep(duration)
+    # the readers only notice stop after their next read, keep the frames coming until they have
+    for r in readers:
+        r.stop()
+    for r in readers:
+        r.join(1.0)
+    # read once the readers are done, so the counts aren't changing underneath
+    counts = [r.getFrameCounts() for r in readers]
+    sim.close()
+    for c, rc in zip(sim.getCounts(), counts):
+        print(c, rc)
+
+
+if __name__ == "__main__":
+    # python BoardSimulator.py                  two gloves on ptys at 100 Hz until Enter
+    # python BoardSimulator.py socket 1000      the same on sockets at 1 kHz
+    # python BoardSimulator.py load 1000        load test through BoardInteractor
+    args = sys.argv[1:]
+    if len(args) > 0 and args[0] == "load":
+        loadTest(rate=float(args[1]) if len(args) > 1 else 1000.0)
+    else:
+        rate = float(args[1]) if len(args) > 1 else 100.0
+        sim = simulate([SimulatedGlove("L", rate, RandomWalkMotion()), SimulatedGlove("R", rate)],
+                       useSocket=len(args) > 0 and args[0] == "socket")
+        for c in sim.getCounts():
+            print("{} glove on {}".format(c["side"], c["port"]))
+        input("Press Enter to stop")
+        sim.close()
+        print(sim.getCounts())
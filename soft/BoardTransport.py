@@ -0,0 +1,163 @@
+"""
+asyncio based board I/O. One event loop can serve any number of boards, each connection decodes
+its own byte stream and is read with `async for side, t, rpy, cons, quats in connection`, the same
+tuples BoardInteractor puts in its sampleQueue.
+
+Serial ports (and ptys, which pyserial opens like any other port) go through pyserial-asyncio,
+plain sockets are there so tests and simulators don't need any hardware.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+from EventBus import pub
+
+import PacketDecoder
+from PacketDecoder import Fingers
+
+
+def encodeHapticCommand(hapticState):
+    """
+    hapticState is the 10 long list of motor states from BoardInteractor (see HapticMotors).
+    Returns a 2 byte little endian bitmask, bit i set if motor i is on.
+    """
+    mask = 0
+    for i, on in enumerate(hapticState):
+        if on:
+            mask |= 1 << i
+    return mask.to_bytes(2, 'little')
+
+
+def frameBatch(frames, t, side, boardTime=None):
+    """
+    The (side, t, rpy, cons, quats) tuple for frames that arrived together, the newest of them
+    made at time t. The others get their own times spread back from it (see PacketDecoder.frameTimes)
+    """
+    rpy = PacketDecoder.normalizeGyro(PacketDecoder.frameYPR(frames))
+    cons = PacketDecoder.fingerConnections(frames['routes'], side=side)
+    quats = PacketDecoder.frameQuaternions(frames)
+    return side, PacketDecoder.frameTimes(t, len(frames), boardTime), rpy, cons, quats
+
+
+class BoardProtocol(asyncio.Protocol):
+    def __init__(self, side=None):
+        # side None means take it from the frames, otherwise it overrides what the board says
+        self.fixedSide = side
+        self.side = side
+        self.transport = None
+        self._decoder = PacketDecoder.PacketDecoder()
+        self._queue = asyncio.Queue()
+        self.framesReceived = 0
+        # a SessionRecording.SessionRecorder or SessionArchive.SessionArchiveWriter to save every frame to
+        self.recorder = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        t = time.time()
+        self._decoder.feed(data)
+        frames = self._decoder.decode(hostTime=t)
+        if len(frames) == 0:
+            return
+
+        self.framesReceived += len(frames)
+        if self.recorder is not None:
+            self.recorder.write(frames, t, self._decoder.sequence, self._decoder.boardTime)
+        if self.fixedSide is None:
+            self.side = PacketDecoder.frameSide(frames[-1])
+        self._queue.put_nowait(frameBatch(frames, self._decoder.newestFrameTime(t), self.side,
+                                           self._decoder.boardTime))
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            print("Board connection lost: {}".format(exc))
+        self._queue.put_nowait(None)
+
+    def getFrameCounts(self):
+        counts = {"received": self.framesReceived}
+        counts.update(self._decoder.getCounts())
+        return counts
+
+
+class BoardConnection:
+    """
+    Async iterator over decoded sample batches from one board, plus the way back for haptic commands
+    """
+
+    def __init__(self, transport, protocol):
+        self.transport = transport
+        self.protocol = protocol
+
+        # what was last published for each side, a replay can interleave both gloves on one connection
+        self._rpy_old = dict()
+        self._connections_old = dict()
+
+    @property
+    def side(self):
+        # None until the first frame arrives if the side is read from the stream
+        return self.protocol.side
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        batch = await self.protocol._queue.get()
+        if batch is None:
+            raise StopAsyncIteration
+        return batch
+
+    def sendHaptic(self, hapticState):
+        if not self.transport.is_closing():
+            self.transport.write(encodeHapticCommand(hapticState))
+
+    def close(self):
+        self.transport.close()
+
+    async def publish(self):
+        """
+        Pumps this board's samples into pubsub until the connection closes. Sends the batch
+        topic and the usual latest value / finger messages, so existing subscribers keep working.
+        """
+        async for side, t, rpy, cons, quats in self:
+            made = t[-1]
+            pub.publishAt(made, side + 'GyroBatch', t, rpy, cons, quats)
+
+            # only the final state of each finger in the batch is sent, same as BoardInteractor. A
+            # batch only has its own side's fingers, so it's compared with that side's last batch
+            consOld = self._connections_old.setdefault(side, np.zeros(16, dtype=bool))
+            for i in np.flatnonzero(cons[-1] != consOld):
+                consOld[i] = cons[-1, i]
+                pub.publishAt(made, 'FingerConnection', bool(cons[-1, i]), Fingers(i).name)
+
+            roll, pitch, yaw = rpy[-1]
+            rollOld, pitchOld, yawOld = self._rpy_old.get(side, (None, None, None))
+            if roll != rollOld or pitch != pitchOld or yaw != yawOld:
+                pub.publishAt(made, side + 'Gyro', roll, pitch, yaw,
+                              roll != rollOld, pitch != pitchOld, yaw != yawOld)
+                pub.publishAt(made, side + 'Quat', quats[-1])
+                self._rpy_old[side] = (roll, pitch, yaw)
+
+
+async def openSerialBoard(port, baudrate=115200, side=None):
+    # pyserial-asyncio is only needed for real serial ports
+    import serial_asyncio
+
+    loop = asyncio.get_running_loop()
+    transport, protocol = await serial_asyncio.create_serial_connection(
+        loop, lambda: BoardProtocol(side), port, baudrate=baudrate)
+    return BoardConnection(transport, protocol)
+
+
+async def openSocketBoard(host, port, side=None):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_connection(lambda: BoardProtocol(side), host, port)
+    return BoardConnection(transport, protocol)
+
+
+async def runBoards(connections):
+    """
+    Publishes samples from all the given connections on the current loop until they all close
+    """
+    await asyncio.gather(*[c.publish() for c in connections])
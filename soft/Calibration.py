@@ -0,0 +1,351 @@
+"""
+Calibrated glove orientation in one NumPy step.
+
+CalibrationDialog fits a FastICA model and per axis interp1d ranges, going through those for every
+sample costs sklearn's input validation and three scipy calls. CalibrationTransform holds the same
+calibration as plain arrays: the offset to subtract, a 3x3 unmixing matrix and piecewise linear
+breakpoints, with the axis permutation and flips already folded into them. apply takes a single
+roll, pitch, yaw or an (n, 3) batch.
+
+CalibrationProfiles keeps the transforms on disk, one small npz per glove and side, so a
+calibrated glove can be used again in the next session without calibrating or loading sklearn.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from Orientation import nearestTurns
+
+
+class CalibrationTransform:
+    def __init__(self, offset, unmixing, breakpoints, values, center=None, reference=None):
+        """
+        offset (3,) and unmixing (3, 3) take a raw sample to one coordinate per output axis,
+        breakpoints and values (3, k) are the piecewise linear map of each coordinate, breakpoints
+        ascending. Coordinates outside the breakpoints get the end values.
+        If center (3,) is given, samples are first moved by whole turns to within half a turn of it,
+        see Orientation.nearestTurns. Without it the IMU's wraps go straight into the transform.
+        reference (4,) is the pose quaternion of a calibration made on Orientation.poseAngles instead
+        of the board's angles, the samples it takes are measured from it.
+        """
+        self.center = None if center is None else np.array(center, dtype=float)
+        self.reference = None if reference is None else np.array(reference, dtype=float)
+        self.offset = np.array(offset, dtype=float)
+        self.unmixing = np.array(unmixing, dtype=float)
+        self.breakpoints = np.array(breakpoints, dtype=float)
+        self.values = np.array(values, dtype=float)
+
+        self._unmixingT = np.ascontiguousarray(self.unmixing.T)
+        self._precompute()
+
+    def _precompute(self):
+        self._starts = self.breakpoints[:, :-1]
+        self._widths = np.diff(self.breakpoints, axis=1)
+        rises = np.diff(self.values, axis=1)
+        self._slopes = np.divide(rises, self._widths, out=np.zeros_like(rises), where=self._widths > 0)
+        self._first = self.values[:, 0]
+
+    def copy(self):
+        return CalibrationTransform(self.offset, self.unmixing, self.breakpoints, self.values, self.center,
+                                    self.reference)
+
+    def setBreakpoints(self, breakpoints):
+        self.breakpoints[:] = breakpoints
+        self._precompute()
+
+    def nearest(self, rpy):
+        if self.center is None:
+            return np.asarray(rpy, dtype=float)
+        return nearestTurns(rpy, self.center)
+
+    def coordinates(self, rpy):
+        return (self.nearest(rpy) - self.offset) @ self._unmixingT
+
+    def apply(self, rpy):
+        """
+        rpy is a raw (roll, pitch, yaw) or an (n, 3) array of them, returns calibrated values
+        of the same shape
+        """
+        return self.applyCoordinates(self.coordinates(rpy))
+
+    def applyCoordinates(self, t):
+        # the start value plus how far t got into each segment times that segment's slope
+        d = np.minimum(np.maximum(t[..., None] - self._starts, 0.0), self._widths)
+        return self._first + np.sum(d * self._slopes, axis=-1)
+
+
+class OnlineRecalibrator:
+    """
+    Follows the slow drift of a calibrated glove during a performance. apply is a drop in for
+    CalibrationTransform.apply on single samples and batches, it updates running statistics with every sample
+    and nudges a copy of the calibration to match, at a fixed cost per sample.
+
+    The statistics forget old samples exponentially, halfLife is in samples:
+        rest        running mean of the raw samples taken while the hand is still and within
+                    restRadius of the calibrated rest pose. How far it is from the rest pose of the
+                    original calibration is taken as drift and added to the offset. A pose held
+                    anywhere else doesn't count, so holding it doesn't pull the calibration along
+        variance    running variance of each calibrated coordinate, samples further than
+                    outlierSigma from the running mean don't count towards the ranges
+        envelopes   the lowest and highest coordinate seen, they widen right away and relax back to
+                    the calibrated range with envelopeHalfLife
+    The hand counts as still while its samples stay within stillRadius of their mean over the last
+    stillHalfLife samples. Both radii are fractions of each coordinate's calibrated range.
+    The calibration moves towards these by at most maxStep per sample (in raw units for the offset,
+    coordinate units for the ranges), so outputs glide instead of jumping. To keep the per sample
+    cost down the moves are made every ADJUST_EVERY samples.
+
+    Not thread safe, to start over from another thread replace the recalibrator instead of calling
+    reset.
+    """
+
+    ADJUST_EVERY = 16
+
+    def __init__(self, transform, halfLife=30000, envelopeHalfLife=120000, warmup=1000, outlierSigma=4.0,
+                 maxStep=1e-5, restRadius=0.1, stillRadius=0.02, stillHalfLife=100):
+        self.base = transform
+        self.transform = transform.copy()
+        self.warmup = warmup
+        self.outlierSigma = outlierSigma
+        self.maxStep = maxStep
+        self.setForgetting(halfLife, envelopeHalfLife, stillHalfLife)
+
+        span = np.maximum(transform.breakpoints[:, -1] - transform.breakpoints[:, 0], 1e-9)
+        self.restRadius = restRadius * span
+        self.stillRadius = stillRadius * span
+        # the rest pose is the middle breakpoint, the raw sample the original calibration maps onto it
+        self.restCoord = transform.breakpoints[:, 1].copy()
+        self._mixingT = np.linalg.pinv(transform._unmixingT)
+        self.restRaw = transform.offset + self.restCoord @ self._mixingT
+        self.reset()
+
+    def setForgetting(self, halfLife, envelopeHalfLife, stillHalfLife=100):
+        self.alpha = 1.0 - 0.5 ** (1.0 / halfLife)
+        self.envelopeAlpha = 1.0 - 0.5 ** (1.0 / envelopeHalfLife)
+        self.stillAlpha = 1.0 - 0.5 ** (1.0 / stillHalfLife)
+
+    def reset(self):
+        """
+        Back to the original calibration, the statistics start over
+        """
+        self.transform = self.base.copy()
+        self.count = 0
+        self.restCount = 0
+        self.rest = self.restRaw.copy()
+        self.recent = None
+        self.coordMean = np.zeros(3)
+        self.coordVar = np.zeros(3)
+        self.lo = self.base.breakpoints[:, 0].copy()
+        self.hi = self.base.breakpoints[:, -1].copy()
+
+    def update(self, rpy):
+        """
+        Adds a raw sample to the statistics, returns its coordinates under the current calibration
+        """
+        x = self.transform.nearest(rpy)
+        t = (x - self.transform.offset) @ self.transform._unmixingT
+        self.count += 1
+        # a plain mean until warmup, there's no history worth forgetting yet
+        a = max(self.alpha, 1.0 / self.count)
+        d = t - self.coordMean
+        self.coordMean += a * d
+        self.coordVar = (1.0 - a) * (self.coordVar + a * d * d)
+
+        if self.recent is None:
+            self.recent = t.copy()
+        still = np.all(np.abs(t - self.recent) <= self.stillRadius)
+        self.recent += self.stillAlpha * (t - self.recent)
+        if still and np.all(np.abs(t - self.restCoord) <= self.restRadius):
+            self.restCount += 1
+            self.rest += max(self.alpha, 1.0 / self.restCount) * (x - self.rest)
+
+        if self.count < self.warmup:
+            return t
+
+        # outliers are swapped for the running mean, which doesn't move the envelope
+        inlier = np.where(np.abs(d) <= self.outlierSigma * np.sqrt(self.coordVar), t, self.coordMean)
+        self.lo = np.minimum(self.lo, inlier)
+        self.hi = np.maximum(self.hi, inlier)
+
+        if self.count % self.ADJUST_EVERY == 0:
+            self._adjust()
+        return t
+
+    def _adjust(self):
+        n = self.ADJUST_EVERY
+        self.lo += (1.0 - (1.0 - self.envelopeAlpha) ** n) * (self.base.breakpoints[:, 0] - self.lo)
+        self.hi += (1.0 - (1.0 - self.envelopeAlpha) ** n) * (self.base.breakpoints[:, -1] - self.hi)
+
+        step = self.maxStep * n
+        if self.restCount >= self.warmup:
+            offsetTarget = self.base.offset + (self.rest - self.restRaw)
+            self.transform.offset += np.minimum(np.maximum(offsetTarget - self.transform.offset, -step), step)
+        bp = self.transform.breakpoints
+        loStep = np.minimum(np.maximum(self.lo - bp[:, 0], -step), step)
+        hiStep = np.minimum(np.maximum(self.hi - bp[:, -1], -step), step)
+        if loStep.any() or hiStep.any():
+            bp = bp.copy()
+            bp[:, 0] = np.minimum(bp[:, 0] + loStep, bp[:, 1])
+            bp[:, -1] = np.maximum(bp[:, -1] + hiStep, bp[:, -2])
+            self.transform.setBreakpoints(bp)
+
+    def apply(self, rpy):
+        rpy = np.asarray(rpy, dtype=float)
+        if rpy.ndim == 2:
+            # the statistics follow the samples in order, a batch is taken one at a time
+            return np.array([self.apply(r) for r in rpy]).reshape(rpy.shape)
+        return self.transform.applyCoordinates(self.update(rpy))
+
+    def drift(self):
+        """
+        How far the offset has moved from the original calibration, in raw units
+        """
+        return self.transform.offset - self.base.offset
+
+
+def fromUnmixing(offset, unmixing, axisranges, axes, center=None):
+    """
+    Builds the transform from a fitted calibration: coordinates are (x - offset) @ unmixing.T,
+    axisranges (3, 3) is the [min, 0, max] range of each coordinate (swapped if flipped), axes
+    which coordinate is roll, pitch and yaw and center the raw center the samples were taken around
+    """
+    axes = np.asarray(axes)
+    breakpoints = np.empty((3, 3))
+    values = np.empty((3, 3))
+    for out, a in enumerate(axes):
+        # interp1d sorts its points, so a flipped range just runs from 1 down to 0, and its
+        # fill values are the same as holding the end values
+        order = np.argsort(axisranges[a, :])
+        breakpoints[out] = axisranges[a, order]
+        values[out] = np.array([0.0, 0.5, 1.0])[order]
+
+    return CalibrationTransform(offset, np.asarray(unmixing)[axes], breakpoints, values, center)
+
+
+def fromICA(center, ica, axisranges, axisflip, axes):
+    """
+    Builds the transform from what CalibrationDialog used to fit: the center sample, the fitted
+    FastICA, the ranges, the flips (already applied to axisranges) and the axes
+    """
+    # FastICA.transform is (x - mean_) @ components_.T
+    return fromUnmixing(np.asarray(center, dtype=float) + ica.mean_, ica.components_, axisranges, axes)
+
+
+class CalibrationProfiles:
+    """
+    Calibration profiles in directory, stored as <glove>_<side>.npz. A profile saved with a
+    different PROFILE_VERSION is ignored, the glove just needs calibrating again.
+    """
+
+    PROFILE_VERSION = 1
+
+    def __init__(self, directory="./calibrations"):
+        self.directory = directory
+
+    def path(self, glove, side):
+        # the glove name is typed in by the user, keep it to one plain file name
+        glove = "".join(c if c.isalnum() or c in "-_" else "_" for c in glove)
+        return os.path.join(self.directory, "{}_{}.npz".format(glove, side))
+
+    def save(self, transform, glove, side):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(glove, side)
+        # written next to the old profile and moved over it, so a crash never leaves half a file
+        tmp = path + ".tmp.npz"
+        arrays = dict(offset=transform.offset, unmixing=transform.unmixing, breakpoints=transform.breakpoints,
+                      values=transform.values)
+        if transform.center is not None:
+            arrays["center"] = transform.center
+        if transform.reference is not None:
+            arrays["reference"] = transform.reference
+        np.savez(tmp, version=self.PROFILE_VERSION, savedAt=time.time(), **arrays)
+        os.replace(tmp, path)
+
+    def load(self, glove, side):
+        """
+        Returns the saved CalibrationTransform, or None if there's no usable profile
+        """
+        path = self.path(glove, side)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path) as dat:
+                if int(dat["version"]) != self.PROFILE_VERSION:
+                    print("Ignoring calibration profile {}, version {} isn't {}".format(
+                        path, int(dat["version"]), self.PROFILE_VERSION))
+                    return None
+                # profiles saved before wraparound handling have no center
+                center = dat["center"] if "center" in dat.files else None
+                reference = dat["reference"] if "reference" in dat.files else None
+                return CalibrationTransform(dat["offset"], dat["unmixing"], dat["breakpoints"], dat["values"], center,
+                                            reference)
+        except (OSError, KeyError, ValueError) as e:
+            print("Couldn't load calibration profile {}: {}".format(path, e))
+            return None
+
+
+def benchmark(numSamples=5000):
+    """
+    Time per sample of the old per sample FastICA + interp1d path against CalibrationTransform,
+    calibrated on made up data like CalibrationDialog's DEBUG_MODE. Also returns the largest
+    difference between the two.
+    """
+    from scipy.interpolate import interp1d
+    from sklearn.decomposition import FastICA
+
+    rng = np.random.default_rng(0)
+    center = np.array([0.5, 0.5, 0.5])
+    mixing = np.eye(3) + 0.1 * rng.standard_normal((3, 3))
+    samples = rng.uniform(-0.3, 0.3, (300, 3)) @ mixing.T
+
+    ica = FastICA(random_state=0)
+    coords = ica.fit_transform(samples)
+    axes = np.argmax(np.abs(ica.transform(np.eye(3))), axis=1)
+    axisranges = np.zeros((3, 3))
+    axisranges[:, 0] = np.min(coords, axis=0)
+    axisranges[:, 2] = np.max(coords, axis=0)
+    axisflip = [False, True, False]
+    axisranges[1, [0, 2]] = axisranges[1, [2, 0]]
+    interps = [interp1d(axisranges[i, :], [0.0, 0.5, 1.0], bounds_error=False,
+                        fill_value=(1.0, 0.0) if axisflip[i] else (0.0, 1.0)) for i in range(3)]
+
+    transform = fromICA(center, ica, axisranges, axisflip, axes)
+    rpy = center + rng.uniform(-0.4, 0.4, (numSamples, 3)) @ mixing.T
+
+    ret = dict()
+    old = np.empty((numSamples, 3))
+    t0 = time.perf_counter()
+    for i in range(numSamples):
+        t = ica.transform((rpy[i] - center).reshape((1, -1)))[0, :]
+        v = np.empty((3,))
+        v[0] = interps[0](t[0])
+        v[1] = interps[1](t[1])
+        v[2] = interps[2](t[2])
+        old[i] = v[axes]
+    ret["ica+interp1d"] = (time.perf_counter() - t0) / numSamples
+
+    new = np.empty((numSamples, 3))
+    t0 = time.perf_counter()
+    for i in range(numSamples):
+        new[i] = transform.apply(rpy[i])
+    ret["apply"] = (time.perf_counter() - t0) / numSamples
+
+    t0 = time.perf_counter()
+    batch = transform.apply(rpy)
+    ret["apply batch"] = (time.perf_counter() - t0) / numSamples
+
+    ret["max difference"] = max(np.max(np.abs(new - old)), np.max(np.abs(batch - old)))
+    return ret
+
+
+if __name__ == "__main__":
+    res = benchmark()
+    diff = res.pop("max difference")
+    for name, t in res.items():
+        print("{}: {:.2f} us/sample".format(name, t * 1e6))
+    print("speedup: {:.0f}x per sample, {:.0f}x batched".format(
+        res["ica+interp1d"] / res["apply"], res["ica+interp1d"] / res["apply batch"]))
+    print("max difference: {:.2e}".format(diff))
@@ -0,0 +1,204 @@
+"""
+Fits a glove calibration from the samples CalibrationDialog records, within a time budget.
+
+Both methods find an unmixing matrix that turns the centered samples into one coordinate per
+glove axis, then the captured axis end points decide which coordinate is roll, pitch and yaw and
+which way round each one goes. The fit quality is how much of the end point movement lands on
+the other coordinates (offAxis, 0 is a perfect fit).
+
+    METHOD_CLOSED_FORM  whitens the samples and rotates them so the end points line up with the
+                        axes. One eigendecomposition and one SVD, deterministic and instant.
+    METHOD_ICA          FastICA with several seeds run in parallel in a process pool, the best
+                        fit wins. Stops at the first good fit, when the time budget runs out or
+                        when asked to, and falls back to the closed form fit if no seed beats it.
+
+sklearn is only imported by the ICA workers.
+"""
+
+import concurrent.futures
+import multiprocessing
+import time
+
+import numpy as np
+
+import Calibration
+import ThreadExtension
+from Orientation import circularMean, nearestTurns
+
+METHOD_CLOSED_FORM = "Closed form"
+METHOD_ICA = "ICA"
+METHODS = [METHOD_CLOSED_FORM, METHOD_ICA]
+
+# offAxis below this is good enough to stop looking
+GOOD_FIT = 0.01
+
+
+class CalibrationFit:
+    def __init__(self, samples, ends, center, mean, unmixing, method, seed=None):
+        """
+        samples (n, 3) and ends (3, 3, one end point per axis) are relative to center,
+        coordinates are (x - mean) @ unmixing.T
+        """
+        self.center = center
+        self.mean = mean
+        self.unmixing = unmixing
+        self.method = method
+        self.seed = seed
+
+        self.coords = (samples - mean) @ unmixing.T
+        self.endcoords = (ends - mean) @ unmixing.T
+        self.axes = np.argmax(np.abs(self.endcoords), axis=1)
+
+        mags = np.abs(self.endcoords)
+        onAxis = np.sum(mags[np.arange(3), self.axes])
+        self.offAxis = (np.sum(mags) - onAxis) / max(np.sum(mags), 1e-12)
+        # two end points on the same coordinate leave an axis with nothing driving it
+        self.valid = len(set(self.axes.tolist())) == 3
+
+        self.axisranges = np.zeros((3, 3))
+        self.axisranges[:, 0] = np.min(self.coords, axis=0)
+        self.axisranges[:, 2] = np.max(self.coords, axis=0)
+        self.axisflip = [False] * 3
+        for i in range(3):
+            a = self.axes[i]
+            if self.endcoords[i, a] > 0:
+                self.axisranges[a, [0, 2]] = self.axisranges[a, [2, 0]]
+                self.axisflip[a] = True
+
+    def betterThan(self, other):
+        if other is None or self.valid != other.valid:
+            return other is None or self.valid
+        return self.offAxis < other.offAxis
+
+    def isGood(self):
+        return self.valid and self.offAxis < GOOD_FIT
+
+    def transform(self):
+        return Calibration.fromUnmixing(self.center + self.mean, self.unmixing, self.axisranges, self.axes,
+                                        center=self.center)
+
+    def describe(self):
+        s = "{}{}: {:.1f}% off axis".format(self.method, "" if self.seed is None else " seed {}".format(self.seed),
+                                            self.offAxis * 100)
+        if not self.valid:
+            s += ", axes not separated"
+        return s
+
+
+def closedFormFit(samples, ends, center):
+    mean = np.mean(samples, axis=0)
+    # whitening makes the sample cloud unit variance in every direction
+    l, v = np.linalg.eigh(np.cov(samples - mean, rowvar=False))
+    whitening = (v / np.sqrt(np.maximum(l, 1e-12))).T
+
+    # orthogonal Procrustes, the rotation taking the whitened end point directions closest to the axes
+    z = (ends - mean) @ whitening.T
+    z = z / np.maximum(np.linalg.norm(z, axis=1, keepdims=True), 1e-12)
+    u, s, vt = np.linalg.svd(z.T)
+    rotation = u @ vt
+
+    return CalibrationFit(samples, ends, center, mean, rotation.T @ whitening, METHOD_CLOSED_FORM)
+
+
+def _fitICA(samples, seed, maxIter):
+    # runs in a worker process, only plain arrays go back
+    from sklearn.decomposition import FastICA
+
+    ica = FastICA(random_state=seed, max_iter=maxIter)
+    ica.fit(samples)
+    return ica.mean_, ica.components_
+
+
+def solve(samples, ends, center, method=METHOD_CLOSED_FORM, timeBudget=5.0, maxSeeds=8, maxIter=400,
+          workers=None, progress=None, shouldStop=None):
+    """
+    Returns the best CalibrationFit found. progress(done, total, best) is called as fits finish,
+    shouldStop() is polled and ends the search early with the best fit so far.
+    """
+    best = closedFormFit(samples, ends, center)
+    if progress is not None:
+        progress(1, 1 if method == METHOD_CLOSED_FORM else maxSeeds + 1, best)
+    if method == METHOD_CLOSED_FORM or best.isGood():
+        return best
+
+    deadline = time.time() + timeBudget
+    # solve runs on a QThread next to the board readers and the MIDI thread, forking that process
+    # can leave a worker holding a copy of a lock some other thread had, so the workers start fresh
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = {executor.submit(_fitICA, samples, seed, maxIter): seed for seed in range(maxSeeds)}
+        done = 1
+        while len(pending) > 0 and time.time() < deadline and not best.isGood():
+            if shouldStop is not None and shouldStop():
+                break
+            finished, _ = concurrent.futures.wait(pending, timeout=min(0.1, max(0, deadline - time.time())),
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in finished:
+                seed = pending.pop(f)
+                done += 1
+                try:
+                    mean, unmixing = f.result()
+                except Exception as e:
+                    print("ICA seed {} failed: {}".format(seed, e))
+                    continue
+                fit = CalibrationFit(samples, ends, center, mean, unmixing, METHOD_ICA, seed)
+                if fit.betterThan(best):
+                    best = fit
+            if progress is not None and len(finished) > 0:
+                progress(done, maxSeeds + 1, best)
+    finally:
+        # seeds still running finish on their own, bounded by maxIter, nothing waits for them
+        executor.shutdown(wait=False, cancel_futures=True)
+    return best
+
+
+class SolverThread(ThreadExtension.StoppableThread):
+    """
+    Runs solve off the GUI thread. The callbacks are called from this thread, emit a signal from
+    them to get back to Qt. onDone(fit) is called once unless the thread was stopped first.
+    """
+
+    def __init__(self, samples, ends, center, method, onProgress=None, onDone=None, **kwargs):
+        super().__init__()
+        self.args = (samples, ends, center)
+        self.method = method
+        self.onProgress = onProgress
+        self.onDone = onDone
+        self.kwargs = kwargs
+
+    def run(self):
+        fit = solve(*self.args, method=self.method, progress=self.onProgress, shouldStop=self.req_stop,
+                    **self.kwargs)
+        if not self.req_stop() and self.onDone is not None:
+            self.onDone(fit)
+
+
+if __name__ == "__main__":
+    # fits the last calibration CalibrationDialog saved with both methods, or a window of a session
+    # archive: python CalibrationSolver.py session.arc L|R [start s] [length s]
+    import sys
+
+    if len(sys.argv) > 2:
+        from SessionArchive import SessionArchive
+
+        a = SessionArchive(sys.argv[1])
+        start, end = a.timeRange()
+        t0 = start + (float(sys.argv[3]) if len(sys.argv) > 3 else 0)
+        t1 = t0 + float(sys.argv[4]) if len(sys.argv) > 4 else end
+        rpy = a.sideWindow(sys.argv[2], t0, t1)['rpy'].astype(float)
+        # every 4th sample of a 100 Hz board is about the 25 ms CalibrationDialog samples at
+        dat = {'samples': rpy[::4].T, 'centers': rpy[:1].T}
+    else:
+        dat = np.load("./calibSample.npz")
+    center = circularMean(dat['centers'], axis=1)
+    samples = nearestTurns(dat['samples'].T, center) - center
+    if 'ends' in dat:
+        ends = nearestTurns(dat['ends'], center) - center
+    else:
+        # older sample files have no end points, the extremes along each raw axis stand in for them
+        ends = np.array([samples[np.argmin(samples[:, i])] for i in range(3)])
+    for method in METHODS:
+        t0 = time.perf_counter()
+        fit = solve(samples, ends, center, method=method)
+        print("{} in {:.3f} s, axes {}".format(fit.describe(), time.perf_counter() - t0, fit.axes))
@@ -1,6 +1,7 @@
 import numpy as np
 from PyQt5.QtWidgets import QLabel
 from MIDI import MIDIMapping
+from RateLimiter import RateLimiter
 import live
 
 
@@ -84,9 +85,16 @@ class C1(MIDIMapping):
     right hand does midi ccs
     """
 
+    # seconds between updates of one track's volume or pan, Live is slow to take them over OSC
+    LIVE_INTERVAL = 0.05
+
     def __init__(self, midiport):
         super().__init__(midiport)
 
+        # keyed by (track, "volume" or "pan"), the last value of a gesture always reaches Live
+        self.liveLimiter = RateLimiter(self.sendLive, interval=self.LIVE_INTERVAL)
+        self.limiters.append(self.liveLimiter)
+
         self.l_roll_ccnum = 1
         self.r_roll_ccnum = 22
         self.r_pitch_ccnum = 23
@@ -116,12 +124,12 @@ class C1(MIDIMapping):
     def initControls(self):
         def makeVolumeControlFunc(i):
             def f(v):
-                self.liveset.tracks[i].volume = v
+                self.liveLimiter.submit((i, "volume"), v)
             return f
 
         def makePanControlFunc(i):
             def f(v):
-                self.liveset.tracks[i].pan = v
+                self.liveLimiter.submit((i, "pan"), v)
             return f
 
         def makeCCFunc(chan, cc):
@@ -139,6 +147,10 @@ class C1(MIDIMapping):
             self.leftHandControls.append(lc)
             self.rightHandControls.append(rc)
 
+    def sendLive(self, key, v):
+        track, param = key
+        setattr(self.liveset.tracks[track], param, v)
+
     def initUI(self):
         self.widget = QLabel("Hi!")
 
@@ -1,117 +1,118 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QSpinBox, QComboBox, QSizePolicy, QPushButton
 from PyQt5.QtGui import QPixmap, QPainter, QBrush, QColor, QPen
-from PyQt5.QtCore import QRect, Qt, QSize
+from PyQt5.QtCore import QLineF, Qt, QSize
 from rtmidi.midiconstants import NOTE_OFF, NOTE_ON, CONTROL_CHANGE, PITCH_BEND
 import numpy as np
-from scipy.interpolate import interp1d
 
 from MIDI import MIDIMapping
 
 
+class DragBank:
+    """
+    State of a bank of drag controls, one row per control and one column per axis (roll, pitch,
+    yaw). An active control moves by the hand's change in angle, clamped to 0-1, and outputs that
+    scaled to its range. Plain arrays, so a frame updates every control in one step whatever the
+    bank size, and nothing here touches widgets.
+    """
+
+    def __init__(self, n, channels=1, ccstart=32):
+        """
+        Controls get 3 consecutive cc numbers each from ccstart, and run on to the next channel
+        (from channel 1) when a channel's numbers are used up
+        """
+        self.n = n
+        self.values = np.zeros((n, 3))
+        self.outLo = np.zeros((n, 3))
+        self.outHi = np.ones((n, 3))
+        self.enabled = np.ones((n, 3), dtype=bool)
+        self.active = {"L": np.zeros(n, dtype=bool), "R": np.zeros(n, dtype=bool)}
+
+        perChannel = (120 - ccstart) // 3
+        if n > perChannel * channels:
+            raise Exception("{} drag controls don't fit on {} channels".format(n, channels))
+        i = np.arange(n)
+        self.channel = 1 + i // perChannel
+        self.cc = ccstart + 3 * (i % perChannel)[:, None] + np.arange(3)
+
+        # controls moved since the widgets last looked, see takeDirty
+        self.dirty = np.zeros(n, dtype=bool)
+
+    def update(self, side, diffs):
+        """
+        Moves the controls active on side by diffs (3,), returns (controls, axes, outputs) of the
+        enabled outputs that changed
+        """
+        rows = np.flatnonzero(self.active[side])
+        if len(rows) == 0:
+            return rows, rows, np.empty(0)
+        old = self.values[rows]
+        new = np.minimum(np.maximum(old + diffs, 0.0), 1.0)
+        self.values[rows] = new
+        moved = new != old
+        self.dirty[rows[moved.any(axis=1)]] = True
+
+        r, a = np.nonzero(moved & self.enabled[rows])
+        controls = rows[r]
+        outputs = self.outLo[controls, a] + new[r, a] * (self.outHi[controls, a] - self.outLo[controls, a])
+        return controls, a, outputs
+
+    def takeDirty(self):
+        """
+        Indices of the controls moved since the last call
+        """
+        d = np.flatnonzero(self.dirty)
+        self.dirty[d] = False
+        return d
+
+
 class DragControl:
-    def __init__(self, rollF=lambda v: None, rollFRange=(0.0, 1.0),
-                 pitchF=lambda v: None, pitchFRange=(0.0, 1.0),
-                 yawF=lambda v: None, yawFRange=(0.0, 1.0),
-                 updateSignal=None):
-        self.leftActive = False
-        self.rightActive = False
-        self.updateSignal = updateSignal
-
-        self.r_start = 0
-        self.p_start = 0
-        self.y_start = 0
-
-        self.r_fval_start = 0
-        self.r_fval = 0
-        self.r_fval_output = 0
-        self.p_fval_start = 0
-        self.p_fval = 0
-        self.p_fval_output = 0
-        self.y_fval_start = 0
-        self.y_fval = 0
-        self.y_fval_output = 0
-
-        self.rfunc = rollF
-        self.pfunc = pitchF
-        self.yfunc = yawF
-
-        self.rmin = rollFRange[0]
-        self.rmax = rollFRange[1]
-        self.pmin = pitchFRange[0]
-        self.pmax = pitchFRange[1]
-        self.ymin = yawFRange[0]
-        self.ymax = yawFRange[1]
+    """
+    One control of a DragBank and its widget
+    """
 
-        self.rEnabled = True
-        self.pEnabled = True
-        self.yEnabled = True
+    def __init__(self, bank, index, repaints):
+        self.bank = bank
+        self.index = index
+        self.repaints = repaints
 
-        self.widget = DragControlWidget(self, self.updateSignal)
+        self.widget = DragControlWidget(self, self.repaints)
 
     def isLeftActive(self):
-        return self.leftActive
+        return bool(self.bank.active["L"][self.index])
 
     def isRightActive(self):
-        return self.rightActive
+        return bool(self.bank.active["R"][self.index])
 
     def activateControl(self, roll, pitch, yaw, side):
         # expecting these to be in the 0.0-1.0 range
         # print("Activating with params RPY:{},{},{}, {}".format(roll, pitch, yaw, side))
-        if side == "L":
-            self.leftActive = True
-        elif side == "R":
-            self.rightActive = True
-        else:
+        if side not in self.bank.active:
             raise Exception("asdf")
-        # self.r_start = roll
-        # self.p_start = pitch
-        # self.y_start = yaw
+        self.bank.active[side][self.index] = True
 
     def deactivateControl(self, side):
         # print("Deactivating side {}".format(side))
-        if side == "L":
-            self.leftActive = False
-        elif side == "R":
-            self.rightActive = False
-        else:
+        if side not in self.bank.active:
             raise Exception("asdf")
-        # self.r_fval_start = self.r_fval
-        # self.p_fval_start = self.p_fval
-        # self.y_fval_start = self.y_fval
-
-    # incoming diffs are on the 0-1 scale
-    def updateRollValueDiff(self, diff):
-        # print("Control got roll val diff {}".format(diff))
-        self.r_fval = np.interp(self.r_fval + diff, [0.0, 1.0], [0.0, 1.0])
-        self.r_fval_output = np.interp(self.r_fval, [0.0, 1.0], [self.rmin, self.rmax])
-        if self.rEnabled:
-            self.rfunc(self.r_fval_output)
-        self.widget.setZ(self.r_fval)
+        self.bank.active[side][self.index] = False
 
-    def updatePitchValueDiff(self, diff):
-        # print("Control got pitch val diff {}".format(diff))
-        self.p_fval = np.interp(self.p_fval + diff, [0.0, 1.0], [0.0, 1.0])
-        self.p_fval_output = np.interp(self.p_fval, [0.0, 1.0], [self.pmin, self.pmax])
-        if self.pEnabled:
-            self.pfunc(self.p_fval_output)
-        self.widget.setY(self.p_fval)
-
-    def updateYawValueDiff(self, diff):
-        # print("Control got yaw val diff {}".format(diff))
-        self.y_fval = np.interp(self.y_fval + diff, [0.0, 1.0], [0.0, 1.0])
-        self.y_fval_output = np.interp(self.y_fval, [0.0, 1.0], [self.ymin, self.ymax])
-        if self.yEnabled:
-            self.yfunc(self.y_fval_output)
-        self.widget.setX(self.y_fval)
+    def setRange(self, axis, lo, hi):
+        self.bank.outLo[self.index, axis] = lo
+        self.bank.outHi[self.index, axis] = hi
 
     def setREnabled(self, val):
-        self.rEnabled = val
+        self.bank.enabled[self.index, 0] = val
 
     def setPEnabled(self, val):
-        self.pEnabled = val
+        self.bank.enabled[self.index, 1] = val
 
     def setYEnabled(self, val):
-        self.yEnabled = val
+        self.bank.enabled[self.index, 2] = val
+
+    def refreshWidget(self):
+        r, p, y = self.bank.values[self.index].tolist()
+        if self.widget.xyPad.setPosition(y, p, r):
+            self.repaints.markDirty(self.widget.xyPad)
 
 
 class DragControlXYPadWidget(QWidget):
@@ -127,50 +128,56 @@ class DragControlXYPadWidget(QWidget):
         p = 3.14159265358979
         self.a1 = 5.0 / 8.0 * 2.0 * p
         self.a2 = -1.0 / 8.0 * 2.0 * p
-        self.aFromZ = interp1d([0.0, 1.0], [self.a1, self.a2])
 
         self.guiSize = 100
         self.setSizePolicy(QSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed))
 
+        # everything paintEvent needs except the line is fixed, the line is worked out once per change
+        self.origin = self.pad + self.lineLen
+        self.span = self.guiSize - 2 * self.pad - 2 * self.lineLen
+        self.brush = QBrush(QColor('black'), Qt.SolidPattern)
+        self.pen = QPen(QColor('white'))
+        self.pen.setWidth(3)
+        self.line = None
+
     def paintEvent(self, event):
-        # print("painting with {},{},{}".format(self.x, self.y, self.z))
+        if self.line is None:
+            x1 = self.origin + self.span * self.x
+            y1 = self.origin + self.span * self.y
+            a = self.a1 + (self.a2 - self.a1) * self.z
+            self.line = QLineF(x1, y1, x1 + self.lineLen * np.cos(a), y1 - self.lineLen * np.sin(a))
         qp = QPainter(self)
-        brush = QBrush()
-        brush.setColor(QColor('black'))
-        brush.setStyle(Qt.SolidPattern)
-        rect = QRect(0, 0, qp.device().width(), qp.device().height())
-        qp.fillRect(rect, brush)
-
-        pen = QPen()
-        pen.setWidth(3)
-        pen.setColor(QColor('white'))
-        qp.setPen(pen)
-        x1 = self.pad + self.lineLen + (self.guiSize - 2 * self.pad - 2 * self.lineLen) * self.x
-        y1 = self.pad + self.lineLen + (self.guiSize - 2 * self.pad - 2 * self.lineLen) * self.y
-        # a = np.interp(self.z, [0.0, 1.0], [self.a1, self.a2])
-        a = self.aFromZ(self.z)
-        # print("{}->{}".format(self.z, a))
-        x2 = x1 + self.lineLen * np.cos(a)
-        y2 = y1 - self.lineLen * np.sin(a)
-        qp.drawLine(x1, y1, x2, y2)
+        qp.fillRect(self.rect(), self.brush)
+        qp.setPen(self.pen)
+        qp.drawLine(self.line)
 
     def sizeHint(self):
         return QSize(self.guiSize, self.guiSize)
 
+    def setPosition(self, x, y, z):
+        """
+        Returns True if the pad needs repainting
+        """
+        if (x, y, z) == (self.x, self.y, self.z):
+            return False
+        self.x, self.y, self.z = x, y, z
+        self.line = None
+        return True
+
     def setX(self, val):
-        self.x = val
+        return self.setPosition(val, self.y, self.z)
 
     def setY(self, val):
-        self.y = val
+        return self.setPosition(self.x, val, self.z)
 
     def setZ(self, val):
-        self.z = val
+        return self.setPosition(self.x, self.y, val)
 
 
 class DragControlWidget(QWidget):
-    def __init__(self, control, updateSignal):
+    def __init__(self, control, repaints):
         super().__init__()
-        self.updateSignal = updateSignal
+        self.repaints = repaints
 
         self.rEnabled = True
         self.pEnabled = True
@@ -219,8 +226,7 @@ class DragControlWidget(QWidget):
                 'QPushButton {background-color: white; border:  none}')
 
         self._control.setREnabled(self.rEnabled)
-        # self.update()
-        self.updateSignal.emit()
+        self.repaints.markDirty(self)
 
     def togglePEnabled(self):
         self.pEnabled = not self.pEnabled
@@ -232,8 +238,7 @@ class DragControlWidget(QWidget):
                 'QPushButton {background-color: white; border:  none}')
 
         self._control.setPEnabled(self.pEnabled)
-        # self.update()
-        self.updateSignal.emit()
+        self.repaints.markDirty(self)
 
     def toggleYEnabled(self):
         self.yEnabled = not self.yEnabled
@@ -245,26 +250,19 @@ class DragControlWidget(QWidget):
                 'QPushButton {background-color: white; border:  none}')
 
         self._control.setYEnabled(self.yEnabled)
-        # self.update()
-        self.updateSignal.emit()
+        self.repaints.markDirty(self)
 
     def setX(self, val):
-        # print("Widget get val {}".format(val))
-        self.xyPad.setX(val)
-        # self.update()
-        self.updateSignal.emit()
+        if self.xyPad.setX(val):
+            self.repaints.markDirty(self.xyPad)
 
     def setY(self, val):
-        # print("Widget get val {}".format(val))
-        self.xyPad.setY(val)
-        # self.update()
-        self.updateSignal.emit()
+        if self.xyPad.setY(val):
+            self.repaints.markDirty(self.xyPad)
 
     def setZ(self, val):
-        print("Widget got z val {}".format(val))
-        self.xyPad.setZ(val)
-        # self.update()
-        self.updateSignal.emit()
+        if self.xyPad.setZ(val):
+            self.repaints.markDirty(self.xyPad)
 
     def setLeftActive(self, val):
         if val:
@@ -273,8 +271,7 @@ class DragControlWidget(QWidget):
         else:
             self.leftActiveButton.setStyleSheet(
                 'QPushButton {background-color: white; border:  none}')
-        # self.update()
-        self.updateSignal.emit()
+        self.repaints.markDirty(self)
 
     def setRightActive(self, val):
         if val:
@@ -283,8 +280,7 @@ class DragControlWidget(QWidget):
         else:
             self.rightActiveButton.setStyleSheet(
                 'QPushButton {background-color: white; border:  none}')
-        # self.update()
-        self.updateSignal.emit()
+        self.repaints.markDirty(self)
 
 
 class DragMap(MIDIMapping):
@@ -295,17 +291,20 @@ class DragMap(MIDIMapping):
     right hand does midi ccs
     """
 
-    def __init__(self, midiport, updateSignal):
+    CONTROL_NAMES = ["IT", "MT", "RT", "PT", "IP", "MP", "RP", "PP"]
+
+    def __init__(self, midiport, repaints):
         super().__init__(midiport)
         self.ccstart = 32
-        self.updateSignal = updateSignal
+        # RepaintScheduler the control widgets repaint through
+        self.repaints = repaints
+
+        # last (roll, pitch, yaw) of each hand, controls move by the difference to it
+        self.lastValues = {"L": np.zeros(3), "R": np.zeros(3)}
 
-        self.rr_val = 0
-        self.rp_val = 0
-        self.ry_val = 0
-        self.lr_val = 0
-        self.lp_val = 0
-        self.ly_val = 0
+        # output resolution per axis (roll, pitch, yaw) for all controls, see MIDIMapping.RES_CC7
+        self.DRAG_RESOLUTION_OPTIONS = [self.RES_CC7, self.RES_NRPN]
+        self.axisResolution = [self.RES_CC7, self.RES_CC7, self.RES_CC7]
 
         self.initControls()
         self.initWidget()
@@ -314,6 +313,16 @@ class DragMap(MIDIMapping):
     def initWidget(self):
         layout = QVBoxLayout()
 
+        # drag cc numbers are 32 and up, which are LSB numbers, so high resolution is NRPN only
+        l0 = QHBoxLayout()
+        for ai, ax in enumerate(["Roll", "Pitch", "Yaw"]):
+            l0.addWidget(QLabel(ax + ":"))
+            rescb = QComboBox()
+            rescb.addItems([self.RESOLUTION_OPTIONS[r] for r in self.DRAG_RESOLUTION_OPTIONS])
+            rescb.currentIndexChanged.connect(self.makeResolutionFunc(ai))
+            l0.addWidget(rescb)
+        layout.addLayout(l0)
+
         l1 = QHBoxLayout()
         l1.addWidget(self.controlDict["IT"].widget)
         l1.addWidget(self.controlDict["MT"].widget)
@@ -330,80 +339,79 @@ class DragMap(MIDIMapping):
 
         self.widget.setLayout(layout)
 
+    def makeResolutionFunc(self, axis):
+        def f(idx):
+            self.axisResolution[axis] = self.DRAG_RESOLUTION_OPTIONS[idx]
+        return f
+
     def initControls(self):
-        def makeCCFunc(chan, cc):
-            def f(v):
-                self.cc(cc=cc, value=v, channel=chan)
-            return f
-
-        self.controls = []
-        self.controlDict = dict()
-
-        cc = self.ccstart
-        cons = ["IT", "MT", "RT", "PT", "IP", "MP", "RP", "PP"]
-        for ci, c in enumerate(cons):
-            dc = DragControl(rollF=makeCCFunc(1, cc), rollFRange=(0, 127),
-                             pitchF=makeCCFunc(1, cc+1), pitchFRange=(0, 127),
-                             yawF=makeCCFunc(1, cc + 2), yawFRange=(0, 127),
-                             updateSignal=self.updateSignal)
-            cc += 3
-            self.controls.append(dc)
-            self.controlDict[c] = dc
+        self.bank = DragBank(len(self.CONTROL_NAMES), ccstart=self.ccstart)
+        self.controls = [DragControl(self.bank, ci, self.repaints)
+                         for ci in range(self.bank.n)]
+        self.controlDict = dict(zip(self.CONTROL_NAMES, self.controls))
+
+    def valuesChanged(self, side, values, changed):
+        last = self.lastValues[side]
+        changed = np.asarray(changed, dtype=bool)
+        diffs = np.where(changed, np.asarray(values, dtype=float) - last, 0.0)
+        last[changed] = np.asarray(values, dtype=float)[changed]
+
+        bank = self.bank
+        controls, axes, outputs = bank.update(side, diffs)
+        for c, a, v in zip(controls.tolist(), axes.tolist(), outputs.tolist()):
+            self.ccValue(self.axisResolution[a], int(bank.cc[c, a]), v, channel=int(bank.channel[c]))
+
+    def _axisChanged(self, side, axis, val):
+        values = self.lastValues[side].copy()
+        values[axis] = val
+        self.valuesChanged(side, values, [a == axis for a in range(3)])
 
     def rightRollChanged(self, val):
-        d = val - self.rr_val
-        self.rr_val = val
-        for ci, c in enumerate(self.controls):
-            if c.isRightActive():
-                c.updateRollValueDiff(d)
+        self._axisChanged("R", 0, val)
 
     def rightPitchChanged(self, val):
-        d = val - self.rp_val
-        self.rp_val = val
-        for ci, c in enumerate(self.controls):
-            if c.isRightActive():
-                c.updatePitchValueDiff(d)
+        self._axisChanged("R", 1, val)
 
     def rightYawChanged(self, val):
-        d = val - self.ry_val
-        self.ry_val = val
-        for ci, c in enumerate(self.controls):
-            if c.isRightActive():
-                c.updateYawValueDiff(d)
+        self._axisChanged("R", 2, val)
 
     def leftRollChanged(self, val):
-        d = val - self.lr_val
-        self.lr_val = val
-        for ci, c in enumerate(self.controls):
-            if c.isLeftActive():
-                c.updateRollValueDiff(d)
+        self._axisChanged("L", 0, val)
 
     def leftPitchChanged(self, val):
-        d = val - self.lp_val
-        self.lp_val = val
-        for ci, c in enumerate(self.controls):
-            if c.isLeftActive():
-                c.updatePitchValueDiff(d)
+        self._axisChanged("L", 1, val)
 
     def leftYawChanged(self, val):
-        d = val - self.ly_val
-        self.ly_val = val
-        for ci, c in enumerate(self.controls):
-            if c.isLeftActive():
-                c.updateYawValueDiff(d)
+        self._axisChanged("L", 2, val)
+
+    def refreshWidget(self):
+        for ci in self.bank.takeDirty().tolist():
+            self.controls[ci].refreshWidget()
 
     def fingerConnection(self, finger, con):
-        if finger[0] == "R":
-            roll = self.rr_val
-            pitch = self.rp_val
-            yaw = self.ry_val
-        else:
-            roll = self.lr_val
-            pitch = self.lp_val
-            yaw = self.ly_val
+        roll, pitch, yaw = self.lastValues[finger[0]]
 
         print("(de)Activating {} ({}, {}, {}, {})".format(finger[1:], roll, pitch, yaw, finger[0]))
         if con:
             self.controlDict[finger[1:]].activateControl(roll, pitch, yaw, finger[0])
         else:
             self.controlDict[finger[1:]].deactivateControl(finger[0])
+
+
+if __name__ == "__main__":
+    # per frame cost of the bank with every control active, 8 controls like DragMap and 32 over 2 channels
+    import time
+
+    rng = np.random.default_rng(0)
+    diffs = rng.normal(0, 0.002, (10000, 3))
+    for n, channels in [(8, 1), (32, 2)]:
+        bank = DragBank(n, channels=channels)
+        bank.active["R"][:] = True
+        bank.values[:] = 0.5
+        sent = 0
+        t0 = time.perf_counter()
+        for d in diffs:
+            controls, axes, outputs = bank.update("R", d)
+            sent += len(outputs)
+        dt = (time.perf_counter() - t0) / len(diffs)
+        print("{} controls: {:.1f} us per frame, {} outputs".format(n, dt * 1e6, sent))
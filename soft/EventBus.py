@@ -0,0 +1,176 @@
+"""
+Lightweight stand in for pypubsub's pub for the high rate board topics.
+
+Topics and their argument names are registered up front. Listeners are checked against the
+topic's arguments once when they subscribe, after that publish just walks a plain list and calls
+each listener positionally, no kwargs dicts or topic tree lookups per message.
+
+`from EventBus import pub` is a drop in for `from pubsub import pub`: subscribe, unsubscribe and
+sendMessage take the same arguments and the topic names are the same. Unlike pypubsub, listeners
+are held with strong references, so unsubscribe anything that goes away before the bus does.
+"""
+
+import inspect
+import threading
+import time
+
+
+class EventBus:
+    def __init__(self):
+        self._argNames = dict()
+        self._listeners = dict()
+        # publisher threads each have their own source time, see publishAt
+        self._local = threading.local()
+
+    def addTopic(self, topic, argNames):
+        self._argNames[topic] = tuple(argNames)
+        self._listeners.setdefault(topic, [])
+
+    def hasTopic(self, topic):
+        return topic in self._argNames
+
+    def topicArgs(self, topic):
+        return self._argNames[topic]
+
+    def topics(self):
+        return list(self._argNames.keys())
+
+    def subscribe(self, listener, topic):
+        if topic not in self._argNames:
+            raise ValueError("Unknown topic {}".format(topic))
+
+        try:
+            inspect.signature(listener).bind(*self._argNames[topic])
+        except TypeError:
+            raise ValueError("Listener {} can't take arguments {} of topic {}".format(
+                listener, self._argNames[topic], topic))
+
+        if listener not in self._listeners[topic]:
+            # copy on write so a listener can unsubscribe while a message is being sent
+            self._listeners[topic] = self._listeners[topic] + [listener]
+
+    def unsubscribe(self, listener, topic):
+        if listener in self._listeners.get(topic, []):
+            self._listeners[topic] = [l for l in self._listeners[topic] if l != listener]
+
+    def publish(self, topic, *args):
+        """
+        Fast path, args are given positionally in the order the topic was registered with
+        """
+        for l in self._listeners[topic]:
+            l(*args)
+
+    def publishAt(self, t, topic, *args):
+        """
+        publish for a sample made at time.time() t, listeners can ask sourceTime() for it while
+        they're being called. Lets latency be measured from the board instead of from the publish.
+        """
+        self._local.t = t
+        try:
+            self.publish(topic, *args)
+        finally:
+            self._local.t = None
+
+    def sourceTime(self):
+        """
+        t of the publishAt being delivered on this thread, None for a plain publish
+        """
+        return getattr(self._local, 't', None)
+
+    def sendMessage(self, topic, **kwargs):
+        self.publish(topic, *[kwargs[a] for a in self._argNames[topic]])
+
+
+GYRO_ARGS = ("roll", "pitch", "yaw", "rollChanged", "pitchChanged", "yawChanged")
+# quat is a w, x, y, z unit quaternion (one per sample in a batch), see Orientation
+GYRO_BATCH_ARGS = ("t", "rpy", "connections", "quat")
+FINGER_CONNECTION_ARGS = ("con", "finger")
+QUAT_ARGS = ("quat",)
+
+pub = EventBus()
+pub.addTopic('LGyro', GYRO_ARGS)
+pub.addTopic('RGyro', GYRO_ARGS)
+pub.addTopic('LGyroBatch', GYRO_BATCH_ARGS)
+pub.addTopic('RGyroBatch', GYRO_BATCH_ARGS)
+pub.addTopic('FingerConnection', FINGER_CONNECTION_ARGS)
+pub.addTopic('LQuat', QUAT_ARGS)
+pub.addTopic('RQuat', QUAT_ARGS)
+
+
+def topicListener(argNames, f):
+    """
+    Wraps f(*args) in a function with argNames as its signature, so it can subscribe to a topic
+    with those arguments. Used for forwarding messages on without knowing the topic's arguments.
+    """
+    def listener(*args):
+        f(*args)
+    listener.__signature__ = inspect.Signature(
+        [inspect.Parameter(a, inspect.Parameter.POSITIONAL_OR_KEYWORD) for a in argNames])
+    return listener
+
+
+def bridgeToPubsub(topics=None, bus=pub):
+    """
+    Forwards the given topics (default all of them) from bus to pypubsub, for code that still
+    subscribes with pypubsub directly. Returns the forwarders, keep them around to unsubscribe.
+    """
+    from pubsub import pub as pypub
+
+    def makeForwarder(topic):
+        argNames = bus.topicArgs(topic)
+        return topicListener(argNames, lambda *args: pypub.sendMessage(topic, **dict(zip(argNames, args))))
+
+    if topics is None:
+        topics = bus.topics()
+
+    forwarders = dict()
+    for topic in topics:
+        forwarders[topic] = makeForwarder(topic)
+        bus.subscribe(forwarders[topic], topic)
+    return forwarders
+
+
+def benchmark(numMessages=100000, numListeners=3):
+    """
+    Time per LGyro message through this bus and through pypubsub with the same listeners
+    """
+    from pubsub import pub as pypub
+
+    class Listener:
+        def __init__(self):
+            self.count = 0
+
+        def handleGyroData(self, roll, pitch, yaw, rollChanged, pitchChanged, yawChanged):
+            self.count += 1
+
+    listeners = [Listener() for _ in range(numListeners)]
+    bus = EventBus()
+    bus.addTopic('LGyro', GYRO_ARGS)
+    for l in listeners:
+        bus.subscribe(l.handleGyroData, 'LGyro')
+        pypub.subscribe(l.handleGyroData, 'BenchLGyro')
+
+    ret = dict()
+    t0 = time.perf_counter()
+    for i in range(numMessages):
+        pypub.sendMessage('BenchLGyro', roll=0.1, pitch=0.2, yaw=0.3,
+                          rollChanged=True, pitchChanged=False, yawChanged=True)
+    ret["pypubsub"] = (time.perf_counter() - t0) / numMessages
+
+    t0 = time.perf_counter()
+    for i in range(numMessages):
+        bus.sendMessage('LGyro', roll=0.1, pitch=0.2, yaw=0.3,
+                        rollChanged=True, pitchChanged=False, yawChanged=True)
+    ret["sendMessage"] = (time.perf_counter() - t0) / numMessages
+
+    t0 = time.perf_counter()
+    for i in range(numMessages):
+        bus.publish('LGyro', 0.1, 0.2, 0.3, True, False, True)
+    ret["publish"] = (time.perf_counter() - t0) / numMessages
+
+    return ret
+
+
+if __name__ == "__main__":
+    for name, t in benchmark().items():
+        print("{}: {:.2f} us/message, {:.1f}% of a 1 kHz sample period".format(name, t * 1e6, t * 1e5))
@@ -1,6 +1,6 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QSlider, QPushButton, QGridLayout, QButtonGroup, QRadioButton
 from PyQt5.QtCore import Qt, QTimer
-from pubsub import pub
+from EventBus import pub
 import random
 
 
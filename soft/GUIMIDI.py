@@ -1,27 +1,42 @@
 from Drag import DragMap
 from MIDI import M1, ToyMidiMap
 import ThreadExtension
+from SampleHandoff import SampleConsumer, GuiBridge, mergeGyro
+from RateLimiter import RateLimiter
+import SignalConditioning
+from RepaintScheduler import RepaintScheduler
+from MIDIOutput import MIDIOutputEngine
 from RealBoard import RealBoard
 from FakeBoard import FakeBoard
-from scipy.interpolate import interp1d
+import Calibration
+import CalibrationSolver
+import Orientation
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from sklearn.decomposition import FastICA
 from collections import deque
 import numpy as np
 import time
-from pubsub import pub
+from EventBus import pub
 from rtmidi.midiutil import open_midioutput
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal
-from PyQt5.QtWidgets import QWidget, QApplication, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QSpinBox, QSlider, QPushButton, QComboBox, QDialog
+from PyQt5.QtWidgets import QWidget, QApplication, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QSpinBox, QSlider, QPushButton, QComboBox, QDialog, QLineEdit
 import sys
 import matplotlib
 matplotlib.use('Qt5Agg')
 
 
 class CalibrationDialog(QDialog):
-    def __init__(self, side):
+    solverProgress = pyqtSignal(int, int, object)
+    solverDone = pyqtSignal(object)
+
+    def __init__(self, side, bus=pub, reference=None):
+        """
+        With a reference pose quaternion the side's Quat messages are calibrated on, measured from
+        the reference (see Orientation.poseAngles), instead of its Gyro angles
+        """
         super().__init__()
+        self.bus = bus
+        self.reference = reference
         self.showFig = True
         self.saveSampleData = True
         self.DEBUG_MODE = False
@@ -44,6 +59,10 @@ class CalibrationDialog(QDialog):
 
         self.NUM_CENTER_SAMPLES = self.ITERATIONS * 3
 
+        self.SOLVER_TIME_BUDGET = 10.0  # s
+        self.solver = None
+        self.transform = None
+
         self.sampleBuffer = np.empty((3, self.SAMPLES_PER_AXIS * 3))
         self.centerBuffer = np.empty((3, self.NUM_CENTER_SAMPLES))
         self.axisEndBuffer = np.empty((3, 3))
@@ -66,6 +85,9 @@ class CalibrationDialog(QDialog):
             self.axisEndBuffer[:] = 0.5
             self.axisEndBuffer = self.axisEndBuffer - 0.5 * np.eye(3)
 
+        self.solverProgress.connect(self.showSolverProgress)
+        self.solverDone.connect(self.calibrationSolved)
+
         self.initUI()
         self.initBoardComs()
 
@@ -83,19 +105,28 @@ class CalibrationDialog(QDialog):
             self.fig = Figure()
             figwidg = FigureCanvasQTAgg(self.fig)
 
+        solverLayout = QHBoxLayout()
+        solverLayout.addWidget(QLabel("Fit: "))
+        self.solverComboBox = QComboBox()
+        self.solverComboBox.addItems(CalibrationSolver.METHODS)
+        solverLayout.addWidget(self.solverComboBox)
+
         layout = QVBoxLayout()
         layout.addWidget(lbl1)
         layout.addWidget(self.actionLabel)
+        layout.addLayout(solverLayout)
         if self.showFig:
             layout.addWidget(figwidg)
             layout.addWidget(self.doneButton)
         self.setLayout(layout)
 
     def initBoardComs(self):
-        if self.side == "L":
-            pub.subscribe(self.handleGyroData, 'LGyro')
+        if self.reference is not None:
+            self.bus.subscribe(self.handleQuat, self.side + 'Quat')
+        elif self.side == "L":
+            self.bus.subscribe(self.handleGyroData, 'LGyro')
         else:
-            pub.subscribe(self.handleGyroData, 'RGyro')
+            self.bus.subscribe(self.handleGyroData, 'RGyro')
 
     def startCalibration(self):
         # QTimer.singleShot(0, lambda: self.calibrationPhase(0, 0, 0))
@@ -138,10 +169,12 @@ class CalibrationDialog(QDialog):
                           lambda: self.calibrationPhase(iteration, axis, trial+1))
 
     def finishCalibration(self):
-        if self.side == "L":
-            pub.unsubscribe(self.handleGyroData, 'LGyro')
+        if self.reference is not None:
+            self.bus.unsubscribe(self.handleQuat, self.side + 'Quat')
+        elif self.side == "L":
+            self.bus.unsubscribe(self.handleGyroData, 'LGyro')
         else:
-            pub.unsubscribe(self.handleGyroData, 'RGyro')
+            self.bus.unsubscribe(self.handleGyroData, 'RGyro')
 
         self.actionLabel.setText("Calibrating, please wait...")
 
@@ -152,62 +185,63 @@ class CalibrationDialog(QDialog):
 
         if self.saveSampleData:
             fname = "./calibSample.npz"
-            np.savez(fname, samples=self.sampleBuffer, centers=self.centerBuffer)
+            np.savez(fname, samples=self.sampleBuffer, centers=self.centerBuffer, ends=self.axisEndBuffer.T)
 
-        self.center = np.mean(self.centerBuffer, axis=1)
+        # circular, so a glove calibrated where its IMU wraps still gets one continuous sample cloud
+        self.center = Orientation.circularMean(self.centerBuffer, axis=1)
         # print(self.center)
         # print(self.sampleBuffer)
-        self.sampleBuffer = self.sampleBuffer.T - self.center
-        self.axisEndBuffer = self.axisEndBuffer.T - self.center
+        self.sampleBuffer = Orientation.nearestTurns(self.sampleBuffer.T, self.center) - self.center
+        self.axisEndBuffer = Orientation.nearestTurns(self.axisEndBuffer.T, self.center) - self.center
         print(self.axisEndBuffer)
 
-        rsi = 0
-        self.ica = FastICA(random_state=rsi)
-        goodfit = False
-        while not goodfit:
-            newcoords = self.ica.fit_transform(self.sampleBuffer)
-            # print(newcoords)
-
-            endcoords = self.ica.transform(self.axisEndBuffer)
-            # print(endcoords)
-            self.axes = np.argmax(np.abs(endcoords), axis=1)
-
-            tmp = np.copy(endcoords)
-            for i in range(3):
-                tmp[i, self.axes[i]] = 0
-            if np.sum(tmp) < 0.001:
-                goodfit = True
-            else:
-                print("bad ICA, rerunning. Off component sum: {}".format(np.sum(tmp)))
-                rsi += 1
-                self.ica = FastICA(random_state=rsi)
-
-        print(self.axes)
-        print(endcoords)
-        axismins = np.min(newcoords, axis=0)
-        axismaxs = np.max(newcoords, axis=0)
-        self.axisranges = np.zeros((3, 3))
-        self.axisranges[:, 0] = axismins
-        self.axisranges[:, 2] = axismaxs
-        self.axisflip = [False] * 3
-        for i in range(3):
-            a = self.axes[i]
-            if endcoords[i, a] > 0:
-                tmp = self.axisranges[a, 0]
-                self.axisranges[a, 0] = self.axisranges[a, 2]
-                self.axisranges[a, 2] = tmp
-                self.axisflip[a] = True
-                print("flipping {}".format(a))
-        print(self.axisranges)
+        # fitting can take a while, the dialog stays responsive and shows how it's going
+        method = self.solverComboBox.currentText()
+        self.solverComboBox.setEnabled(False)
+        self.solver = CalibrationSolver.SolverThread(self.sampleBuffer, self.axisEndBuffer, self.center, method,
+                                                     onProgress=self.solverProgress.emit,
+                                                     onDone=self.solverDone.emit,
+                                                     timeBudget=self.SOLVER_TIME_BUDGET)
+        self.solver.start()
+
+    def showSolverProgress(self, done, total, fit):
+        self.actionLabel.setText("Calibrating, please wait... {}/{}, best {}".format(done, total, fit.describe()))
+
+    def calibrationSolved(self, fit):
+        print("Calibration fit: {}".format(fit.describe()))
+        print(fit.axes)
+        print(fit.endcoords)
+        print(fit.axisranges)
+        self.fit = fit
+        self.axes = fit.axes
+        self.axisranges = fit.axisranges
+        self.axisflip = fit.axisflip
+        self.transform = fit.transform()
+        self.transform.reference = self.reference
+
+        if fit.isGood():
+            self.actionLabel.setText("Calibrated, {}".format(fit.describe()))
+        else:
+            self.actionLabel.setText("Calibrated, but the fit is poor ({}), consider recalibrating".format(fit.describe()))
 
         if self.showFig:
             ax = self.fig.add_subplot(projection='3d')
-            ax.scatter(newcoords[:, 0], newcoords[:, 1], newcoords[:, 2])
-            ax.scatter(endcoords[:, 0], endcoords[:, 1], endcoords[:, 2])
+            ax.scatter(fit.coords[:, 0], fit.coords[:, 1], fit.coords[:, 2])
+            ax.scatter(fit.endcoords[:, 0], fit.endcoords[:, 1], fit.endcoords[:, 2])
             self.doneButton.setEnabled(True)
         else:
             self.done(0)
 
+    def done(self, r):
+        # closing the dialog early drops a fit still in progress
+        if self.solver is not None:
+            self.solver.stop()
+        super().done(r)
+
+    def handleQuat(self, quat):
+        roll, pitch, yaw = Orientation.poseAngles(quat, self.reference)
+        self.handleGyroData(roll, pitch, yaw, True, True, True)
+
     def handleGyroData(self, roll, pitch, yaw, rollChanged, pitchChanged, yawChanged):
         if self.captureNextCenter:
             self.captureNextCenter = False
@@ -227,47 +261,60 @@ class CalibrationDialog(QDialog):
 class ConfigWindow(QWidget):
     """
     """
-    updateSignal = pyqtSignal()
 
     def __init__(self):
         # QWidget.__init__(self)
         super().__init__()
 
-        self.updateSignal.connect(self.updateSignalFunc)
-        self.lastUpdateSignalTime = 0
-        self.UPDATE_SIGNAL_REFRAC = 0
+        # live widgets repaint through this, at most once per display frame
+        self.repaints = RepaintScheduler()
 
         # value is the minimum delay in milliseconds between cc sends
         self.throttleLevels = [0, 33, 200, 1000]
         self.throttleLabels = ["None", "30Hz", "5Hz", "1Hz"]
         self.throttleLevel = 0
 
+        # CC changes this small are treated as sensor jitter, see MIDIMapping.cc
+        self.ccHysteresis = 0
+
         self.midiout = None
+        self.midiEngine = None
         self.midiHandler = None
 
-        self.last_rgyro_time = 0
-        self.last_lgyro_time = 0
-        self.rrcint = False
-        self.rpcint = False
-        self.rycint = False
-        self.lrcint = False
-        self.lpcint = False
-        self.lycint = False
+        # filter chain of each hand between calibration and the MIDI handler, see SignalConditioning
+        self.conditioning = {"L": SignalConditioning.FilterChain(), "R": SignalConditioning.FilterChain()}
+        self.lastConditioned = {"L": np.full(3, np.nan), "R": np.full(3, np.nan)}
+        self.conditioningPreset = {"L": 0, "R": 0}
+        # roll, pitch, yaw the chain of each hand works on, the other axes pass through
+        self.conditioningAxes = {"L": [True, True, True], "R": [True, True, True]}
+        # sides whose board sends every sample in batches. Their latest value messages repeat the
+        # newest sample of a batch, so they're left out rather than conditioned twice
+        self.batchSides = set()
+
+        # hand samples to the MIDI handler, [roll, pitch, yaw, rollChanged, pitchChanged, yawChanged]
+        # per side. Samples inside the throttle interval are merged and sent when it's up
+        self.gyroLimiter = RateLimiter(self.sendGyro, merge=mergeGyro)
 
         self.board = None
 
-        self.rrcenter = 0.5
-        self.rpcenter = 0.5
-        self.rycenter = 0.5
+        # uncalibrated values, centered per axis and wrapping half a turn from the center
+        self.normalizer = Orientation.OrientationNormalizer()
+        # in quaternion mode the angles are taken from the board's quaternions, measured from a pose
+        # captured with the center button, instead of from the board's Euler angles (see
+        # Orientation.poseAngles). A calibration made in quaternion mode keeps the pose it was made from
+        self.orientationOptions = ["Angles", "Quaternion"]
+        self.quaternionMode = False
+        self.poseReference = {"L": np.array([1.0, 0.0, 0.0, 0.0]), "R": np.array([1.0, 0.0, 0.0, 0.0])}
+        self.lastQuat = {"L": None, "R": None}
+        self.lastPose = {"L": np.full(3, np.nan), "R": np.full(3, np.nan)}
+        # sides whose board sends quaternions, the others stay on their angles in quaternion mode
+        self.quatSides = set()
         self.rrminval = 0.0
         self.rrmaxval = 1.0
         self.rpminval = 0.0
         self.rpmaxval = 1.0
         self.ryminval = 0.0
         self.rymaxval = 1.0
-        self.lrcenter = 0.5
-        self.lpcenter = 0.5
-        self.lycenter = 0.5
         self.lrminval = 0.0
         self.lrmaxval = 1.0
         self.lpminval = 0.0
@@ -277,6 +324,10 @@ class ConfigWindow(QWidget):
 
         self.isLeftCalibrated = False
         self.isRightCalibrated = False
+        self.calibProfiles = Calibration.CalibrationProfiles()
+        # follow IMU drift during a performance, see Calibration.OnlineRecalibrator
+        self.trackDrift = False
+        self.gloveName = "default"
 
         self.midiHandlerOptions = ["None",
                                    "M1",
@@ -289,17 +340,13 @@ class ConfigWindow(QWidget):
                              "Arduino"]
 
         self.initUI()
+        self.loadCalibrations()
         self.initBoardComs()
         self.initMIDI()
 
         self.midiHandlerComboBox.setCurrentIndex(3)
         self.inputComboBox.setCurrentIndex(1)
 
-    def updateSignalFunc(self):
-        if time.time() * 1000 - self.lastUpdateSignalTime >= self.UPDATE_SIGNAL_REFRAC:
-            self.update()
-            self.lastUpdateSignalTime = time.time() * 1000
-
     def initUI(self):
         self.setWindowTitle("MIDI Glove Config")
 
@@ -320,6 +367,37 @@ class ConfigWindow(QWidget):
         l7.addWidget(self.inputComboBox)
         layout.addLayout(l7)
 
+        l9 = QHBoxLayout()
+        l9.addWidget(QLabel("Glove: "))
+        self.gloveNameEdit = QLineEdit(self.gloveName)
+        self.gloveNameEdit.editingFinished.connect(self.gloveNameChanged)
+        l9.addWidget(self.gloveNameEdit)
+        self.calibStatusLabel = QLabel("")
+        l9.addWidget(self.calibStatusLabel)
+        trackDriftCheckBox = QCheckBox("Track drift")
+        trackDriftCheckBox.setChecked(self.trackDrift)
+        trackDriftCheckBox.stateChanged.connect(self.trackDriftState)
+        l9.addWidget(trackDriftCheckBox)
+        layout.addLayout(l9)
+
+        l10 = QHBoxLayout()
+        l10.addWidget(QLabel("Orientation:"))
+        orientationComboBox = QComboBox()
+        orientationComboBox.addItems(self.orientationOptions)
+        orientationComboBox.currentIndexChanged.connect(self.orientationSelected)
+        l10.addWidget(orientationComboBox)
+        for side, name in [("L", "Left"), ("R", "Right")]:
+            centerButton = QPushButton("Center {}".format(name))
+            centerButton.clicked.connect(lambda checked, side=side: self.centerbtn(3, side))
+            l10.addWidget(centerButton)
+            label = QLabel("")
+            l10.addWidget(label)
+            if side == "L":
+                self.calibLabel_l = label
+            else:
+                self.calibLabel_r = label
+        layout.addLayout(l10)
+
         l6 = QHBoxLayout()
         self.leftCalibButton = QPushButton("Calib Left")
         self.leftCalibButton.clicked.connect(lambda: self.calibButton("L"))
@@ -349,6 +427,30 @@ class ConfigWindow(QWidget):
         l4.addWidget(self.throttleSlider)
         layout.addLayout(l4)
 
+        l9 = QHBoxLayout()
+        l9.addWidget(QLabel("Smoothing:"))
+        for side, name in [("L", "Left"), ("R", "Right")]:
+            l9.addWidget(QLabel(name))
+            ccb = QComboBox()
+            ccb.addItems(SignalConditioning.PRESET_NAMES)
+            ccb.currentIndexChanged.connect(lambda idx, side=side: self.conditioningstate(side, idx))
+            l9.addWidget(ccb)
+            for axis, axisName in enumerate(["R", "P", "Y"]):
+                acb = QCheckBox(axisName)
+                acb.setChecked(self.conditioningAxes[side][axis])
+                acb.stateChanged.connect(lambda state, side=side, axis=axis: self.conditioningaxisstate(side, axis, state))
+                l9.addWidget(acb)
+        layout.addLayout(l9)
+
+        l8 = QHBoxLayout()
+        l8.addWidget(QLabel("CC jitter filter (steps): "))
+        self.hysteresisSpinBox = QSpinBox()
+        self.hysteresisSpinBox.setMaximum(8)
+        self.hysteresisSpinBox.setValue(self.ccHysteresis)
+        self.hysteresisSpinBox.valueChanged.connect(self.hysteresisstate)
+        l8.addWidget(self.hysteresisSpinBox)
+        layout.addLayout(l8)
+
         self.handlerWidgetContainer = QHBoxLayout()
         self.handlerWidget = QLabel("None")
         self.handlerWidgetContainer.addWidget(self.handlerWidget)
@@ -365,11 +467,11 @@ class ConfigWindow(QWidget):
         handler = self.midiHandlerOptions[idx]
 
         if handler == "M1":
-            self.midiHandler = M1(self.midiout)
+            self.midiHandler = M1(self.midiEngine)
         elif handler == "ToyMidiMap":
-            self.midiHandler = ToyMidiMap(self.midiout)
+            self.midiHandler = ToyMidiMap(self.midiEngine)
         elif handler == "Drag":
-            self.midiHandler = DragMap(self.midiout, self.updateSignal)
+            self.midiHandler = DragMap(self.midiEngine, self.repaints)
         elif handler == "None":
             self.midiHandler = None
             self.handlerWidgetContainer.removeWidget(self.handlerWidget)
@@ -381,6 +483,8 @@ class ConfigWindow(QWidget):
             print("unimplemented handler")
             return
 
+        self.midiHandler.setCCHysteresis(self.ccHysteresis)
+
         self.handlerWidgetContainer.removeWidget(self.handlerWidget)
         self.handlerWidget.deleteLater()
         self.handlerWidget = self.midiHandler.widget
@@ -392,11 +496,14 @@ class ConfigWindow(QWidget):
         self.inputWidgetContainer.removeWidget(self.inputWidget)
         self.inputWidget.close()
         self.inputWidget.deleteLater()
+        # the new input shows again whether it sends batches and quaternions
+        self.batchSides = set()
+        self.quatSides = set()
 
         if inp == "None":
             self.inputWidget = QLabel("No Input")
         elif inp == "Arduino":
-            self.inputWidget = RealBoard()
+            self.inputWidget = RealBoard(bus=self.guiBridge.bus)
         elif inp == "Fake input":
             self.inputWidget = FakeBoard()
         else:
@@ -405,9 +512,40 @@ class ConfigWindow(QWidget):
 
         self.inputWidgetContainer.addWidget(self.inputWidget)
 
+    def conditioningstate(self, side, idx):
+        self.conditioningPreset[side] = idx
+        self.rebuildConditioning(side)
+
+    def conditioningaxisstate(self, side, axis, state):
+        self.conditioningAxes[side][axis] = bool(state)
+        self.rebuildConditioning(side)
+
+    def rebuildConditioning(self, side):
+        chain = SignalConditioning.PRESETS[SignalConditioning.PRESET_NAMES[self.conditioningPreset[side]]]()
+        chain.setEnabled(self.conditioningAxes[side])
+        # replaced whole, the MIDI thread picks the new chain up with its next sample
+        self.conditioning[side] = chain
+        self.lastConditioned[side] = np.full(3, np.nan)
+
     def throttlestate(self, sld):
         self.throttleLabel.setText(self.throttleLabels[sld.value()])
         self.throttleLevel = self.throttleLevels[sld.value()]
+        self.gyroLimiter.setInterval(self.throttleLevel / 1000.0)
+
+    def trackDriftState(self, state):
+        if state and not self.trackDrift:
+            # start from the saved calibration each time tracking is turned on. The MIDI thread may be
+            # in the middle of apply, so the trackers are replaced whole rather than reset under it
+            if self.isLeftCalibrated:
+                self.leftTracker = Calibration.OnlineRecalibrator(self.leftTransform)
+            if self.isRightCalibrated:
+                self.rightTracker = Calibration.OnlineRecalibrator(self.rightTransform)
+        self.trackDrift = bool(state)
+
+    def hysteresisstate(self, val):
+        self.ccHysteresis = val
+        if self.midiHandler is not None:
+            self.midiHandler.setCCHysteresis(val)
 
     def centerbtn(self, timeleft, side):
         if timeleft > 0:
@@ -420,211 +558,274 @@ class ConfigWindow(QWidget):
 
         if side == "L":
             self.calibLabel_l.setText("")
-            self.lrcenter = self.lrval_raw
-            self.lpcenter = self.lpval_raw
-            self.lycenter = self.lyval_raw
         else:
             self.calibLabel_r.setText("")
-            self.rrcenter = self.rrval_raw
-            self.rpcenter = self.rpval_raw
-            self.rycenter = self.ryval_raw
+        if self.quaternionMode and self.lastQuat[side] is not None:
+            # the current pose becomes the one the angles are measured from, it comes out at 0.5
+            self.poseReference[side] = self.lastQuat[side].copy()
+            self.normalizer.setCenter(side, rpy=[0.5, 0.5, 0.5])
+        else:
+            self.normalizer.setCenter(side)
+
+    def orientationSelected(self, idx):
+        self.quaternionMode = self.orientationOptions[idx] == "Quaternion"
+        # calibrations are made on one kind of angles, each mode has its own profiles
+        self.loadCalibrations()
 
     def centerYaw(self, side):
-        if side == "L":
-            self.lycenter = self.lyval_raw
-        else:
-            self.rycenter = self.ryval_raw
+        self.normalizer.setCenter(side, axes=[2])
 
     def calibButton(self, side):
         print("Initiating calibration on side {}".format(side))
         self.leftCalibButton.setEnabled(False)
         self.rightCalibButton.setEnabled(False)
 
-        self.calibDialog = CalibrationDialog(side)
+        reference = self.poseReference[side] if self.quaternionMode else None
+        self.calibDialog = CalibrationDialog(side, bus=self.guiBridge.bus, reference=reference)
         self.calibDialog.exec()
         self.leftCalibButton.setEnabled(True)
         self.rightCalibButton.setEnabled(True)
+        if self.calibDialog.transform is None:
+            print("Calibration on side {} didn't finish".format(side))
+            return
+        print("{} calibration breakpoints: {}".format(side, self.calibDialog.transform.breakpoints))
+        self.setCalibration(side, self.calibDialog.transform)
+        self.calibProfiles.save(self.calibDialog.transform, self.profileName(), side)
+        self.updateCalibStatus()
+
+    def setCalibration(self, side, transform):
+        """
+        transform None goes back to uncalibrated
+        """
+        # the calibrated flags are set last, the MIDI thread uses the transform as soon as they're set
         if side == "L":
-            self.isLeftCalibrated = True
-            self.leftCalib = self.calibDialog
-            fvnofl = (0.0, 1.0)
-            fvflip = (1.0, 0.0)
-
-            if self.leftCalib.axisflip[0]:
-                fv = fvflip
-            else:
-                fv = fvnofl
-            self.leftInterp0 = interp1d(self.leftCalib.axisranges[0, :], [
-                                        0.0, 0.5, 1.0], fill_value=fv, bounds_error=False)
-            print("Range: {}, fv: {}, [0, 0.4, 0.6, 1] -> [{}, {}, {}, {}]".format(self.leftCalib.axisranges[0, :],
-                  fv, self.leftInterp0(0.0), self.leftInterp0(0.4), self.leftInterp0(0.6), self.leftInterp0(1.0)))
-
-            if self.leftCalib.axisflip[1]:
-                fv = fvflip
-            else:
-                fv = fvnofl
-            self.leftInterp1 = interp1d(self.leftCalib.axisranges[1, :], [
-                                        0.0, 0.5, 1.0], fill_value=fv, bounds_error=False)
-            print("Range: {}, fv: {}, [0, 0.4, 0.6, 1] -> [{}, {}, {}, {}]".format(self.leftCalib.axisranges[1, :],
-                  fv, self.leftInterp1(0.0), self.leftInterp1(0.4), self.leftInterp1(0.6), self.leftInterp1(1.0)))
-
-            if self.leftCalib.axisflip[2]:
-                fv = fvflip
-            else:
-                fv = fvnofl
-            self.leftInterp2 = interp1d(self.leftCalib.axisranges[2, :], [
-                                        0.0, 0.5, 1.0], fill_value=fv, bounds_error=False)
-            print("Range: {}, fv: {}, [0, 0.4, 0.6, 1] -> [{}, {}, {}, {}]".format(self.leftCalib.axisranges[2, :],
-                  fv, self.leftInterp2(0.0), self.leftInterp2(0.4), self.leftInterp2(0.6), self.leftInterp2(1.0)))
+            if transform is not None:
+                self.leftTransform = transform
+                self.leftTracker = Calibration.OnlineRecalibrator(transform)
+            self.isLeftCalibrated = transform is not None
+        else:
+            if transform is not None:
+                self.rightTransform = transform
+                self.rightTracker = Calibration.OnlineRecalibrator(transform)
+            self.isRightCalibrated = transform is not None
+
+    def loadCalibrations(self):
+        """
+        Uses the saved profiles of the current glove, a side without one goes back to uncalibrated
+        """
+        self.setCalibration("L", self.calibProfiles.load(self.profileName(), "L"))
+        self.setCalibration("R", self.calibProfiles.load(self.profileName(), "R"))
+        self.updateCalibStatus()
+
+    def profileName(self):
+        return self.gloveName + "-quaternion" if self.quaternionMode else self.gloveName
+
+    def updateCalibStatus(self):
+        calibrated = [name for name, c in (("left", self.isLeftCalibrated), ("right", self.isRightCalibrated)) if c]
+        if len(calibrated) == 0:
+            self.calibStatusLabel.setText("Not calibrated")
         else:
-            self.isRightCalibrated = True
-            self.rightCalib = self.calibDialog
-            fvnofl = (0.0, 1.0)
-            fvflip = (1.0, 0.0)
+            self.calibStatusLabel.setText("Calibrated: {}".format(", ".join(calibrated)))
 
-            if self.rightCalib.axisflip[0]:
-                fv = fvflip
-            else:
-                fv = fvnofl
-            self.rightInterp0 = interp1d(self.rightCalib.axisranges[0, :], [
-                0.0, 0.5, 1.0], fill_value=fv, bounds_error=False)
-            print("Range: {}, fv: {}, [0, 0.4, 0.6, 1] -> [{}, {}, {}, {}]".format(self.rightCalib.axisranges[0, :],
-                  fv, self.rightInterp0(0.0), self.rightInterp0(0.4), self.rightInterp0(0.6), self.rightInterp0(1.0)))
-
-            if self.rightCalib.axisflip[1]:
-                fv = fvflip
-            else:
-                fv = fvnofl
-            self.rightInterp1 = interp1d(self.rightCalib.axisranges[1, :], [
-                0.0, 0.5, 1.0], fill_value=fv, bounds_error=False)
-            print("Range: {}, fv: {}, [0, 0.4, 0.6, 1] -> [{}, {}, {}, {}]".format(self.rightCalib.axisranges[1, :],
-                  fv, self.rightInterp1(0.0), self.rightInterp1(0.4), self.rightInterp1(0.6), self.rightInterp1(1.0)))
-
-            if self.rightCalib.axisflip[2]:
-                fv = fvflip
-            else:
-                fv = fvnofl
-            self.rightInterp2 = interp1d(self.rightCalib.axisranges[2, :], [
-                0.0, 0.5, 1.0], fill_value=fv, bounds_error=False)
-            print("Range: {}, fv: {}, [0, 0.4, 0.6, 1] -> [{}, {}, {}, {}]".format(self.rightCalib.axisranges[2, :],
-                  fv, self.rightInterp2(0.0), self.rightInterp2(0.4), self.rightInterp2(0.6), self.rightInterp2(1.0)))
+    def gloveNameChanged(self):
+        name = self.gloveNameEdit.text().strip()
+        if name == "" or name == self.gloveName:
+            return
+        self.gloveName = name
+        self.loadCalibrations()
 
     def initBoardComs(self):
-        pub.subscribe(self.handleFingerConnection, 'FingerConnection')
-        pub.subscribe(self.handleLGyroData, 'LGyro')
-        pub.subscribe(self.handleRGyroData, 'RGyro')
+        # MIDI output runs on its own thread so drawing never holds it up, widgets are refreshed
+        # from the GUI thread at display rate
+        self.midiConsumer = SampleConsumer()
+        self.midiConsumer.bus.subscribe(self.handleFingerConnection, 'FingerConnection')
+        self.midiConsumer.bus.subscribe(self.handleLGyroData, 'LGyro')
+        self.midiConsumer.bus.subscribe(self.handleRGyroData, 'RGyro')
+        self.midiConsumer.bus.subscribe(self.handleLGyroBatch, 'LGyroBatch')
+        self.midiConsumer.bus.subscribe(self.handleRGyroBatch, 'RGyroBatch')
+        self.midiConsumer.bus.subscribe(self.handleLQuat, 'LQuat')
+        self.midiConsumer.bus.subscribe(self.handleRQuat, 'RQuat')
+        self.midiConsumer.addTimer(self.settleConditioning)
+        self.midiConsumer.addTimer(self.flushLimiters)
+        self.midiConsumer.addTimer(self.endMappingFrame)
+        self.midiConsumer.start()
+
+        self.guiBridge = GuiBridge()
+        self.guiBridge.drained.connect(self.refreshHandlerWidget)
+
+    def refreshHandlerWidget(self):
+        if self.midiHandler is not None:
+            self.midiHandler.refreshWidget()
+
+    def closeEvent(self, event):
+        print("MIDI latency: {}".format(self.midiEngine.getLatencyStats()))
+        if self.midiHandler is not None:
+            print("CC messages: {}".format(self.midiHandler.getCCCounts()))
+        print("Repaints: {}".format(self.repaints.getCounts()))
+        print("Throttle: {}".format(self.gyroLimiter.getCounts()))
+        self.midiEngine.stop()
+        self.midiConsumer.stop()
+        self.guiBridge.close()
+        super().closeEvent(event)
 
     def initMIDI(self):
         self.midiout, self.midiportname = open_midioutput()
+        # mappings send through the engine so MIDI goes out from its own thread, notes first
+        self.midiEngine = MIDIOutputEngine(self.midiout, sampleTimeFunc=lambda: self.midiConsumer.sampleTime)
+        self.midiEngine.start()
 
     def handleFingerConnection(self, con, finger):
-        if self.midiHandler is not None:
-            self.midiHandler.fingerConnection(finger, con)
+        # midiHandler can be swapped from the GUI thread, so only look it up once
+        midiHandler = self.midiHandler
+        if midiHandler is not None:
+            midiHandler.fingerConnection(finger, con)
+
+    def sendGyro(self, side, sample):
+        midiHandler = self.midiHandler
+        if midiHandler is not None:
+            midiHandler.valuesChanged(side, sample[0:3], sample[3:6])
+
+    def flushLimiters(self, now):
+        # runs on the MIDI thread after every delivery, and at the deadlines returned
+        midiHandler = self.midiHandler
+        limiters = [self.gyroLimiter] + (midiHandler.limiters if midiHandler is not None else [])
+        deadlines = [d for d in (l.flush(now) for l in limiters) if d is not None]
+        return min(deadlines) if len(deadlines) > 0 else None
+
+    def settleConditioning(self, now):
+        # runs on the MIDI thread. The board goes quiet when the hand stops, but smoothing is still
+        # on its way there, so the chains are stepped on with the last sample until they catch up
+        deadlines = []
+        for side in ("L", "R"):
+            chain = self.conditioning[side]
+            if chain.isSettled():
+                continue
+            due = max(chain.lastTime, self.midiConsumer.sampleTime) + chain.HOLD_PERIOD
+            if now >= due:
+                out = chain.hold(now)
+                changed = out != self.lastConditioned[side]
+                self.lastConditioned[side] = out
+                if changed.any():
+                    self.gyroLimiter.submit(side, out.tolist() + changed.tolist())
+                if chain.isSettled():
+                    continue
+                due = now + chain.HOLD_PERIOD
+            deadlines.append(due)
+        return min(deadlines) if len(deadlines) > 0 else None
+
+    def endMappingFrame(self, now):
+        # after the limiters, which may have just passed samples on
+        midiHandler = self.midiHandler
+        if midiHandler is not None:
+            midiHandler.endFrame()
+        return None
+
+    def conditionSample(self, side, values, changed):
+        chain = self.conditioning[side]
+        if chain.isEmpty():
+            return values, changed
+        out = chain.processSample(self.midiConsumer.sampleTime, values)
+        # smoothing keeps the output moving after the input stops, so changed is whatever moved
+        changed = tuple((out != self.lastConditioned[side]).tolist())
+        self.lastConditioned[side] = out
+        return tuple(out.tolist()), changed
+
+    def calibrate(self, side, rpy):
+        """
+        One raw sample or an (n, 3) batch through the side's calibration, or centered if it has none
+        """
+        if side == "L" and self.isLeftCalibrated:
+            return (self.leftTracker if self.trackDrift else self.leftTransform).apply(rpy)
+        if side == "R" and self.isRightCalibrated:
+            return (self.rightTracker if self.trackDrift else self.rightTransform).apply(rpy)
+        return self.normalizer.normalize(side, rpy)
+
+    def poseAngles(self, side, quat):
+        """
+        Angles of one quaternion or an (n, 4) batch in quaternion mode, measured from the pose the
+        side's calibration was made from, or else from the one captured with the center button
+        """
+        self.lastQuat[side] = np.array(quat, dtype=float).reshape((-1, 4))[-1]
+        calibrated = self.isLeftCalibrated if side == "L" else self.isRightCalibrated
+        transform = (self.leftTransform if side == "L" else self.rightTransform) if calibrated else None
+        if transform is not None and transform.reference is not None:
+            return Orientation.poseAngles(quat, transform.reference)
+        return Orientation.poseAngles(quat, self.poseReference[side])
+
+    def usesGyro(self, side):
+        # a side's Gyro messages are left out when its batches or quaternions already carry its samples
+        return side not in self.batchSides and not (self.quaternionMode and side in self.quatSides)
+
+    def handleGyroBatch(self, side, t, rpy, quat):
+        if side not in self.batchSides:
+            # replaced whole, the GUI thread clears it when the input changes
+            self.batchSides = self.batchSides | {side}
+        if self.quaternionMode:
+            rpy = self.poseAngles(side, quat)
+        values = self.calibrate(side, rpy)
+        chain = self.conditioning[side]
+        if not chain.isEmpty():
+            # every sample goes through the filters, a row at a time costs several times as much
+            values = chain.process(t, values)
+        out = values[-1]
+        # only the newest sample goes on, changed is whatever moved since the last one sent
+        changed = out != self.lastConditioned[side]
+        self.lastConditioned[side] = out
+        if changed.any():
+            self.gyroLimiter.submit(side, out.tolist() + changed.tolist())
+
+    def handleLGyroBatch(self, t, rpy, connections, quat):
+        self.handleGyroBatch("L", t, rpy, quat)
+
+    def handleRGyroBatch(self, t, rpy, connections, quat):
+        self.handleGyroBatch("R", t, rpy, quat)
+
+    def handleQuat(self, side, quat):
+        if side not in self.quatSides:
+            self.quatSides = self.quatSides | {side}
+        if not self.quaternionMode or side in self.batchSides:
+            return
+        pose = self.poseAngles(side, quat)
+        changed = pose != self.lastPose[side]
+        self.lastPose[side] = pose
+        values = self.calibrate(side, pose)
+        values, changed = self.conditionSample(side, tuple(values.tolist()), tuple(changed.tolist()))
+        self.gyroLimiter.submit(side, list(values) + list(changed))
+
+    def handleLQuat(self, quat):
+        self.handleQuat("L", quat)
+
+    def handleRQuat(self, quat):
+        self.handleQuat("R", quat)
 
     def handleLGyroData(self, roll, pitch, yaw, rollChanged, pitchChanged, yawChanged):
+        if not self.usesGyro("L"):
+            return
         self.lrval_raw = roll
         self.lpval_raw = pitch
         self.lyval_raw = yaw
 
-        if self.isLeftCalibrated:
-            c = np.array([roll, pitch, yaw]) - self.leftCalib.center
-            t = self.leftCalib.ica.transform(c.reshape((1, -1)))[0, :]
-            v = np.empty((3,))
-            # print("c {}".format(c))
-            # print("t {}".format(t))
-            v[0] = self.leftInterp0(t[0])
-            v[1] = self.leftInterp1(t[1])
-            v[2] = self.leftInterp2(t[2])
-
-            self.lrval = v[self.leftCalib.axes[0]]
-            self.lpval = v[self.leftCalib.axes[1]]
-            self.lyval = v[self.leftCalib.axes[2]]
-            print("rpy: {}, {}, {}".format(self.lrval, self.lpval, self.lyval))
-        else:
-            self.lrval = roll - self.lrcenter + 0.5
-            if self.lrval > 1.0:
-                self.lrval -= 1.0
-            self.lpval = pitch - self.lpcenter + 0.5
-            if self.lpval > 1.0:
-                self.lpval -= 1.0
-            self.lyval = yaw - self.lycenter + 0.5
-            if self.lyval > 1.0:
-                self.lyval -= 1.0
-
-        if time.time() * 1000 - self.last_lgyro_time < self.throttleLevel:
-            self.lrcint = self.lrcint or rollChanged
-            self.lpcint = self.lpcint or pitchChanged
-            self.lycint = self.lycint or yawChanged
-            # print("Throttling")
-            return
+        self.lrval, self.lpval, self.lyval = self.calibrate("L", (roll, pitch, yaw))
 
-        if rollChanged:
-            if self.midiHandler is not None:
-                self.midiHandler.leftRollChanged(self.lrval)
-        if pitchChanged:
-            if self.midiHandler is not None:
-                self.midiHandler.leftPitchChanged(self.lpval)
-        if yawChanged:
-            if self.midiHandler is not None:
-                self.midiHandler.leftYawChanged(self.lyval)
-
-        self.last_lgyro_time = time.time() * 1000
-        self.lrcint = False
-        self.lpcint = False
-        self.lycint = False
+        (self.lrval, self.lpval, self.lyval), (rollChanged, pitchChanged, yawChanged) = self.conditionSample(
+            "L", (self.lrval, self.lpval, self.lyval), (rollChanged, pitchChanged, yawChanged))
+        self.gyroLimiter.submit("L", [self.lrval, self.lpval, self.lyval,
+                                      rollChanged, pitchChanged, yawChanged])
 
     def handleRGyroData(self, roll, pitch, yaw, rollChanged, pitchChanged, yawChanged):
         # print("RGYRO received:", roll, pitch, yaw)
+        if not self.usesGyro("R"):
+            return
         self.rrval_raw = roll
         self.rpval_raw = pitch
         self.ryval_raw = yaw
 
-        if self.isRightCalibrated:
-            c = np.array([roll, pitch, yaw]) - self.rightCalib.center
-            t = self.rightCalib.ica.transform(c.reshape((1, -1)))[0, :]
-            v = np.empty((3,))
-            # print("c {}".format(c))
-            # print("t {}".format(t))
-            v[0] = self.rightInterp0(t[0])
-            v[1] = self.rightInterp1(t[1])
-            v[2] = self.rightInterp2(t[2])
-
-            self.rrval = v[self.rightCalib.axes[0]]
-            self.rpval = v[self.rightCalib.axes[1]]
-            self.ryval = v[self.rightCalib.axes[2]]
-            # print("rpy: {}, {}, {}".format(self.rrval, self.rpval, self.ryval))
-        else:
-            self.rrval = roll - self.rrcenter + 0.5
-            if self.rrval > 1.0:
-                self.rrval -= 1.0
-            self.rpval = pitch - self.rpcenter + 0.5
-            if self.rpval > 1.0:
-                self.rpval -= 1.0
-            self.ryval = yaw - self.rycenter + 0.5
-            if self.ryval > 1.0:
-                self.ryval -= 1.0
-
-        if time.time() * 1000 - self.last_rgyro_time < self.throttleLevel:
-            self.rrcint = self.rrcint or rollChanged
-            self.rpcint = self.rpcint or pitchChanged
-            self.rycint = self.rycint or yawChanged
-            # print("Throttling")
-            return
+        self.rrval, self.rpval, self.ryval = self.calibrate("R", (roll, pitch, yaw))
 
-        if rollChanged:
-            if self.midiHandler is not None:
-                self.midiHandler.rightRollChanged(self.rrval)
-        if pitchChanged:
-            if self.midiHandler is not None:
-                self.midiHandler.rightPitchChanged(self.rpval)
-        if yawChanged:
-            if self.midiHandler is not None:
-                self.midiHandler.rightYawChanged(self.ryval)
-
-        self.last_rgyro_time = time.time() * 1000
-        self.rrcint = False
-        self.rpcint = False
-        self.rycint = False
+        (self.rrval, self.rpval, self.ryval), (rollChanged, pitchChanged, yawChanged) = self.conditionSample(
+            "R", (self.rrval, self.rpval, self.ryval), (rollChanged, pitchChanged, yawChanged))
+        self.gyroLimiter.submit("R", [self.rrval, self.rpval, self.ryval,
+                                      rollChanged, pitchChanged, yawChanged])
 
 
 def main():
@@ -1,12 +1,32 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QSpinBox, QComboBox
 from rtmidi.midiconstants import NOTE_OFF, NOTE_ON, CONTROL_CHANGE, PITCH_BEND
 
+import MappingEngine
+from MIDIOutput import MIDIOutputEngine
+
 
 class MIDIMapping:
+    # output resolution of a continuous control, index into RESOLUTION_OPTIONS
+    RESOLUTION_OPTIONS = ["7-bit CC", "14-bit CC", "NRPN"]
+    RES_CC7 = 0
+    RES_CC14 = 1  # cc on 0-31 for the MSB, cc + 32 for the LSB
+    RES_NRPN = 2  # cc number is used as the NRPN parameter number
+
     def __init__(self, midiport):
         self.midiport = midiport
         self.widget = QWidget()
 
+        # (channel, cc) -> last value sent, cc() skips values that wouldn't change anything
+        self.lastCCValues = dict()
+        # (channel, kind, cc/param) -> last 14 bit value sent by cc14 and nrpn
+        self.lastHiResValues = dict()
+        # changes of this size or less are treated as jitter and not sent, except to reach 0 or 127
+        self.ccHysteresis = 0
+        self.ccSentCount = 0
+        self.ccSkippedCount = 0
+        # RateLimiters of this mapping, ConfigWindow flushes them on the MIDI thread
+        self.limiters = []
+
     def rightRollChanged(self, val):
         pass
 
@@ -25,9 +45,32 @@ class MIDIMapping:
     def leftYawChanged(self, val):
         pass
 
+    def valuesChanged(self, side, values, changed):
+        """
+        One sample of a hand, values is (roll, pitch, yaw) and changed which of them changed
+        """
+        if side == "L":
+            axes = (self.leftRollChanged, self.leftPitchChanged, self.leftYawChanged)
+        else:
+            axes = (self.rightRollChanged, self.rightPitchChanged, self.rightYawChanged)
+        for f, v, c in zip(axes, values, changed):
+            if c:
+                f(v)
+
     def fingerConnection(self, finger, con):
         pass
 
+    def endFrame(self):
+        """
+        Called on the MIDI thread once the samples delivered together have all been passed on
+        """
+        pass
+
+    def refreshWidget(self):
+        # called from the GUI thread at display rate, the *Changed functions run on the MIDI
+        # thread and must not touch widgets
+        pass
+
     def startNote(self, pitch=60, vel=112):
         self.midiport.send_message([NOTE_ON, pitch, vel])
 
@@ -45,223 +88,210 @@ class MIDIMapping:
             channel = 0
         if channel > 15:
             channel = 15
+        value = int(value)
+
+        last = self.lastCCValues.get((channel, cc))
+        if last is not None and (value == last or
+                                 (abs(value - last) <= self.ccHysteresis and value != 0 and value != 127)):
+            self.ccSkippedCount += 1
+            return
+
+        self.lastCCValues[(channel, cc)] = value
+        self.ccSentCount += 1
         ch = CONTROL_CHANGE | channel
         self.midiport.send_message([ch, cc, value])
 
+    def _hiResChanged(self, key, value):
+        # same rule as cc(), hysteresis is in 7 bit steps so scale it up
+        last = self.lastHiResValues.get(key)
+        if last is not None and (value == last or
+                                 (abs(value - last) <= self.ccHysteresis * 128 and value != 0 and value != 16383)):
+            self.ccSkippedCount += 1
+            return False
+        self.lastHiResValues[key] = value
+        self.ccSentCount += 1
+        return True
+
+    def cc14(self, cc=0, value=0, channel=0):
+        """
+        14 bit control change, value is 0-16383. cc is the MSB controller (0-31)
+        """
+        value = int(min(max(value, 0), 16383))
+        channel = min(max(channel, 0), 15)
+        if not self._hiResChanged((channel, "cc", cc), value):
+            return
+
+        ch = CONTROL_CHANGE | channel
+        # both halves every time, a receiver resets the LSB when it gets a new MSB
+        self.sendGroup([[ch, cc, value >> 7], [ch, cc + 32, value & 0x7f]], (channel, "cc", cc))
+
+    def nrpn(self, param=0, value=0, channel=0):
+        """
+        NRPN with a 14 bit value, param is 0-16383
+        """
+        value = int(min(max(value, 0), 16383))
+        channel = min(max(channel, 0), 15)
+        if not self._hiResChanged((channel, "nrpn", param), value):
+            return
+
+        ch = CONTROL_CHANGE | channel
+        self.sendGroup([[ch, 99, (param >> 7) & 0x7f], [ch, 98, param & 0x7f],
+                        [ch, 6, value >> 7], [ch, 38, value & 0x7f]], (channel, "nrpn", param))
+
+    def sendGroup(self, messages, key):
+        # the output engine keeps groups together, a plain rtmidi port just gets them in order
+        if isinstance(self.midiport, MIDIOutputEngine):
+            self.midiport.send_group(messages, key)
+        else:
+            for m in messages:
+                self.midiport.send_message(m)
+
+    def ccValue(self, resolution, cc, val, channel=0):
+        """
+        Sends val (0.0-1.0) on cc at the given resolution (one of the RES_ constants)
+        """
+        if resolution == self.RES_CC7:
+            self.cc(cc, int(val*127), channel)
+        elif resolution == self.RES_CC14:
+            self.cc14(cc, int(val*16383), channel)
+        else:
+            self.nrpn(cc, int(val*16383), channel)
+
+    def setCCHysteresis(self, val):
+        self.ccHysteresis = val
+
+    def getCCCounts(self):
+        return {"sent": self.ccSentCount, "skipped": self.ccSkippedCount}
+
     def pb(self, value=8192):
         self.midiport.send_message([PITCH_BEND, value & 0x7f, (value >> 7) & 0x7f])
 
 
-class M1(MIDIMapping):
-    def __init__(self, midiport):
-        super().__init__(midiport)
+# finger names in PacketDecoder.Fingers order, which is the order of MappingEngine's finger table
+FINGER_INDEX = {name: i for i, name in enumerate(
+    [s + f + c for s in "LR" for c in "TP" for f in "IMRP"])}
 
-        self.rr_ccnum = 22
-        self.rp_ccnum = 23
-        self.ry_ccnum = 24
-        self.rr_enabled = True
-        self.rp_enabled = True
-        self.ry_enabled = True
 
-        self.lr_ccnum = 25
-        self.lp_ccnum = 26
-        self.ly_ccnum = 27
-        self.lr_enabled = True
-        self.lp_enabled = True
-        self.ly_enabled = True
+class TableMapping(MIDIMapping):
+    """
+    A mapping evaluated from a MappingEngine.RoutingTable. Route i of the table is row i of the
+    axis rows the subclasses show, see addAxisRow.
+    """
 
-        self.initWidget()
+    def __init__(self, midiport, table):
+        super().__init__(midiport)
+        self.table = table
+        self.router = MappingEngine.Router(table)
+        self.valueLabels = dict()
 
-    def initWidget(self):
-        layout = QVBoxLayout()
+    def valuesChanged(self, side, values, changed):
+        # both hands' samples of a frame are sent together in endFrame
+        self.router.stage(side, values, changed)
 
-        l1 = QHBoxLayout()
-        l1.addWidget(QLabel("Right Roll"))
-        self.rrcb = QCheckBox("Enabled")
-        self.rrcb.setChecked(self.rr_enabled)
-        self.rrcb.stateChanged.connect(lambda: self.btnstate("rr", self.rrcb))
-        l1.addWidget(QLabel("Midi cc:"))
-        self.rrsb = QSpinBox()
-        self.rrsb.setValue(self.rr_ccnum)
-        self.rrsb.valueChanged.connect(lambda: self.spinstate("rr", self.rrsb))
-        l1.addWidget(self.rrsb)
-        l1.addWidget(self.rrcb)
-        self.rrvalLabel = QLabel("0")
-        l1.addWidget(QLabel("Value:"))
-        l1.addWidget(self.rrvalLabel)
-        layout.addLayout(l1)
-
-        l2 = QHBoxLayout()
-        l2.addWidget(QLabel("Right Pitch"))
-        self.rpcb = QCheckBox("Enabled")
-        self.rpcb.setChecked(self.rp_enabled)
-        self.rpcb.stateChanged.connect(lambda: self.btnstate("rp", self.rpcb))
-        l2.addWidget(QLabel("Midi cc:"))
-        self.rpsb = QSpinBox()
-        self.rpsb.setValue(self.rp_ccnum)
-        self.rpsb.valueChanged.connect(lambda: self.spinstate("rp", self.rpsb))
-        l2.addWidget(self.rpsb)
-        l2.addWidget(self.rpcb)
-        self.rpvalLabel = QLabel("0")
-        l2.addWidget(QLabel("Value:"))
-        l2.addWidget(self.rpvalLabel)
-        layout.addLayout(l2)
-
-        l3 = QHBoxLayout()
-        l3.addWidget(QLabel("Right Yaw"))
-        self.rycb = QCheckBox("Enabled")
-        self.rycb.setChecked(self.ry_enabled)
-        self.rycb.stateChanged.connect(lambda: self.btnstate("ry", self.rycb))
-        l3.addWidget(QLabel("Midi cc:"))
-        self.rysb = QSpinBox()
-        self.rysb.setValue(self.ry_ccnum)
-        self.rysb.valueChanged.connect(lambda: self.spinstate("ry", self.rysb))
-        l3.addWidget(self.rysb)
-        l3.addWidget(self.rycb)
-        self.ryvalLabel = QLabel("0")
-        l3.addWidget(QLabel("Value:"))
-        l3.addWidget(self.ryvalLabel)
-        layout.addLayout(l3)
-
-        l4 = QHBoxLayout()
-        l4.addWidget(QLabel("Left Roll"))
-        self.lrcb = QCheckBox("Enabled")
-        self.lrcb.setChecked(self.lr_enabled)
-        self.lrcb.stateChanged.connect(lambda: self.btnstate("lr", self.lrcb))
-        l4.addWidget(QLabel("Midi cc:"))
-        self.lrsb = QSpinBox()
-        self.lrsb.setValue(self.lr_ccnum)
-        self.lrsb.valueChanged.connect(lambda: self.spinstate("lr", self.lrsb))
-        l4.addWidget(self.lrsb)
-        l4.addWidget(self.lrcb)
-        self.lrvalLabel = QLabel("0")
-        l4.addWidget(QLabel("Value:"))
-        l4.addWidget(self.lrvalLabel)
-        layout.addLayout(l4)
-
-        l5 = QHBoxLayout()
-        l5.addWidget(QLabel("Left Pitch"))
-        self.lpcb = QCheckBox("Enabled")
-        self.lpcb.setChecked(self.lp_enabled)
-        self.lpcb.stateChanged.connect(lambda: self.btnstate("lp", self.lpcb))
-        l5.addWidget(QLabel("Midi cc:"))
-        self.lpsb = QSpinBox()
-        self.lpsb.setValue(self.lp_ccnum)
-        self.lpsb.valueChanged.connect(lambda: self.spinstate("lp", self.lpsb))
-        l5.addWidget(self.lpsb)
-        l5.addWidget(self.lpcb)
-        self.lpvalLabel = QLabel("0")
-        l5.addWidget(QLabel("Value:"))
-        l5.addWidget(self.lpvalLabel)
-        layout.addLayout(l5)
-
-        l6 = QHBoxLayout()
-        l6.addWidget(QLabel("Left Yaw"))
-        self.lycb = QCheckBox("Enabled")
-        self.lycb.setChecked(self.ly_enabled)
-        self.lycb.stateChanged.connect(lambda: self.btnstate("ly", self.lycb))
-        l6.addWidget(QLabel("Midi cc:"))
-        self.lysb = QSpinBox()
-        self.lysb.setValue(self.ly_ccnum)
-        self.lysb.valueChanged.connect(lambda: self.spinstate("ly", self.lysb))
-        l6.addWidget(self.lysb)
-        l6.addWidget(self.lycb)
-        self.lyvalLabel = QLabel("0")
-        l6.addWidget(QLabel("Value:"))
-        l6.addWidget(self.lyvalLabel)
-        layout.addLayout(l6)
+    def endFrame(self):
+        self.router.evaluate(self)
 
-        self.widget.setLayout(layout)
+    def fingerConnection(self, finger, con):
+        # a note takes its velocity from the samples before it
+        self.router.evaluate(self)
+        self.router.finger(FINGER_INDEX[finger], con, self)
 
-    def btnstate(self, ax, cb):
-        if ax == "rr":
-            self.rr_enabled = cb.isChecked()
-        elif ax == "rp":
-            self.rp_enabled = cb.isChecked()
-        elif ax == "ry":
-            self.ry_enabled = cb.isChecked()
-        elif ax == "lr":
-            self.lr_enabled = cb.isChecked()
-        elif ax == "lp":
-            self.lp_enabled = cb.isChecked()
-        elif ax == "ly":
-            self.ly_enabled = cb.isChecked()
-
-    def spinstate(self, ax, sb):
-        if ax == "rr":
-            self.rr_ccnum = sb.value()
-        elif ax == "rp":
-            self.rp_ccnum = sb.value()
-        elif ax == "ry":
-            self.ry_ccnum = sb.value()
-        elif ax == "lr":
-            self.lr_ccnum = sb.value()
-        elif ax == "lp":
-            self.lp_ccnum = sb.value()
-        elif ax == "ly":
-            self.ly_ccnum = sb.value()
+    def _axisChanged(self, side, axis, val):
+        # the other two axes keep the values the router last saw
+        o = MappingEngine.SIDE_SOURCE_OFFSET[side]
+        values = self.router.values[o:o + 3].copy()
+        values[axis] = val
+        self.router.update(side, values, [a == axis for a in range(3)], self)
 
     def rightRollChanged(self, val):
-        self.rrvalLabel.setText(str(int(val*127)))
-        if self.rr_enabled:
-            self.cc(self.rr_ccnum, int(val*127))
+        self._axisChanged("R", 0, val)
 
     def rightPitchChanged(self, val):
-        self.rpvalLabel.setText(str(int(val*127)))
-        if self.rp_enabled:
-            self.cc(self.rp_ccnum, int(val*127))
+        self._axisChanged("R", 1, val)
 
     def rightYawChanged(self, val):
-        self.ryvalLabel.setText(str(int(val*127)))
-        if self.ry_enabled:
-            self.cc(self.ry_ccnum, int(val*127))
+        self._axisChanged("R", 2, val)
 
     def leftRollChanged(self, val):
-        self.lrvalLabel.setText(str(int(val*127)))
-        if self.lr_enabled:
-            self.cc(self.lr_ccnum, int(val*127))
+        self._axisChanged("L", 0, val)
 
     def leftPitchChanged(self, val):
-        self.lpvalLabel.setText(str(int(val*127)))
-        if self.lp_enabled:
-            self.cc(self.lp_ccnum, int(val*127))
+        self._axisChanged("L", 1, val)
 
     def leftYawChanged(self, val):
-        self.lyvalLabel.setText(str(int(val*127)))
-        if self.ly_enabled:
-            self.cc(self.ly_ccnum, int(val*127))
+        self._axisChanged("L", 2, val)
+
+    def addAxisRow(self, layout, route, resolution=False):
+        """
+        Enabled box, cc number and value of a route, and its resolution if asked for
+        """
+        t = self.table
+        l = QHBoxLayout()
+        l.addWidget(QLabel(MappingEngine.SOURCE_NAMES[t.source[route]]))
+        cb = QCheckBox("Enabled")
+        cb.setChecked(bool(t.enabled[route]))
+        cb.stateChanged.connect(lambda: t.set(route, enabled=cb.isChecked()))
+        l.addWidget(QLabel("Midi cc:"))
+        sb = QSpinBox()
+        sb.setValue(int(t.number[route]))
+        sb.valueChanged.connect(lambda val: t.set(route, number=val))
+        l.addWidget(sb)
+        l.addWidget(cb)
+        if resolution:
+            rescb = QComboBox()
+            rescb.addItems(self.RESOLUTION_OPTIONS)
+            rescb.setCurrentIndex(int(t.resolution[route]))
+            rescb.currentIndexChanged.connect(lambda idx: self.resolutionstate(route, sb, idx))
+            l.addWidget(rescb)
+        self.valueLabels[route] = QLabel("0")
+        l.addWidget(QLabel("Value:"))
+        l.addWidget(self.valueLabels[route])
+        layout.addLayout(l)
+
+    def resolutionstate(self, route, sb, idx):
+        # 14 bit CCs only exist for controllers 0-31
+        if idx == self.RES_CC14:
+            sb.setMaximum(31)
+        else:
+            sb.setMaximum(99)
+        self.table.set(route, resolution=idx)
+
+    def refreshWidget(self):
+        routes = list(self.valueLabels)
+        vals = self.table.transform(routes, self.router.values)
+        for route, v in zip(routes, vals):
+            self.valueLabels[route].setText(str(int(v*127)))
 
 
-class ToyMidiMap(MIDIMapping):
+class M1(TableMapping):
     def __init__(self, midiport):
-        super().__init__(midiport)
+        super().__init__(midiport, MappingEngine.ccPreset())
+        self.initWidget()
+
+    def initWidget(self):
+        layout = QVBoxLayout()
+        for route in range(6):
+            self.addAxisRow(layout, route, resolution=True)
+        self.widget.setLayout(layout)
+
+
+class ToyMidiMap(TableMapping):
+    def __init__(self, midiport):
+        super().__init__(midiport, MappingEngine.ccPreset())
 
         self.rootNote = 60
         self.SCALE_MODES = ["Major Pentatonic", "Minor Pentatonic",
                             "Major", "Minor", "Mixolydian", "Blues"]
         self.setScaleMode(0)
 
-        self.leftNoteVelocity = 127
-        self.rightNoteVelocity = 127
-
-        self.rr_ccnum = 22
-        self.rp_ccnum = 23
-        self.ry_ccnum = 24
-        self.rr_enabled = True
-        self.rp_enabled = True
-        self.ry_enabled = True
-
-        self.lr_ccnum = 25
-        self.lp_ccnum = 26
-        self.ly_ccnum = 27
-        self.lr_enabled = True
-        self.lp_enabled = True
-        self.ly_enabled = True
-
         self.VELOCITY_CONTROL_OPTIONS = ["Right Pitch", "Right Roll",
                                          "Right Yaw", "Left Pitch", "Left Roll", "Left Yaw", "127"]
+        # one velocity route per hand, disabled while the option is "127"
         self.lvelctrl = 6
         self.rvelctrl = 6
+        self.velocityRoutes = {
+            "l": self.table.add(0, MappingEngine.TARGET_VELOCITY, MappingEngine.VELOCITY_LEFT, enabled=False),
+            "r": self.table.add(0, MappingEngine.TARGET_VELOCITY, MappingEngine.VELOCITY_RIGHT, enabled=False)}
 
         self.initWidget()
 
@@ -284,115 +314,27 @@ class ToyMidiMap(MIDIMapping):
         lh.addWidget(scb)
         layout.addLayout(lh)
 
-        l1 = QHBoxLayout()
-        l1.addWidget(QLabel("Right Roll"))
-        self.rrcb = QCheckBox("Enabled")
-        self.rrcb.setChecked(self.rr_enabled)
-        self.rrcb.stateChanged.connect(lambda: self.btnstate("rr", self.rrcb))
-        l1.addWidget(QLabel("Midi cc:"))
-        self.rrsb = QSpinBox()
-        self.rrsb.setValue(self.rr_ccnum)
-        self.rrsb.valueChanged.connect(lambda: self.spinstate("rr", self.rrsb))
-        l1.addWidget(self.rrsb)
-        l1.addWidget(self.rrcb)
-        self.rrvalLabel = QLabel("0")
-        l1.addWidget(QLabel("Value:"))
-        l1.addWidget(self.rrvalLabel)
-        layout.addLayout(l1)
-
-        l2 = QHBoxLayout()
-        l2.addWidget(QLabel("Right Pitch"))
-        self.rpcb = QCheckBox("Enabled")
-        self.rpcb.setChecked(self.rp_enabled)
-        self.rpcb.stateChanged.connect(lambda: self.btnstate("rp", self.rpcb))
-        l2.addWidget(QLabel("Midi cc:"))
-        self.rpsb = QSpinBox()
-        self.rpsb.setValue(self.rp_ccnum)
-        self.rpsb.valueChanged.connect(lambda: self.spinstate("rp", self.rpsb))
-        l2.addWidget(self.rpsb)
-        l2.addWidget(self.rpcb)
-        self.rpvalLabel = QLabel("0")
-        l2.addWidget(QLabel("Value:"))
-        l2.addWidget(self.rpvalLabel)
-        layout.addLayout(l2)
-
-        l3 = QHBoxLayout()
-        l3.addWidget(QLabel("Right Yaw"))
-        self.rycb = QCheckBox("Enabled")
-        self.rycb.setChecked(self.ry_enabled)
-        self.rycb.stateChanged.connect(lambda: self.btnstate("ry", self.rycb))
-        l3.addWidget(QLabel("Midi cc:"))
-        self.rysb = QSpinBox()
-        self.rysb.setValue(self.ry_ccnum)
-        self.rysb.valueChanged.connect(lambda: self.spinstate("ry", self.rysb))
-        l3.addWidget(self.rysb)
-        l3.addWidget(self.rycb)
-        self.ryvalLabel = QLabel("0")
-        l3.addWidget(QLabel("Value:"))
-        l3.addWidget(self.ryvalLabel)
-        layout.addLayout(l3)
+        for route in range(3):
+            self.addAxisRow(layout, route)
 
         l7 = QHBoxLayout()
         l7.addWidget(QLabel("Right Velocity Control"))
         self.rvcb = QComboBox()
         self.rvcb.addItems(self.VELOCITY_CONTROL_OPTIONS)
+        self.rvcb.setCurrentIndex(self.rvelctrl)
         self.rvcb.currentIndexChanged.connect(
             lambda idx: self.velocityControlState("r", self.rvcb, idx))
         l7.addWidget(self.rvcb)
         layout.addLayout(l7)
 
-        l4 = QHBoxLayout()
-        l4.addWidget(QLabel("Left Roll"))
-        self.lrcb = QCheckBox("Enabled")
-        self.lrcb.setChecked(self.lr_enabled)
-        self.lrcb.stateChanged.connect(lambda: self.btnstate("lr", self.lrcb))
-        l4.addWidget(QLabel("Midi cc:"))
-        self.lrsb = QSpinBox()
-        self.lrsb.setValue(self.lr_ccnum)
-        self.lrsb.valueChanged.connect(lambda: self.spinstate("lr", self.lrsb))
-        l4.addWidget(self.lrsb)
-        l4.addWidget(self.lrcb)
-        self.lrvalLabel = QLabel("0")
-        l4.addWidget(QLabel("Value:"))
-        l4.addWidget(self.lrvalLabel)
-        layout.addLayout(l4)
-
-        l5 = QHBoxLayout()
-        l5.addWidget(QLabel("Left Pitch"))
-        self.lpcb = QCheckBox("Enabled")
-        self.lpcb.setChecked(self.lp_enabled)
-        self.lpcb.stateChanged.connect(lambda: self.btnstate("lp", self.lpcb))
-        l5.addWidget(QLabel("Midi cc:"))
-        self.lpsb = QSpinBox()
-        self.lpsb.setValue(self.lp_ccnum)
-        self.lpsb.valueChanged.connect(lambda: self.spinstate("lp", self.lpsb))
-        l5.addWidget(self.lpsb)
-        l5.addWidget(self.lpcb)
-        self.lpvalLabel = QLabel("0")
-        l5.addWidget(QLabel("Value:"))
-        l5.addWidget(self.lpvalLabel)
-        layout.addLayout(l5)
-
-        l6 = QHBoxLayout()
-        l6.addWidget(QLabel("Left Yaw"))
-        self.lycb = QCheckBox("Enabled")
-        self.lycb.setChecked(self.ly_enabled)
-        self.lycb.stateChanged.connect(lambda: self.btnstate("ly", self.lycb))
-        l6.addWidget(QLabel("Midi cc:"))
-        self.lysb = QSpinBox()
-        self.lysb.setValue(self.ly_ccnum)
-        self.lysb.valueChanged.connect(lambda: self.spinstate("ly", self.lysb))
-        l6.addWidget(self.lysb)
-        l6.addWidget(self.lycb)
-        self.lyvalLabel = QLabel("0")
-        l6.addWidget(QLabel("Value:"))
-        l6.addWidget(self.lyvalLabel)
-        layout.addLayout(l6)
+        for route in range(3, 6):
+            self.addAxisRow(layout, route)
 
         l8 = QHBoxLayout()
         l8.addWidget(QLabel("Left Velocity Control"))
         self.lvcb = QComboBox()
         self.lvcb.addItems(self.VELOCITY_CONTROL_OPTIONS)
+        self.lvcb.setCurrentIndex(self.lvelctrl)
         self.lvcb.currentIndexChanged.connect(
             lambda idx: self.velocityControlState("l", self.lvcb, idx))
         l8.addWidget(self.lvcb)
@@ -411,6 +353,7 @@ class ToyMidiMap(MIDIMapping):
     def setRootNote(self, val):
         self.rootNote = val
         self.rootNoteNameLabel.setText(self.noteNameForVal(val))
+        MappingEngine.scalePreset(self.rootNote, self.scaleOffsets, self.table)
 
     def setScaleMode(self, idx):
         self.scale_mode = self.SCALE_MODES[idx]
@@ -433,132 +376,25 @@ class ToyMidiMap(MIDIMapping):
         elif self.scale_mode == "Blues":
             self.scaleOffsets = [0, 3, 5, 6, 7, 10, 12, 15,
                                  24, 27, 29, 30, 31, 34, 36, 39]
-
-    def fingerConnection(self, finger, con):
-        noteidx = self.getNoteIdxForFingerName(finger)
-        noteval = self.getNoteValForNoteIdx(noteidx)
-        if con:
-            vel = self.leftNoteVelocity
-            if finger[0] == "R":
-                vel = self.rightNoteVelocity
-            self.startNote(pitch=noteval, vel=vel)
-        else:
-            self.stopNote(pitch=noteval)
+        MappingEngine.scalePreset(self.rootNote, self.scaleOffsets, self.table)
 
     def getNoteIdxForFingerName(self, finger):
-        ret = 0
-        if finger[0] == "R":
-            ret += 8
-
-        if finger[2] == "P":
-            ret += 4
-
-        if finger[1] == "M":
-            ret += 1
-        elif finger[1] == "R":
-            ret += 2
-        elif finger[1] == "P":
-            ret += 3
-
-        return ret
+        return FINGER_INDEX[finger]
 
     def getNoteValForNoteIdx(self, idx):
         return self.rootNote + self.scaleOffsets[idx]
 
-    def rightRollChanged(self, val):
-        self.rrvalLabel.setText(str(int(val*127)))
-        if self.rr_enabled:
-            self.cc(self.rr_ccnum, int(val*127))
-
-        if self.VELOCITY_CONTROL_OPTIONS[self.lvelctrl] == "Right Roll":
-            self.leftNoteVelocity = int(val*127)
-        if self.VELOCITY_CONTROL_OPTIONS[self.rvelctrl] == "Right Roll":
-            self.rightNoteVelocity = int(val*127)
-
-    def rightPitchChanged(self, val):
-        self.rpvalLabel.setText(str(int(val*127)))
-        if self.rp_enabled:
-            self.cc(self.rp_ccnum, int(val*127))
-
-        if self.VELOCITY_CONTROL_OPTIONS[self.lvelctrl] == "Right Pitch":
-            self.leftNoteVelocity = int(val*127)
-        if self.VELOCITY_CONTROL_OPTIONS[self.rvelctrl] == "Right Pitch":
-            self.rightNoteVelocity = int(val*127)
-
-    def rightYawChanged(self, val):
-        self.ryvalLabel.setText(str(int(val*127)))
-        if self.ry_enabled:
-            self.cc(self.ry_ccnum, int(val*127))
-
-        if self.VELOCITY_CONTROL_OPTIONS[self.lvelctrl] == "Right Yaw":
-            self.leftNoteVelocity = int(val*127)
-        if self.VELOCITY_CONTROL_OPTIONS[self.rvelctrl] == "Right Yaw":
-            self.rightNoteVelocity = int(val*127)
-
-    def leftRollChanged(self, val):
-        self.lrvalLabel.setText(str(int(val*127)))
-        if self.lr_enabled:
-            self.cc(self.lr_ccnum, int(val*127))
-
-        if self.VELOCITY_CONTROL_OPTIONS[self.lvelctrl] == "Left Roll":
-            self.leftNoteVelocity = int(val*127)
-        if self.VELOCITY_CONTROL_OPTIONS[self.rvelctrl] == "Left Roll":
-            self.rightNoteVelocity = int(val*127)
-
-    def leftPitchChanged(self, val):
-        self.lpvalLabel.setText(str(int(val*127)))
-        if self.lp_enabled:
-            self.cc(self.lp_ccnum, int(val*127))
-
-        if self.VELOCITY_CONTROL_OPTIONS[self.lvelctrl] == "Left Pitch":
-            self.leftNoteVelocity = int(val*127)
-        if self.VELOCITY_CONTROL_OPTIONS[self.rvelctrl] == "Left Pitch":
-            self.rightNoteVelocity = int(val*127)
-
-    def leftYawChanged(self, val):
-        self.lyvalLabel.setText(str(int(val*127)))
-        if self.ly_enabled:
-            self.cc(self.ly_ccnum, int(val*127))
-
-        if self.VELOCITY_CONTROL_OPTIONS[self.lvelctrl] == "Left Yaw":
-            self.leftNoteVelocity = int(val*127)
-        if self.VELOCITY_CONTROL_OPTIONS[self.rvelctrl] == "Left Yaw":
-            self.rightNoteVelocity = int(val*127)
-
-    def btnstate(self, ax, cb):
-        if ax == "rr":
-            self.rr_enabled = cb.isChecked()
-        elif ax == "rp":
-            self.rp_enabled = cb.isChecked()
-        elif ax == "ry":
-            self.ry_enabled = cb.isChecked()
-        elif ax == "lr":
-            self.lr_enabled = cb.isChecked()
-        elif ax == "lp":
-            self.lp_enabled = cb.isChecked()
-        elif ax == "ly":
-            self.ly_enabled = cb.isChecked()
-
-    def spinstate(self, ax, sb):
-        if ax == "rr":
-            self.rr_ccnum = sb.value()
-        elif ax == "rp":
-            self.rp_ccnum = sb.value()
-        elif ax == "ry":
-            self.ry_ccnum = sb.value()
-        elif ax == "lr":
-            self.lr_ccnum = sb.value()
-        elif ax == "lp":
-            self.lp_ccnum = sb.value()
-        elif ax == "ly":
-            self.ly_ccnum = sb.value()
-
     def velocityControlState(self, side, cb, idx):
         if side == "l":
             self.lvelctrl = idx
-            if self.VELOCITY_CONTROL_OPTIONS[self.lvelctrl] == "127":
-                self.leftNoteVelocity = 127
-        elif side == "r":
+            register = MappingEngine.VELOCITY_LEFT
+        else:
             self.rvelctrl = idx
-            if self.VELOCITY_CONTROL_OPTIONS[self.rvelctrl] == "127":
-                self.rightNoteVelocity = 127
+            register = MappingEngine.VELOCITY_RIGHT
+        option = self.VELOCITY_CONTROL_OPTIONS[idx]
+        route = self.velocityRoutes[side]
+        if option == "127":
+            self.table.set(route, enabled=False)
+            self.router.velocity[register] = 127
+        else:
+            self.table.set(route, source=MappingEngine.SOURCE_NAMES.index(option), enabled=True)
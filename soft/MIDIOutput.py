@@ -0,0 +1,115 @@
+"""
+MIDI output on a dedicated sender thread.
+
+MIDIOutputEngine has the same send_message as an rtmidi port, so mappings use it in place of one.
+Messages are sent in priority order: note on/off (and anything else that isn't continuous) first,
+in the order they came in, then control changes and pitch bends. A CC still waiting to go out is
+replaced by a newer value for the same channel and controller, so a backed up port only ever sends
+the latest value instead of a queue of stale ones. send_group does the same for multi message
+values (14 bit CC pairs, NRPN), which always go out together and in order.
+
+If sampleTimeFunc is given it's called when a message is queued and should return the time.time()
+the board sample behind it was made (SampleConsumer.sampleTime: the read from the port, or for
+version 2 frames their board time on the host clock). The time from then to the port write, so
+serial, decoding and the handoff between threads included, is kept for getLatencyStats.
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from rtmidi.midiconstants import CONTROL_CHANGE, PITCH_BEND
+
+import ThreadExtension
+
+
+class MIDIOutputEngine(ThreadExtension.StoppableThread):
+
+    STOP_POLL_DELAY = 0.1  # seconds
+    LATENCY_HISTORY_LEN = 1000
+
+    def __init__(self, midiport, sampleTimeFunc=None):
+        super().__init__()
+        self.midiport = midiport
+        self.sampleTimeFunc = sampleTimeFunc
+
+        self._cond = threading.Condition()
+        self._notes = deque()
+        # (status, controller) or group key -> (messages, sample time). dicts keep insertion order,
+        # and replacing a value doesn't move it, so a merged CC keeps its place in line
+        self._continuous = dict()
+
+        self.sentCount = 0
+        self.mergedCount = 0
+        self._latencies = deque(maxlen=self.LATENCY_HISTORY_LEN)
+
+    def _sampleTime(self):
+        if self.sampleTimeFunc is not None:
+            return self.sampleTimeFunc()
+        return time.time()
+
+    def send_message(self, message):
+        status = message[0] & 0xF0
+        if status == CONTROL_CHANGE:
+            self._queueContinuous([message], (message[0], message[1]))
+        elif status == PITCH_BEND:
+            self._queueContinuous([message], (message[0], None))
+        else:
+            t = self._sampleTime()
+            with self._cond:
+                self._notes.append(([message], t))
+                self._cond.notify()
+
+    def send_group(self, messages, key):
+        """
+        messages are sent back to back, a pending group with the same key is replaced
+        """
+        self._queueContinuous(messages, ("group",) + tuple(key))
+
+    def _queueContinuous(self, messages, key):
+        t = self._sampleTime()
+        with self._cond:
+            if key in self._continuous:
+                self.mergedCount += 1
+            self._continuous[key] = (messages, t)
+            self._cond.notify()
+
+    def _nextMessage(self):
+        # called with _cond held
+        if len(self._notes) > 0:
+            return self._notes.popleft()
+        if len(self._continuous) > 0:
+            key = next(iter(self._continuous))
+            return self._continuous.pop(key)
+        return None
+
+    def run(self):
+        while not self.req_stop():
+            with self._cond:
+                m = self._nextMessage()
+                if m is None:
+                    self._cond.wait(self.STOP_POLL_DELAY)
+                    continue
+
+            messages, t = m
+            for message in messages:
+                self.midiport.send_message(message)
+            self.sentCount += len(messages)
+            self._latencies.append(time.time() - t)
+
+    def stop(self):
+        super().stop()
+        with self._cond:
+            self._cond.notify()
+
+    def getLatencyStats(self):
+        """
+        Sample to port write latency over the last LATENCY_HISTORY_LEN messages, in ms
+        """
+        if len(self._latencies) == 0:
+            return None
+        l = np.array(self._latencies) * 1000
+        return {"count": len(l), "mean": np.mean(l), "median": np.median(l),
+                "p99": np.percentile(l, 99), "max": np.max(l),
+                "sent": self.sentCount, "merged": self.mergedCount}
@@ -0,0 +1,364 @@
+"""
+Table driven glove to MIDI mapping.
+
+A RoutingTable holds every route as a row of plain arrays: which source axis it reads, the input
+range taken from it and the output range it's scaled to, and its target, a CC (at any of
+MIDIMapping's resolutions) or a note velocity register. Finger routes are a second table, one
+row per finger (indexed like PacketDecoder.Fingers) with the note it plays, its channel and the
+velocity register it takes its velocity from.
+
+Router takes the samples of both hands with stage and evaluates the table once per frame, the
+samples delivered together, with evaluate. The routes reading axes that changed are looked up by
+the changed mask, all scaled in one go and sent, so a frame costs O(routes it actually touches) and
+no strings are compared anywhere. Everything a mask's routes need is gathered into a RouteSlice the
+first time the mask comes up, with its own work buffers, so evaluating allocates no arrays. Tables
+are edited from the GUI thread while the MIDI thread evaluates them, the lookup is rebuilt and
+swapped in whole.
+
+Presets build the tables for the mappings that used to be written out per axis (see MIDI.M1 and
+MIDI.ToyMidiMap). Drag.DragMap and ControlSurface.C1 aren't tables: their controls move by how far
+the hand turned since a finger grabbed them, and C1 sends Live mixer values over OSC, not MIDI.
+"""
+
+import time
+
+import numpy as np
+
+SOURCE_NAMES = ["Left Roll", "Left Pitch", "Left Yaw", "Right Roll", "Right Pitch", "Right Yaw"]
+NUM_SOURCES = len(SOURCE_NAMES)
+# index of a hand's roll in the source values, pitch and yaw follow
+SIDE_SOURCE_OFFSET = {"L": 0, "R": 3}
+
+TARGET_CC = 0
+TARGET_VELOCITY = 1
+
+# velocity registers, the notes of each hand use their own by default
+VELOCITY_LEFT = 0
+VELOCITY_RIGHT = 1
+NUM_VELOCITY_REGISTERS = 2
+
+# same as MIDIMapping.RES_CC7, here so the table doesn't need Qt
+RES_CC7 = 0
+# steps of the value sent at each resolution (7 bit CC, 14 bit CC, NRPN)
+RESOLUTION_STEPS = np.array([127, 16383, 16383])
+
+NUM_FINGERS = 16
+
+
+class RoutingTable:
+    def __init__(self, capacity=8):
+        self.count = 0
+        # bumped on every change, see Router
+        self.version = 0
+        self._alloc(capacity)
+
+        self.notes = np.full(NUM_FINGERS, -1, dtype=np.int16)
+        self.noteChannel = np.zeros(NUM_FINGERS, dtype=np.int8)
+        # fingers 0-7 are the left hand
+        self.noteVelocity = np.where(np.arange(NUM_FINGERS) < NUM_FINGERS // 2, VELOCITY_LEFT, VELOCITY_RIGHT).astype(np.int8)
+
+        self._rebuild()
+
+    # name, dtype and default of each per route array
+    FIELDS = [("source", np.int8, 0), ("target", np.int8, TARGET_CC),
+              ("number", np.int16, 0),  # cc number, nrpn parameter or velocity register
+              ("channel", np.int8, 0), ("resolution", np.int8, RES_CC7),
+              ("inLo", float, 0.0), ("inHi", float, 1.0), ("outLo", float, 0.0), ("outHi", float, 1.0),
+              ("enabled", bool, False), ("used", bool, False)]
+
+    def _alloc(self, capacity):
+        for name, dtype, default in self.FIELDS:
+            a = np.full(capacity, default, dtype=dtype)
+            if hasattr(self, name):
+                old = getattr(self, name)
+                a[:len(old)] = old
+            setattr(self, name, a)
+
+    def add(self, source, target=TARGET_CC, number=0, channel=0, resolution=RES_CC7, inRange=(0.0, 1.0),
+            outRange=(0.0, 1.0), enabled=True):
+        """
+        Returns the new route's index, which stays the same until it's removed
+        """
+        free = np.flatnonzero(~self.used[:self.count])
+        if len(free) > 0:
+            i = int(free[0])
+        else:
+            if self.count == len(self.used):
+                self._alloc(2 * len(self.used))
+            i = self.count
+            self.count += 1
+        self.used[i] = True
+        self.set(i, source=source, target=target, number=number, channel=channel, resolution=resolution,
+                 inRange=inRange, outRange=outRange, enabled=enabled)
+        return i
+
+    def remove(self, i):
+        self.used[i] = False
+        self._rebuild()
+
+    def set(self, i, **fields):
+        """
+        Changes any of add's arguments of route i
+        """
+        if "inRange" in fields:
+            self.inLo[i], self.inHi[i] = fields.pop("inRange")
+        if "outRange" in fields:
+            self.outLo[i], self.outHi[i] = fields.pop("outRange")
+        for k, v in fields.items():
+            getattr(self, k)[i] = v
+        self._rebuild()
+
+    def setNote(self, finger, note, channel=0, velocity=None):
+        """
+        note -1 leaves the finger silent, velocity is the register it takes its velocity from
+        """
+        self.notes[finger] = note
+        self.noteChannel[finger] = channel
+        if velocity is not None:
+            self.noteVelocity[finger] = velocity
+
+    def routes(self):
+        return np.flatnonzero(self.used[:self.count])
+
+    def _rebuild(self):
+        live = self.used[:self.count] & self.enabled[:self.count]
+        bySource = [np.flatnonzero(live & (self.source[:self.count] == s)) for s in range(NUM_SOURCES)]
+        # swapped in whole, a Router on another thread sees either the old lookup or the new one
+        self._lookup = (bySource, dict())
+        self.version += 1
+
+    def routesFor(self, mask):
+        """
+        RouteSlice of the enabled routes reading any source whose bit is set in mask
+        """
+        bySource, byMask = self._lookup
+        routes = byMask.get(mask)
+        if routes is None:
+            ids = np.concatenate([bySource[s] for s in range(NUM_SOURCES) if mask & (1 << s)] + [np.empty(0, dtype=int)])
+            ids.sort()
+            routes = RouteSlice(self, ids)
+            byMask[mask] = routes
+        return routes
+
+    def transform(self, ids, values):
+        """
+        Outputs of routes ids given the source values (NUM_SOURCES,)
+        """
+        lo = self.inLo[ids]
+        span = self.inHi[ids] - lo
+        t = (values[self.source[ids]] - lo) / np.where(span != 0, span, 1.0)
+        t = np.minimum(np.maximum(t, 0.0), 1.0)
+        return self.outLo[ids] + t * (self.outHi[ids] - self.outLo[ids])
+
+
+class RouteSlice:
+    """
+    Routes ids of a table with their fields gathered into contiguous arrays, and buffers to
+    evaluate them in. Only valid for the table version it was made from, and only for one thread.
+    """
+
+    def __init__(self, table, ids):
+        self.ids = ids
+        self.source = table.source[ids].astype(np.intp)
+        self.inLo = table.inLo[ids]
+        span = table.inHi[ids] - self.inLo
+        self.inScale = 1.0 / np.where(span != 0, span, 1.0)
+        self.outLo = table.outLo[ids]
+        self.outSpan = table.outHi[ids] - self.outLo
+        isCC = table.target[ids] == TARGET_CC
+        self.stepScale = np.where(isCC, RESOLUTION_STEPS[table.resolution[ids]], 127).astype(float)
+        # (is a CC, resolution, number, channel) of each route as plain Python values for sending
+        self.sends = list(zip(isCC.tolist(), table.resolution[ids].tolist(), table.number[ids].tolist(),
+                              table.channel[ids].tolist()))
+        # a few routes are quicker as Python floats than through NumPy's per call overhead
+        self.rows = list(zip(ids.tolist(), self.source.tolist(), self.inLo.tolist(), self.inScale.tolist(),
+                             self.outLo.tolist(), self.outSpan.tolist(), self.stepScale.tolist(), self.sends))
+
+        n = len(ids)
+        self.outputs = np.empty(n)
+        self.scaled = np.empty(n)
+        self.steps = np.empty(n, dtype=int)
+        self.lastSteps = np.empty(n, dtype=int)
+        self.moved = np.empty(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def evaluate(self, values):
+        """
+        Outputs (in self.outputs) and output steps (in self.steps) of the routes for the source
+        values (NUM_SOURCES,)
+        """
+        x = self.outputs
+        np.take(values, self.source, out=x)
+        np.subtract(x, self.inLo, out=x)
+        np.multiply(x, self.inScale, out=x)
+        np.maximum(x, 0.0, out=x)
+        np.minimum(x, 1.0, out=x)
+        np.multiply(x, self.outSpan, out=x)
+        np.add(x, self.outLo, out=x)
+        np.multiply(x, self.stepScale, out=self.scaled)
+        # truncates like astype(int), the outputs are never negative
+        np.copyto(self.steps, self.scaled, casting='unsafe')
+
+
+class Router:
+    """
+    Evaluates a RoutingTable into a MIDIMapping's ccValue, startNote and stopNote
+    """
+
+    # up to this many routes are evaluated one by one in plain Python, more in NumPy
+    SCALAR_ROUTES = 32
+
+    def __init__(self, table):
+        self.table = table
+        self.values = np.zeros(NUM_SOURCES)
+        self.velocity = np.full(NUM_VELOCITY_REGISTERS, 127, dtype=int)
+        # note each finger is holding, so a table change doesn't leave one stuck on
+        self.held = np.full(NUM_FINGERS, -1, dtype=int)
+        # each route's last output in steps of its resolution, routes that land on the same step
+        # again aren't sent (MIDIMapping would skip them anyway, this skips the call)
+        self._lastSteps = np.empty(0, dtype=int)
+        self._version = None
+        # sources changed by the samples staged since the last evaluate, a bit per source
+        self._mask = 0
+
+    def stage(self, side, values, changed):
+        """
+        values is a hand's (roll, pitch, yaw), changed which of them changed. Nothing is sent
+        until evaluate.
+        """
+        o = SIDE_SOURCE_OFFSET[side]
+        self.values[o:o + 3] = values
+        self._mask |= (bool(changed[0]) | bool(changed[1]) << 1 | bool(changed[2]) << 2) << o
+
+    def evaluate(self, out):
+        """
+        Sends the outputs of the routes reading any source changed since the last evaluate
+        """
+        mask = self._mask
+        if mask == 0:
+            return
+        self._mask = 0
+        t = self.table
+        if self._version != t.version:
+            # a changed route might now send somewhere else, send everything again
+            self._version = t.version
+            self._lastSteps = np.full(len(t.used), -1)
+        routes = t.routesFor(mask)
+        if len(routes) == 0:
+            return
+        if len(routes) <= self.SCALAR_ROUTES:
+            self._evaluateScalar(routes, out)
+            return
+        routes.evaluate(self.values)
+        np.take(self._lastSteps, routes.ids, out=routes.lastSteps)
+        np.not_equal(routes.steps, routes.lastSteps, out=routes.moved)
+        if not routes.moved.any():
+            return
+        np.put(self._lastSteps, routes.ids, routes.steps)
+        outputs = routes.outputs
+        sends = routes.sends
+        for j in np.flatnonzero(routes.moved).tolist():
+            isCC, resolution, number, channel = sends[j]
+            if isCC:
+                out.ccValue(resolution, number, float(outputs[j]), channel=channel)
+            else:
+                self.velocity[number] = int(outputs[j] * 127)
+
+    def _evaluateScalar(self, routes, out):
+        values = self.values.tolist()
+        lastSteps = self._lastSteps
+        for i, source, inLo, inScale, outLo, outSpan, stepScale, send in routes.rows:
+            x = (values[source] - inLo) * inScale
+            v = outLo + (0.0 if x < 0.0 else 1.0 if x > 1.0 else x) * outSpan
+            step = int(v * stepScale)
+            if step == lastSteps[i]:
+                continue
+            lastSteps[i] = step
+            isCC, resolution, number, channel = send
+            if isCC:
+                out.ccValue(resolution, number, v, channel=channel)
+            else:
+                self.velocity[number] = int(v * 127)
+
+    def update(self, side, values, changed, out):
+        """
+        stage and evaluate in one, for a single sample
+        """
+        self.stage(side, values, changed)
+        self.evaluate(out)
+
+    def finger(self, finger, con, out):
+        t = self.table
+        if con:
+            note = int(t.notes[finger])
+            if note < 0:
+                return
+            self.held[finger] = note
+            out.startNote(pitch=note, vel=int(self.velocity[t.noteVelocity[finger]]))
+        elif self.held[finger] >= 0:
+            out.stopNote(pitch=int(self.held[finger]))
+            self.held[finger] = -1
+
+
+def ccPreset(ccnums=(22, 23, 24, 25, 26, 27), sources=(3, 4, 5, 0, 1, 2)):
+    """
+    One 7 bit CC per axis, routes in the order of sources. The defaults are the old M1 and
+    ToyMidiMap layout: right hand on 22-24, left on 25-27, right hand first.
+    """
+    table = RoutingTable()
+    for s, cc in zip(sources, ccnums):
+        table.add(s, TARGET_CC, cc)
+    return table
+
+
+def scalePreset(rootNote, scaleOffsets, table=None):
+    """
+    Fingers play rootNote + scaleOffsets[finger], each hand with its own velocity register
+    """
+    if table is None:
+        table = RoutingTable()
+    for f in range(NUM_FINGERS):
+        table.setNote(f, rootNote + scaleOffsets[f])
+    return table
+
+
+if __name__ == "__main__":
+    # per sample cost with the preset and with a few hundred routes, into a mapping that only counts
+    class CountingOutput:
+        def __init__(self):
+            self.n = 0
+
+        def ccValue(self, resolution, cc, val, channel=0):
+            self.n += 1
+
+        def startNote(self, pitch=60, vel=112):
+            self.n += 1
+
+        def stopNote(self, pitch=60):
+            self.n += 1
+
+    rng = np.random.default_rng(0)
+    # a random walk like a glove, most samples only move a few routes to a new step
+    values = 0.5 + np.cumsum(rng.normal(0, 0.002, (10000, 3)), axis=0)
+    for name, table in [("preset", ccPreset()), ("300 routes", None)]:
+        if table is None:
+            table = RoutingTable()
+            for i in range(300):
+                table.add(i % NUM_SOURCES, TARGET_CC, i % 120, channel=i // 120, inRange=(0.2, 0.8))
+        r = Router(table)
+        out = CountingOutput()
+        t0 = time.perf_counter()
+        for i, v in enumerate(values):
+            r.update("L" if i % 2 else "R", v, (True, True, True), out)
+        dt = (time.perf_counter() - t0) / len(values)
+        # both hands staged, one evaluate per frame
+        t0 = time.perf_counter()
+        for i in range(0, len(values) - 1, 2):
+            r.stage("R", values[i], (True, True, True))
+            r.stage("L", values[i + 1], (True, True, True))
+            r.evaluate(out)
+        frame = (time.perf_counter() - t0) / (len(values) // 2)
+        print("{}: {:.1f} us per sample, {:.1f} us per two hand frame, {} sends".format(
+            name, dt * 1e6, frame * 1e6, out.n))
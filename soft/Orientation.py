@@ -0,0 +1,219 @@
+"""
+Glove orientation helpers.
+
+The board's angles reach us as turns: PacketDecoder.normalizeGyro maps radians to (g + pi/2) / (2 pi),
+so one full turn is 1.0 and a value 1.0 apart from another is the same direction. Raw values jump
+by a whole turn wherever the IMU wraps (yaw at +-pi for example). Everything here treats them as
+circular and works on single (roll, pitch, yaw) samples and (n, 3) batches alike.
+
+Boards can also send the IMU's quaternion instead of angles (see PacketDecoder). Quaternions are
+(..., 4) arrays of w, x, y, z and the functions for them work on any number of leading dimensions.
+poseAngles turns them into turns measured from a reference pose, which don't lock or flip anywhere
+but half a turn away from it, for everything that takes the board's angles.
+"""
+
+import numpy as np
+
+SIDE_INDEX = {"L": 0, "R": 1}
+
+
+def wrapTurns(x):
+    """
+    Into [0, 1)
+    """
+    return np.mod(x, 1.0)
+
+
+def centerTurns(x, center):
+    """
+    Circular distance from center shifted so center is 0.5, in [0, 1). The wrap ends up half a
+    turn away from center instead of wherever the IMU happens to wrap.
+    """
+    return np.mod(np.asarray(x, dtype=float) - center + 0.5, 1.0)
+
+
+def nearestTurns(x, center):
+    """
+    The same directions as x, each moved by whole turns to within half a turn of center
+    """
+    return center + centerTurns(x, center) - 0.5
+
+
+def unwrapTurns(x, previous=None):
+    """
+    Removes the whole turn jumps between consecutive samples (axis 0) of an (n, 3) batch, continuing
+    from previous, the last unwrapped sample of the batch before, if given
+    """
+    x = np.asarray(x, dtype=float)
+    if previous is not None:
+        x = np.concatenate((np.reshape(previous, (1, -1)), x))
+    steps = np.diff(x, axis=0)
+    steps -= np.round(steps)
+    out = x[0] + np.concatenate((np.zeros((1, x.shape[1])), np.cumsum(steps, axis=0)))
+    if previous is not None:
+        return out[1:]
+    return out
+
+
+def circularMean(x, axis=0):
+    """
+    Mean direction of turns along axis, in [0, 1). A plain mean of samples either side of a wrap
+    lands on the opposite side.
+    """
+    a = 2.0 * np.pi * np.asarray(x, dtype=float)
+    return wrapTurns(np.arctan2(np.mean(np.sin(a), axis=axis), np.mean(np.cos(a), axis=axis)) / (2.0 * np.pi))
+
+
+# the DMP sends Q1, Q2 and Q3 as fixed point with 30 fractional bits
+QUAT_SCALE = 2.0 ** 30
+
+
+def quatFromQ123(q123):
+    """
+    (..., 3) Q1, Q2, Q3 integers as the IMU's DMP sends them to unit quaternions. Q0 (w) is
+    implied by the unit length, and taken as positive like the firmware does.
+    """
+    v = np.asarray(q123, dtype=float) / QUAT_SCALE
+    w = np.sqrt(np.maximum(1.0 - np.sum(v * v, axis=-1, keepdims=True), 0.0))
+    q = np.concatenate((w, v), axis=-1)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def quatToYPR(q):
+    """
+    The same angles in radians, in the same order, that the firmware's quatsToYPR sends:
+    yaw (z), then the x rotation, then the y rotation
+    """
+    q = np.asarray(q, dtype=float)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    ypr = np.empty(q.shape[:-1] + (3,))
+    ypr[..., 0] = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    ypr[..., 1] = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    ypr[..., 2] = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    return ypr
+
+
+def yprToQuat(ypr):
+    """
+    Inverse of quatToYPR, for boards that send angles and for making up test streams
+    """
+    ypr = np.asarray(ypr, dtype=float) / 2.0
+    cz, sz = np.cos(ypr[..., 0]), np.sin(ypr[..., 0])
+    cx, sx = np.cos(ypr[..., 1]), np.sin(ypr[..., 1])
+    cy, sy = np.cos(ypr[..., 2]), np.sin(ypr[..., 2])
+    return np.stack((cx * cy * cz + sx * sy * sz,
+                     sx * cy * cz - cx * sy * sz,
+                     cx * sy * cz + sx * cy * sz,
+                     cx * cy * sz - sx * sy * cz), axis=-1)
+
+
+def quatConjugate(q):
+    q = np.array(q, dtype=float)
+    q[..., 1:] *= -1.0
+    return q
+
+
+def quatMultiply(a, b):
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    return np.stack((aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw), axis=-1)
+
+
+# the IMU's x axis, what poseAngles takes the twist around
+X_AXIS = np.array([1.0, 0.0, 0.0])
+
+
+def relativeRotation(q, reference):
+    """
+    Rotation from the reference pose to q, in the reference pose's frame. Angles taken from it are
+    measured from the reference instead of from wherever the IMU's axes happen to point.
+    """
+    return quatMultiply(quatConjugate(reference), q)
+
+
+def swingTwist(q, axis):
+    """
+    Splits q into a twist around axis (3,) and the swing of that axis that's left, q = swing * twist.
+    Twist around the forearm, for example, doesn't change no matter how the arm is swung, not even
+    pointing straight up where Euler angles lock.
+    """
+    q = np.asarray(q, dtype=float)
+    axis = np.asarray(axis, dtype=float)
+    axis = axis / np.linalg.norm(axis)
+    proj = np.sum(q[..., 1:] * axis, axis=-1, keepdims=True) * axis
+    twist = np.concatenate((q[..., 0:1], proj), axis=-1)
+    norm = np.linalg.norm(twist, axis=-1, keepdims=True)
+    # a half turn swing leaves no twist to speak of, call it none
+    twist = np.where(norm > 1e-9, twist / np.maximum(norm, 1e-9), np.array([1.0, 0.0, 0.0, 0.0]))
+    return quatMultiply(q, quatConjugate(twist)), twist
+
+
+def twistAngle(q, axis):
+    """
+    Angle in radians, in [-pi, pi), of the twist of q around axis
+    """
+    _, twist = swingTwist(q, axis)
+    axis = np.asarray(axis, dtype=float)
+    axis = axis / np.linalg.norm(axis)
+    a = 2.0 * np.arctan2(np.sum(twist[..., 1:] * axis, axis=-1), twist[..., 0])
+    return np.mod(a + np.pi, 2.0 * np.pi) - np.pi
+
+
+def poseAngles(q, reference):
+    """
+    Turns of each pose q from the reference pose, in the order PacketDecoder.normalizeGyro gives the
+    board's angles: the y, x and z rotation, each 0.5 at the reference. The x rotation is the twist
+    around the IMU's x axis, y and z are the rotation vector of the swing of that axis, so pointing
+    it straight up doesn't lock the other angles the way Euler angles do.
+    """
+    swing, twist = swingTwist(relativeRotation(q, reference), X_AXIS)
+    # the shorter way round, swing and -swing are the same rotation
+    swing = swing * np.where(swing[..., 0:1] < 0.0, -1.0, 1.0)
+    v = swing[..., 2:4]
+    s = np.linalg.norm(v, axis=-1, keepdims=True)
+    # 2 atan2(s, w) / s goes to 2 for small swings
+    scale = np.where(s > 1e-9, 2.0 * np.arctan2(s, swing[..., 0:1]) / np.maximum(s, 1e-9), 2.0)
+    x = 2.0 * np.arctan2(twist[..., 1], twist[..., 0])
+    angles = np.stack((v[..., 0] * scale[..., 0], x, v[..., 1] * scale[..., 0]), axis=-1)
+    return wrapTurns(angles / (2.0 * np.pi) + 0.5)
+
+
+class OrientationNormalizer:
+    """
+    Uncalibrated orientation of both gloves: each axis centered on a settable center, 0.5 at the
+    center and wrapping half a turn away from it. Centers start at 0.5, which leaves values as they
+    are apart from the wrap.
+    """
+
+    def __init__(self):
+        self.centers = np.full((2, 3), 0.5)
+        # last raw sample seen on each side, for centering on the current position
+        self.last = np.full((2, 3), np.nan)
+
+    def normalize(self, side, rpy):
+        i = SIDE_INDEX[side]
+        rpy = np.asarray(rpy, dtype=float)
+        self.last[i] = rpy if rpy.ndim == 1 else rpy[-1]
+        return centerTurns(rpy, self.centers[i])
+
+    def setCenter(self, side, rpy=None, axes=(0, 1, 2)):
+        """
+        Centers the given axes on rpy, or on the last sample if rpy is None
+        """
+        i = SIDE_INDEX[side]
+        if rpy is None:
+            rpy = self.last[i]
+        axes = list(axes)
+        if np.any(np.isnan(np.asarray(rpy, dtype=float)[axes])):
+            # nothing received from this side yet
+            return
+        centers = self.centers.copy()
+        centers[i, axes] = wrapTurns(np.asarray(rpy, dtype=float)[axes])
+        # replaced whole so a reader on another thread never sees half an update
+        self.centers = centers
+
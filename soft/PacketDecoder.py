@@ -0,0 +1,639 @@
+"""
+Batch decoding of the 32 byte frames the board sends over serial.
+
+Frame layout (little endian, same as struct format '4b3f6h4b'):
+    4 x int8    finger connection routes (index, middle, ring, pinky)
+    3 x float32 yaw, pitch, roll in radians,
+     or 3 x int32 the IMU's Q1, Q2, Q3 quaternion components if FLAG_QUAT is set
+    6 x int16   raw accel x,y,z and gyro x,y,z readings
+    4 x int8    trailer, 3,2,1 followed by the flags byte: bit 0 is the glove side (0 right, 1 left),
+                bit 1 (FLAG_QUAT) means the frame carries the quaternion instead of angles.
+                Firmware from before gloves knew their side always sends 3,2,1,0 so it reads as a
+                right glove sending angles.
+
+Version 2 frames (40 bytes) start with a header instead and carry a sequence number, the board's
+clock and a CRC, so lost, reordered and corrupted frames can be told apart and latency measured:
+    2 x uint8   magic 0xA5 0x5A
+    uint8       frame version, 2
+    uint8       flags, the same as the last trailer byte of version 1 frames
+    uint16      sequence number, wraps
+    uint32      board time in microseconds (micros()), wraps
+    4 x int8    finger connection routes
+    3 x float32 / int32  orientation, as in version 1
+    6 x int16   raw accel and gyro readings
+    uint16      CRC-16/CCITT-FALSE of everything after the magic up to here
+The decoder takes either version, whichever it finds, and hands out version 2 frames converted to
+FRAME_DTYPE so nothing downstream has to care which one the board sends.
+"""
+
+from collections import deque
+from enum import Enum
+
+import numpy as np
+
+import Orientation
+
+FRAME_DTYPE = np.dtype([('routes', 'i1', (4,)),
+                        ('ypr', '<f4', (3,)),
+                        ('raw', '<i2', (6,)),
+                        ('trailer', 'i1', (4,))])
+
+# the same frame with the orientation read as the quaternion
+QUAT_FRAME_DTYPE = np.dtype([('routes', 'i1', (4,)),
+                             ('q123', '<i4', (3,)),
+                             ('raw', '<i2', (6,)),
+                             ('trailer', 'i1', (4,))])
+
+FRAME_V2_DTYPE = np.dtype([('magic', 'u1', (2,)),
+                           ('version', 'u1'),
+                           ('flags', 'u1'),
+                           ('seq', '<u2'),
+                           ('boardTime', '<u4'),
+                           ('routes', 'i1', (4,)),
+                           ('q123', '<i4', (3,)),
+                           ('raw', '<i2', (6,)),
+                           ('crc', '<u2')])
+V2_MAGIC = bytes([0xA5, 0x5A])
+V2_VERSION = 2
+# bytes covered by the CRC
+V2_CRC_START = 2
+V2_CRC_END = FRAME_V2_DTYPE.fields['crc'][1]
+# boardTime is a 32 bit microsecond counter, it wraps after this many seconds
+BOARD_TIME_WRAP = 2 ** 32 / 1e6
+# seconds between frames of a board that sends no time of its own (version 1 frames)
+FRAME_PERIOD = 0.01
+# once a stream has sent good version 2 frames, this many version 1 frames in a row are needed
+# before the decoder believes the board has switched to version 1
+V1_FALLBACK_FRAMES = 4
+
+TRAILER = bytes([3, 2, 1, 0])
+TRAILER_PREFIX = TRAILER[:3]
+SIDE_RIGHT = 0
+SIDE_LEFT = 1
+SIDE_NAMES = {SIDE_RIGHT: "R", SIDE_LEFT: "L"}
+SIDE_MASK = 1
+FLAG_QUAT = 2
+VALID_FLAGS = (0, 1, 2, 3)
+
+# connection routes as set by the firmware
+ROUTE_NONE = 0
+ROUTE_THUMB = 1
+ROUTE_PALM = 2
+ROUTE_BOTH = 3
+ROUTE_UNKNOWN = 4
+
+
+# the 16 long connection list, a thumb (T) and a palm (P) contact for each finger of each side
+class Fingers(Enum):
+    LIT = 0
+    LMT = 1
+    LRT = 2
+    LPT = 3
+    LIP = 4
+    LMP = 5
+    LRP = 6
+    LPP = 7
+    RIT = 8
+    RMT = 9
+    RRT = 10
+    RPT = 11
+    RIP = 12
+    RMP = 13
+    RRP = 14
+    RPP = 15
+
+
+# index into the 16 long connection list of the first finger of each side
+SIDE_CONNECTION_OFFSET = {"L": 0, "R": 8}
+
+
+def fingerConnections(routes, side="R"):
+    """
+    routes is an (n, 4) array of connection routes, returns an (n, 16) bool array
+    indexed the same way as Fingers
+    """
+    routes = np.asarray(routes)
+    ret = np.zeros((routes.shape[0], 16), dtype=bool)
+    o = SIDE_CONNECTION_OFFSET[side]
+    ret[:, o:o+4] = (routes == ROUTE_THUMB) | (routes == ROUTE_BOTH)
+    ret[:, o+4:o+8] = (routes == ROUTE_PALM) | (routes == ROUTE_BOTH)
+    return ret
+
+
+def normalizeGyro(ypr):
+    """
+    ypr is an (n, 3) array of yaw, pitch, roll in radians as sent by the board.
+    Returns an (n, 3) array of roll, pitch, yaw scaled the same way BoardInteractor always has
+    """
+    p = 3.1415926
+    return (np.asarray(ypr, dtype=float)[:, ::-1] + p/2.0) / (2.0*p)
+
+
+def _crcTable():
+    table = np.zeros(256, dtype=np.uint16)
+    for i in range(256):
+        c = i << 8
+        for _ in range(8):
+            c = ((c << 1) ^ 0x1021) if c & 0x8000 else (c << 1)
+        table[i] = c & 0xFFFF
+    return table
+
+
+CRC_TABLE = _crcTable()
+
+
+def crc16(data):
+    """
+    CRC-16/CCITT-FALSE of each row of an (n, m) uint8 array, a byte at a time for all rows at once
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    crc = np.full(data.shape[0], 0xFFFF, dtype=np.uint16)
+    for i in range(data.shape[1]):
+        crc = (crc << 8) ^ CRC_TABLE[(crc >> 8) ^ data[:, i]]
+    return crc
+
+
+def encodeFrames(routes, ypr, raw, flags):
+    """
+    FRAME_DTYPE frames the way the board sends them, from (n, 4) routes, (n, 3) yaw, pitch, roll
+    in radians (or Q1-Q3 ints with FLAG_QUAT set in flags) and (n, 6) raw readings
+    """
+    frames = np.zeros(len(routes), dtype=FRAME_DTYPE)
+    frames['routes'] = routes
+    if flags & FLAG_QUAT:
+        frames.view(QUAT_FRAME_DTYPE)['q123'] = ypr
+    else:
+        frames['ypr'] = ypr
+    frames['raw'] = raw
+    frames['trailer'][:, 0:3] = np.frombuffer(TRAILER_PREFIX, dtype='i1')
+    frames['trailer'][:, 3] = flags
+    return frames
+
+
+def encodeFramesV2(frames, seq, boardTime):
+    """
+    FRAME_DTYPE frames as version 2 frames, seq and boardTime (microseconds) one per frame
+    """
+    f = np.zeros(len(frames), dtype=FRAME_V2_DTYPE)
+    f['magic'] = np.frombuffer(V2_MAGIC, dtype='u1')
+    f['version'] = V2_VERSION
+    f['flags'] = frames['trailer'][:, 3]
+    f['seq'] = np.asarray(seq, dtype=np.int64) & 0xFFFF
+    f['boardTime'] = np.asarray(boardTime, dtype=np.int64) & 0xFFFFFFFF
+    f['routes'] = frames['routes']
+    f['q123'] = frames.view(QUAT_FRAME_DTYPE)['q123']
+    f['raw'] = frames['raw']
+    b = f.view(np.uint8).reshape((len(f), FRAME_V2_DTYPE.itemsize))
+    f['crc'] = crc16(b[:, V2_CRC_START:V2_CRC_END])
+    return f
+
+
+def encodeFrameV2(routes, orientation, raw, flags, seq, boardTime):
+    """
+    One version 2 frame as bytes, orientation is 3 floats or, with FLAG_QUAT, 3 ints
+    """
+    frames = encodeFrames([routes], [orientation], [raw], flags)
+    return encodeFramesV2(frames, [seq], [boardTime]).tobytes()
+
+
+def validFramesV2(frames):
+    """
+    Bool array of which version 2 frames have the right header and CRC
+    """
+    b = frames.view(np.uint8).reshape((len(frames), FRAME_V2_DTYPE.itemsize))
+    return (frames['magic'][:, 0] == V2_MAGIC[0]) & (frames['magic'][:, 1] == V2_MAGIC[1]) & \
+        (frames['version'] == V2_VERSION) & (frames['flags'] <= max(VALID_FLAGS)) & \
+        (crc16(b[:, V2_CRC_START:V2_CRC_END]) == frames['crc'])
+
+
+def framesFromV2(frames):
+    """
+    Version 2 frames as FRAME_DTYPE, the orientation bytes are copied as they are
+    """
+    out = np.empty(len(frames), dtype=FRAME_DTYPE)
+    out['routes'] = frames['routes']
+    out.view(QUAT_FRAME_DTYPE)['q123'] = frames['q123']
+    out['raw'] = frames['raw']
+    out['trailer'][:, 0:3] = np.frombuffer(TRAILER_PREFIX, dtype='i1')
+    out['trailer'][:, 3] = frames['flags']
+    return out
+
+
+class LinkStats:
+    """
+    Loss, reordering and timing of version 2 frames from their sequence numbers and board clock.
+    Latency can only be measured relative to the fastest frame seen, since the two clocks aren't
+    synchronized, jitter is the spread of that.
+    """
+
+    HISTORY_LEN = 1000
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self._lastSeq = None
+        self._lastBoardTime = None
+        self._boardSeconds = 0.0
+        self._intervals = deque(maxlen=self.HISTORY_LEN)
+        self._offsets = deque(maxlen=self.HISTORY_LEN)
+        self._minOffset = np.inf
+
+    def update(self, seq, boardTime, hostTime=None):
+        """
+        seq and boardTime of each frame in arrival order, hostTime when they arrived
+        """
+        if len(seq) == 0:
+            return
+        self.received += len(seq)
+        # a handful of frames per read, plain python is quicker than setting up arrays
+        for s, t in zip(seq.tolist(), boardTime.tolist()):
+            if self._lastSeq is None:
+                self._lastSeq = s
+                self._lastBoardTime = t
+                continue
+            # signed distance from the newest frame so far, in 16 bit sequence arithmetic
+            d = (s - self._lastSeq + 0x8000) % 0x10000 - 0x8000
+            if d == 0:
+                self.duplicates += 1
+                continue
+            if d < 0:
+                # a frame counted as lost turned up late
+                self.reordered += 1
+                self.lost = max(0, self.lost - 1)
+                continue
+            self.lost += d - 1
+            dt = (t - self._lastBoardTime) % 0x100000000
+            if d == 1:
+                self._intervals.append(dt / 1e6)
+            self._boardSeconds += dt / 1e6
+            self._lastSeq = s
+            self._lastBoardTime = t
+
+        if hostTime is not None:
+            offset = hostTime - self._boardSeconds
+            self._minOffset = min(self._minOffset, offset)
+            self._offsets.append(offset)
+
+    def newestHostTime(self):
+        """
+        When the newest frame was made, on the host clock, or None before any arrived with a time.
+        Board time plus the smallest board to host offset seen, so it's early by the link's
+        fastest transit.
+        """
+        if not np.isfinite(self._minOffset):
+            return None
+        return self._boardSeconds + self._minOffset
+
+    def getStats(self):
+        ret = {"received": self.received, "lost": self.lost, "reordered": self.reordered,
+               "duplicates": self.duplicates,
+               "lossRate": self.lost / max(1, self.received + self.lost)}
+        if len(self._intervals) > 0:
+            i = np.array(self._intervals)
+            ret["boardRate"] = 1.0 / np.mean(i) if np.mean(i) > 0 else None
+            ret["boardIntervalStd"] = np.std(i) * 1000  # ms
+        if len(self._offsets) > 0:
+            l = (np.array(self._offsets) - self._minOffset) * 1000
+            ret["latency"] = {"mean": np.mean(l), "p99": np.percentile(l, 99), "max": np.max(l)}  # ms
+            ret["jitter"] = np.std(l)  # ms
+        return ret
+
+
+class PacketDecoder:
+    """
+    Collects bytes from the board in a reusable buffer and decodes all complete frames at once.
+
+    Frame sync is a small state machine: while synced, every frame's trailer (or header and CRC for
+    version 2) is checked and the good frames before a bad one are returned. On a bad frame the
+    decoder starts searching for the next trailer or header with bytes.find, and picks up again at
+    the first frame that starts after the bad one. A single corrupted byte therefore only costs the
+    frame it landed in. The decoder starts out unsynced since the board may be mid frame when we
+    open the port, and syncs to whichever frame version it finds first. Once it has decoded good
+    version 2 frames it only falls back to version 1 after V1_FALLBACK_FRAMES trailers in a row,
+    a 3, 2, 1 in the data of a damaged version 2 frame shouldn't switch it over.
+
+    For version 1 frames the array returned by decode is a view into the internal buffer, it's only
+    valid until the next call to feed or readFrom. Copy it if you need to keep it around.
+    After each decode, sequence and boardTime hold each returned frame's sequence number and board
+    time in seconds, -1 and nan for version 1 frames. stats has the loss and timing statistics.
+    """
+
+    def __init__(self, bufferSize=4096):
+        self.version = 1
+        self.packetSize = FRAME_DTYPE.itemsize
+        maxPacketSize = max(FRAME_DTYPE.itemsize, FRAME_V2_DTYPE.itemsize)
+        self._buf = bytearray(max(bufferSize, maxPacketSize))
+        self._start = 0
+        self._end = 0
+
+        self.sequence = np.empty(0, dtype=int)
+        self.boardTime = np.empty(0)
+        self.stats = LinkStats()
+
+        self.synced = False
+        self.preferV2 = False
+        self._droppedThisSync = 0
+        self.resyncCount = 0
+        self.droppedBytes = 0
+        self.framesDropped = 0
+
+    def pending(self):
+        return self._end - self._start
+
+    def reset(self):
+        self._start = 0
+        self._end = 0
+        self.stats.reset()
+        self.preferV2 = False
+        self.resync()
+
+    def resync(self):
+        """
+        Forget the current alignment, the next frames are found by searching for the trailer
+        """
+        if self.synced:
+            self.resyncCount += 1
+        self.synced = False
+        self._droppedThisSync = 0
+
+    def newestFrameTime(self, hostTime):
+        """
+        When the newest frame of the last decode was made. Version 2 frames tell from their board
+        time (see LinkStats.newestHostTime), version 1 frames get hostTime, when they were read.
+        """
+        if len(self.boardTime) > 0 and np.isfinite(self.boardTime[-1]):
+            t = self.stats.newestHostTime()
+            if t is not None:
+                return t
+        return hostTime
+
+    def getCounts(self):
+        """
+        What the decoder threw away, and the link statistics once there are any to report
+        """
+        counts = {"dropped": self.framesDropped, "resyncs": self.resyncCount}
+        if self.stats.received > 0:
+            # only boards sending version 2 frames can tell what got lost on the way
+            counts["link"] = self.stats.getStats()
+        return counts
+
+    def feed(self, data):
+        n = len(data)
+        if n == 0:
+            return
+
+        # drop the frames that were already handed out, this is what invalidates old views
+        rem = self._end - self._start
+        if self._start > 0:
+            self._buf[0:rem] = self._buf[self._start:self._end]
+            self._start = 0
+            self._end = rem
+
+        if rem + n > len(self._buf):
+            # a new bytearray instead of resizing, outstanding views keep the old one alive
+            newbuf = bytearray(max(2 * len(self._buf), rem + n))
+            newbuf[0:rem] = self._buf[0:rem]
+            self._buf = newbuf
+
+        self._buf[rem:rem+n] = data
+        self._end = rem + n
+
+    def readFrom(self, board):
+        """
+        Reads everything the board has waiting, blocking until at least one whole frame could be buffered
+        """
+        n = max(board.in_waiting, self.packetSize - self.pending(), 1)
+        self.feed(board.read(n))
+
+    def decode(self, hostTime=None):
+        """
+        Returns a structured array (dtype FRAME_DTYPE) of every complete frame in the buffer that
+        checks out. Leftover bytes of a partial frame are kept for the next call. hostTime is when
+        the bytes arrived, for the latency statistics.
+        """
+        out = []
+        seqs = []
+        while True:
+            if not self.synced and not self._findSync():
+                break
+
+            nframes = self.pending() // self.packetSize
+            if self.version == V2_VERSION:
+                frames = np.frombuffer(self._buf, dtype=FRAME_V2_DTYPE, count=nframes, offset=self._start)
+                valid = validFramesV2(frames)
+            else:
+                frames = np.frombuffer(self._buf, dtype=FRAME_DTYPE, count=nframes, offset=self._start)
+                valid = validFrames(frames)
+
+            nvalid = nframes if np.all(valid) else int(np.argmin(valid))
+            good = frames[:nvalid]
+            if nvalid > 0:
+                self.preferV2 = self.version == V2_VERSION
+            if self.version == V2_VERSION:
+                out.append(framesFromV2(good))
+                seqs.append((good['seq'], good['boardTime']))
+            else:
+                out.append(good)
+                seqs.append((np.full(nvalid, -1), None))
+
+            if nvalid == nframes:
+                self._start += nframes * self.packetSize
+                break
+            # search for the next frame starting at least one byte after the bad one
+            self._start += nvalid * self.packetSize + 1
+            self.resync()
+            self._droppedThisSync = 1
+
+        if len(out) == 0:
+            self.sequence = np.empty(0, dtype=int)
+            self.boardTime = np.empty(0)
+            return np.empty(0, dtype=FRAME_DTYPE)
+
+        self.sequence = np.concatenate([s for s, _ in seqs]).astype(int)
+        self.boardTime = np.concatenate([np.full(len(s), np.nan) if t is None else t / 1e6 for s, t in seqs])
+        for s, t in seqs:
+            if t is not None:
+                self.stats.update(s, t, hostTime)
+
+        if len(out) == 1:
+            return out[0]
+        return np.concatenate(out)
+
+    def _findSync(self):
+        v1 = self._findV1()
+        v2, v2Incomplete = self._findV2()
+        if v1 >= 0 and v2 >= 0 and v1 + FRAME_DTYPE.itemsize > v2:
+            # a trailer found inside a frame with a good CRC is part of its data
+            v1 = -1
+        v1Incomplete = -1
+        if self.preferV2:
+            v1, v1Incomplete = self._confirmV1(v1, v2)
+        candidates = [(p, v) for p, v in ((v1, 1), (v2, V2_VERSION)) if p >= 0]
+        if len(candidates) > 0:
+            p, version = min(candidates)
+        else:
+            p, version = -1, None
+
+        # keep enough bytes that a frame ending in a partial trailer can still be found
+        keep = max(self._start, self._end - (FRAME_DTYPE.itemsize - 1))
+        incomplete = min([i for i in (v1Incomplete, v2Incomplete) if i >= 0], default=-1)
+        if incomplete >= 0 and (p < 0 or incomplete < p):
+            # what may be a frame (or the start of a run of them) hasn't fully arrived yet, wait for it
+            self._drop(min(incomplete, keep))
+            return False
+        if p < 0:
+            self._drop(keep)
+            return False
+
+        self._drop(p)
+        self.version = version
+        self.packetSize = FRAME_V2_DTYPE.itemsize if version == V2_VERSION else FRAME_DTYPE.itemsize
+        self.droppedBytes += self._droppedThisSync
+        self.framesDropped += -(-self._droppedThisSync // self.packetSize)
+        self._droppedThisSync = 0
+        self.synced = True
+        return True
+
+    def _drop(self, newStart):
+        self._droppedThisSync += newStart - self._start
+        self._start = newStart
+
+    def _findV1(self, start=None):
+        """
+        Start of the first version 1 frame at or after start, found by its trailer, or -1
+        """
+        if start is None:
+            start = self._start
+        # the trailer ends a frame, only look for ones whose frame begins at or after start
+        size = FRAME_DTYPE.itemsize
+        p = self._buf.find(TRAILER_PREFIX, start + size - len(TRAILER), self._end - 1)
+        while p >= 0 and self._buf[p + 3] not in VALID_FLAGS:
+            p = self._buf.find(TRAILER_PREFIX, p + 1, self._end - 1)
+        if p < 0:
+            return -1
+        return p + len(TRAILER) - size
+
+    def _confirmV1(self, v1, v2):
+        """
+        Start of the first run of V1_FALLBACK_FRAMES good version 1 frames from v1 on, ending
+        before the version 2 frame at v2, or -1. And the start of a run that may still turn out
+        good once more bytes arrive, or -1.
+        """
+        size = FRAME_DTYPE.itemsize
+        limit = v2 if v2 >= 0 else self._end
+        while v1 >= 0:
+            if v1 + V1_FALLBACK_FRAMES * size > limit:
+                return -1, (v1 if v2 < 0 else -1)
+            frames = np.frombuffer(self._buf, dtype=FRAME_DTYPE, count=V1_FALLBACK_FRAMES, offset=v1)
+            if np.all(validFrames(frames)):
+                return v1, -1
+            v1 = self._findV1(v1 + 1)
+        return -1, -1
+
+    def _findV2(self):
+        """
+        Start of the first version 2 frame with a good CRC or -1, and the start of a header whose
+        frame isn't complete yet or -1
+        """
+        size = FRAME_V2_DTYPE.itemsize
+        p = self._buf.find(V2_MAGIC, self._start, self._end)
+        while p >= 0:
+            if self._end - p < size:
+                # only the version byte can be checked so far
+                if self._end - p < 3 or self._buf[p + 2] == V2_VERSION:
+                    return -1, p
+                return -1, -1
+            frame = np.frombuffer(self._buf, dtype=FRAME_V2_DTYPE, count=1, offset=p)
+            if validFramesV2(frame)[0]:
+                return p, -1
+            p = self._buf.find(V2_MAGIC, p + 1, self._end)
+        return -1, -1
+
+
+def validFrames(frames):
+    """
+    Bool array of which frames end with the expected trailer
+    """
+    t = frames['trailer']
+    return np.all(t[:, 0:3] == np.frombuffer(TRAILER_PREFIX, dtype='i1'), axis=1) & \
+        (t[:, 3] >= 0) & (t[:, 3] <= max(VALID_FLAGS))
+
+
+def frameSide(frame):
+    """
+    "L" or "R" for a single frame, as told by its trailer
+    """
+    return SIDE_NAMES[int(frame['trailer'][3]) & SIDE_MASK]
+
+
+def isQuatFrame(frames):
+    """
+    Bool array of which frames carry the quaternion
+    """
+    return (frames['trailer'][:, 3] & FLAG_QUAT) != 0
+
+
+def frameYPR(frames):
+    """
+    (n, 3) yaw, pitch, roll in radians for every frame, whichever way the board sent them.
+    Quaternion frames are converted the same way the firmware would have.
+    """
+    quat = isQuatFrame(frames)
+    if not np.any(quat):
+        return frames['ypr']
+    # the float view of quaternion frames can be signalling nans, only cast the real angles
+    ypr = np.empty((len(frames), 3))
+    ypr[~quat] = frames['ypr'][~quat]
+    ypr[quat] = Orientation.quatToYPR(Orientation.quatFromQ123(frames.view(QUAT_FRAME_DTYPE)['q123'][quat]))
+    return ypr
+
+
+def frameTimes(t, n, boardTime=None, period=FRAME_PERIOD):
+    """
+    Host times of n frames that were decoded together at time t. The last frame gets t and the
+    ones before it are spaced back by their board time (seconds, as PacketDecoder.boardTime) if
+    they all have one, or by period otherwise.
+    """
+    if boardTime is not None and len(boardTime) == n and n > 0 and np.all(np.isfinite(boardTime)):
+        # signed difference to the last frame, across the counter wrap
+        back = (boardTime[-1] - boardTime + BOARD_TIME_WRAP / 2) % BOARD_TIME_WRAP - BOARD_TIME_WRAP / 2
+    else:
+        back = np.arange(n - 1, -1, -1) * period
+    return t - back
+
+
+def frameQuaternions(frames):
+    """
+    (n, 4) w, x, y, z unit quaternion for every frame. Frames with angles get the quaternion
+    those angles describe, which can't be better than the angles were.
+    """
+    quat = isQuatFrame(frames)
+    q = np.empty((len(frames), 4))
+    q[quat] = Orientation.quatFromQ123(frames.view(QUAT_FRAME_DTYPE)['q123'][quat])
+    q[~quat] = Orientation.yprToQuat(frames['ypr'][~quat])
+    return q
+
+
+if __name__ == "__main__":
+    # link statistics of a version 2 stream with a corrupted, a lost and a late frame, fed in
+    # pieces that don't line up with the frames (tests/test_PacketDecoder.py checks them)
+    rng = np.random.default_rng(0)
+    seqs = [0, 1, 2, 4, 3, 5, 6, 7, 8, 9]
+    data = [encodeFrameV2([1, -1, -1, -1], rng.uniform(-3, 3, 3), np.arange(6), 0, s, 1000 * s + 4294960000)
+            for s in seqs]
+    bad = bytearray(data[7])
+    bad[20] ^= 4
+    data[7] = bytes(bad)
+    stream = bytes(3) + b"".join(data)
+    d = PacketDecoder()
+    t = 0.0
+    for i in range(0, len(stream), 17):
+        d.feed(stream[i:i + 17])
+        t += 0.001
+        d.decode(hostTime=t)
+    print(d.getCounts())
@@ -0,0 +1,97 @@
+"""
+Rate limiting that never drops the last value.
+
+RateLimiter sends a value straight away if its key hasn't sent anything for the key's interval.
+Otherwise the value is held as the key's pending value, merged into the one already pending, and
+sent by flush once the interval is up. A burst costs at most one send per interval per key, and
+its final value still goes out, at most one interval late.
+
+submit and flush have to run on the thread that does the sending, and flush has to be called at
+the deadlines it returns. SampleConsumer.addTimer does that on the MIDI thread. On the GUI thread,
+use a QTimer.singleShot to nextDeadline().
+"""
+
+import time
+
+
+def keepLatest(old, new):
+    return new
+
+
+class RateLimiter:
+    def __init__(self, send, interval=0.0, merge=keepLatest):
+        """
+        send(key, value) does the sending, interval is in seconds, merge(pending, new) combines a
+        held value with a newer one
+        """
+        self.send = send
+        self.interval = interval
+        # keys with their own budget, the rest use interval
+        self.intervals = dict()
+        self.merge = merge
+
+        self._last = dict()
+        self._pending = dict()
+        self.sentCount = 0
+        self.heldCount = 0
+        self.flushedCount = 0
+
+    def setInterval(self, interval, key=None):
+        if key is None:
+            self.interval = interval
+        else:
+            self.intervals[key] = interval
+
+    def submit(self, key, value, now=None):
+        if now is None:
+            now = time.time()
+        if key in self._pending:
+            value = self.merge(self._pending.pop(key), value)
+        last = self._last.get(key)
+        if last is None or now - last >= self.intervals.get(key, self.interval):
+            self._send(key, value, now)
+        else:
+            self._pending[key] = value
+            self.heldCount += 1
+
+    def flush(self, now=None):
+        """
+        Sends the pending values that are due, returns the next deadline or None if nothing is pending
+        """
+        if len(self._pending) == 0:
+            return None
+        if now is None:
+            now = time.time()
+        nextDeadline = None
+        for key in list(self._pending):
+            due = self._last[key] + self.intervals.get(key, self.interval)
+            if now >= due:
+                self._send(key, self._pending.pop(key), now)
+                self.flushedCount += 1
+            elif nextDeadline is None or due < nextDeadline:
+                nextDeadline = due
+        return nextDeadline
+
+    def nextDeadline(self):
+        if len(self._pending) == 0:
+            return None
+        return min(self._last[key] + self.intervals.get(key, self.interval) for key in self._pending)
+
+    def _send(self, key, value, now):
+        self._last[key] = now
+        self.sentCount += 1
+        self.send(key, value)
+
+    def getCounts(self):
+        return {"sent": self.sentCount, "held": self.heldCount, "flushed": self.flushedCount}
+
+
+if __name__ == "__main__":
+    # a 1 kHz gesture through a 30 Hz limit, its end value comes out of flush
+    sent = []
+    r = RateLimiter(lambda key, value: sent.append((key, value)), interval=0.033)
+    for i in range(90):
+        r.submit("fast", i, now=i * 0.001)
+    r.flush(now=0.1)
+    print(sent)
+    print(r.getCounts())
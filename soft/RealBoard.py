@@ -1,14 +1,16 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QSlider, QPushButton, QGridLayout, QButtonGroup, QRadioButton
 from PyQt5.QtCore import Qt, QTimer
-from pubsub import pub
+from EventBus import pub
 
-from BoardInteraction import BoardInteractor
+from BoardManager import BoardManager
 
 
 class RealBoard(QWidget):
 
-    def __init__(self):
+    def __init__(self, bus=pub):
         QWidget.__init__(self)
+        # bus should deliver on the GUI thread, see SampleHandoff.GuiBridge
+        self.bus = bus
 
         self.allfingers = ["LP", "LR", "LM", "LI", "RI", "RM", "RR", "RP"]
         self.initUI()
@@ -55,14 +57,17 @@ class RealBoard(QWidget):
         self.setLayout(layout)
 
     def connectToBoard(self):
-        self.board = BoardInteractor()
+        self.board = BoardManager()
         self.board.start()
 
-        pub.subscribe(self.handleFingerConnection, 'FingerConnection')
-        pub.subscribe(self.handleLGyroData, 'LGyro')
-        pub.subscribe(self.handleRGyroData, 'RGyro')
+        self.bus.subscribe(self.handleFingerConnection, 'FingerConnection')
+        self.bus.subscribe(self.handleLGyroData, 'LGyro')
+        self.bus.subscribe(self.handleRGyroData, 'RGyro')
 
     def closeEvent(self, event):
+        self.bus.unsubscribe(self.handleFingerConnection, 'FingerConnection')
+        self.bus.unsubscribe(self.handleLGyroData, 'LGyro')
+        self.bus.unsubscribe(self.handleRGyroData, 'RGyro')
         if self.board is not None:
             self.board.stop()
         print("stopping board comms")
@@ -0,0 +1,56 @@
+"""
+Coalesces repaints of live widgets to at most one per display frame.
+
+Widgets showing sensor data ask for a repaint with markDirty, from any thread and as often as the
+data comes in. One timer on the GUI thread repaints each widget marked since the last tick once,
+and stops when a tick finds nothing to do, so drawing costs the same at 100 Hz or 10 kHz of data
+and nothing while the gloves are still.
+"""
+
+import threading
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+class RepaintScheduler(QObject):
+    # emitted when the first widget is marked after an idle tick, queued into the GUI thread
+    dirtied = pyqtSignal()
+
+    def __init__(self, maxRate=60):
+        super().__init__()
+        self._lock = threading.Lock()
+        # used as an ordered set, widgets repaint in the order they were first marked
+        self._dirty = dict()
+        self.markCount = 0
+        self.repaintCount = 0
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(1000 / maxRate))
+        self.timer.timeout.connect(self.repaint)
+        self.dirtied.connect(self._start)
+
+    def markDirty(self, widget):
+        with self._lock:
+            wasEmpty = len(self._dirty) == 0
+            self._dirty[widget] = None
+            self.markCount += 1
+        if wasEmpty:
+            self.dirtied.emit()
+
+    def _start(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def repaint(self):
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = dict()
+        if len(dirty) == 0:
+            self.timer.stop()
+            return
+        for w in dirty:
+            w.update()
+        self.repaintCount += len(dirty)
+
+    def getCounts(self):
+        return {"marked": self.markCount, "repainted": self.repaintCount}
@@ -0,0 +1,207 @@
+"""
+Moves board messages off the thread that read them.
+
+Board readers publish on EventBus.pub from their own threads. Instead of doing MIDI and widget work
+right there, ConfigWindow puts a SampleConsumer (own thread, for MIDI) and a GuiBridge (Qt GUI thread,
+drained at display rate) in between. Each has its own EventBus with the same topics to subscribe to.
+
+Both sit on a SampleMailbox, which never holds more than one pending gyro message per topic between
+finger events: a newer sample replaces the pending one (changed flags are or'ed together, batches are
+concatenated) so a slow consumer gets the latest position instead of a growing backlog, while finger
+connections are always delivered in order.
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+import ThreadExtension
+from EventBus import EventBus, pub, topicListener, GYRO_ARGS, GYRO_BATCH_ARGS, QUAT_ARGS
+
+
+def mergeGyro(old, new):
+    # latest values, but a flag stays set if any of the merged samples changed that axis
+    return new[0:3] + [old[3] or new[3], old[4] or new[4], old[5] or new[5]]
+
+
+def mergeGyroBatch(old, new):
+    return [np.concatenate((o, n)) for o, n in zip(old, new)]
+
+
+def mergeLatest(old, new):
+    return new
+
+
+class SampleMailbox:
+    def __init__(self, bus):
+        self._lock = threading.Lock()
+        self._entries = deque()
+        # pending entry of each mergeable topic that hasn't been passed by an unmergeable one
+        self._open = dict()
+        self._mergeFuncs = dict()
+        for topic in bus.topics():
+            if bus.topicArgs(topic) == GYRO_ARGS:
+                self._mergeFuncs[topic] = mergeGyro
+            elif bus.topicArgs(topic) == GYRO_BATCH_ARGS:
+                self._mergeFuncs[topic] = mergeGyroBatch
+            elif bus.topicArgs(topic) == QUAT_ARGS:
+                self._mergeFuncs[topic] = mergeLatest
+        self._nonEmpty = threading.Event()
+        self.mergedCount = 0
+
+    def put(self, topic, args, t=None):
+        """
+        t is when the sample was made, now if not given. Returns True if the mailbox was empty
+        before this message
+        """
+        if t is None:
+            t = time.time()
+        with self._lock:
+            wasEmpty = len(self._entries) == 0
+            merge = self._mergeFuncs.get(topic)
+            if merge is None:
+                self._open.clear()
+                self._entries.append([topic, args, t])
+            elif topic in self._open:
+                entry = self._open[topic]
+                entry[1] = merge(entry[1], list(args))
+                entry[2] = t
+                self.mergedCount += 1
+            else:
+                entry = [topic, list(args), t]
+                self._open[topic] = entry
+                self._entries.append(entry)
+            self._nonEmpty.set()
+        return wasEmpty
+
+    def drain(self):
+        """
+        Returns all pending [topic, args, time put] entries in order
+        """
+        with self._lock:
+            entries = self._entries
+            self._entries = deque()
+            self._open.clear()
+            self._nonEmpty.clear()
+        return entries
+
+    def wait(self, timeout=None):
+        return self._nonEmpty.wait(timeout)
+
+
+def makeBus(source):
+    bus = EventBus()
+    for topic in source.topics():
+        bus.addTopic(topic, source.topicArgs(topic))
+    return bus
+
+
+class SampleConsumer(ThreadExtension.StoppableThread):
+    """
+    Delivers messages from source to the listeners on self.bus from its own thread.
+    Nothing on this thread should touch Qt widgets.
+    """
+
+    STOP_POLL_DELAY = 0.1  # seconds
+
+    def __init__(self, source=pub):
+        super().__init__()
+        self.source = source
+        self.bus = makeBus(source)
+        self._mailbox = SampleMailbox(source)
+        # when the sample being delivered was made (see EventBus.publishAt), or published if the
+        # publisher didn't say, listeners can use it to measure latency
+        self.sampleTime = 0
+        # timer(now) functions run on this thread after every delivery and at the deadlines they return
+        self._timers = []
+        self._nextDeadline = None
+        self._forwarders = dict()
+        for topic in source.topics():
+            self._forwarders[topic] = topicListener(source.topicArgs(topic), self._makePut(topic))
+            source.subscribe(self._forwarders[topic], topic)
+
+    def _makePut(self, topic):
+        return lambda *args: self._mailbox.put(topic, args, self.source.sourceTime())
+
+    def addTimer(self, timer):
+        """
+        timer(now) is called on this thread, and returns the time.time() it wants to be called
+        again by, or None if it only needs calling after deliveries
+        """
+        self._timers = self._timers + [timer]
+
+    def removeTimer(self, timer):
+        self._timers = [t for t in self._timers if t is not timer]
+
+    def run(self):
+        while not self.req_stop():
+            timeout = self.STOP_POLL_DELAY
+            if self._nextDeadline is not None:
+                timeout = min(timeout, max(0, self._nextDeadline - time.time()))
+            if self._mailbox.wait(timeout):
+                for topic, args, t in self._mailbox.drain():
+                    self.sampleTime = t
+                    self.bus.publish(topic, *args)
+            self._runTimers()
+
+    def _runTimers(self):
+        now = time.time()
+        deadlines = [d for d in (timer(now) for timer in self._timers) if d is not None]
+        self._nextDeadline = min(deadlines) if len(deadlines) > 0 else None
+
+    def stop(self):
+        for topic, f in self._forwarders.items():
+            self.source.unsubscribe(f, topic)
+        super().stop()
+
+    def getMergedCount(self):
+        return self._mailbox.mergedCount
+
+
+class GuiBridge(QObject):
+    """
+    Delivers messages from source to the listeners on self.bus on the Qt GUI thread, at most
+    maxRate times a second. drained is emitted after each delivery, for refreshing widgets.
+    """
+    samplesReady = pyqtSignal()
+    drained = pyqtSignal()
+
+    def __init__(self, source=pub, maxRate=60):
+        super().__init__()
+        self.source = source
+        self.bus = makeBus(source)
+        self._mailbox = SampleMailbox(source)
+        self.minDrainPeriod = 1000.0 / maxRate  # ms
+        self.lastDrainTime = 0
+
+        # emitted from the reader threads, so this is a queued connection into the GUI thread
+        self.samplesReady.connect(self._scheduleDrain)
+
+        self._forwarders = dict()
+        for topic in source.topics():
+            self._forwarders[topic] = topicListener(source.topicArgs(topic), self._makePut(topic))
+            source.subscribe(self._forwarders[topic], topic)
+
+    def _makePut(self, topic):
+        def put(*args):
+            # only the first message since the last drain needs to wake the GUI thread
+            if self._mailbox.put(topic, args, self.source.sourceTime()):
+                self.samplesReady.emit()
+        return put
+
+    def _scheduleDrain(self):
+        wait = self.lastDrainTime + self.minDrainPeriod - time.time() * 1000
+        QTimer.singleShot(max(0, int(wait)), self.drain)
+
+    def drain(self):
+        self.lastDrainTime = time.time() * 1000
+        for topic, args, t in self._mailbox.drain():
+            self.bus.publish(topic, *args)
+        self.drained.emit()
+
+    def close(self):
+        for topic, f in self._forwarders.items():
+            self.source.unsubscribe(f, topic)
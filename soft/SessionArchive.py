@@ -0,0 +1,309 @@
+"""
+Session archive for long recordings: fixed size records after a short header, read through
+np.memmap so only the pages a window or seek actually touches are read from disk.
+
+Each record is one frame from either glove in arrival order, already decoded: host time, board
+time and sequence number (nan and -1 for version 1 frames), side, the frame's flags, finger
+routes, roll/pitch/yaw normalized the same way the board interactors publish them, the quaternion
+and the raw accel/gyro shorts. An hour of two glove data at 100 Hz is about 52 MB.
+
+Records are found by time through a block index, the time of every INDEX_STRIDE-th record. It's
+built from the file when opened (one page read per block) and extended by refresh as the file
+grows, so an archive still being written can be followed. Time is assumed not to go backwards.
+
+SessionArchiveWriter has the same write as SessionRecording.SessionRecorder, so it can be given
+to BoardManager, BoardProtocol or BoardInteractor in its place.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import PacketDecoder
+import Orientation
+
+FILE_MAGIC = b"GLOVEARC"
+FILE_VERSION = 1
+FILE_HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u2'), ('recordSize', '<u2'), ('reserved', 'u1', (4,))])
+ARCHIVE_DTYPE = np.dtype([('t', '<f8'),
+                          ('boardTime', '<f8'),
+                          ('seq', '<i4'),
+                          ('side', 'S1'),
+                          ('flags', 'u1'),
+                          ('routes', 'i1', (4,)),
+                          ('rpy', '<f4', (3,)),
+                          ('quat', '<f4', (4,)),
+                          ('raw', '<i2', (6,)),
+                          ('reserved', 'u1', (6,))])
+INDEX_STRIDE = 1024
+# side byte for each value of the flags' side bit
+SIDE_BYTES = np.array([PacketDecoder.SIDE_NAMES[i].encode() for i in range(2)], dtype='S1')
+
+
+def archiveRecords(frames, t, sequence=None, boardTime=None):
+    """
+    ARCHIVE_DTYPE records for frames from PacketDecoder.decode
+    """
+    records = np.zeros(len(frames), dtype=ARCHIVE_DTYPE)
+    if len(frames) == 0:
+        return records
+    flags = frames['trailer'][:, 3].astype(np.uint8)
+    records['t'] = t
+    records['boardTime'] = np.nan if boardTime is None else boardTime
+    records['seq'] = -1 if sequence is None else sequence
+    records['side'] = SIDE_BYTES[flags & PacketDecoder.SIDE_MASK]
+    records['flags'] = flags
+    records['routes'] = frames['routes']
+    records['rpy'] = PacketDecoder.normalizeGyro(PacketDecoder.frameYPR(frames))
+    records['quat'] = PacketDecoder.frameQuaternions(frames)
+    records['raw'] = frames['raw']
+    return records
+
+
+class SessionArchiveWriter:
+    """
+    Appends records to an archive, creating it if needed. write can be called from any thread.
+    Records are written through a buffer and flushed every flushInterval seconds.
+    """
+
+    def __init__(self, path, flushInterval=1.0):
+        self.path = path
+        self.flushInterval = flushInterval
+        self._lock = threading.Lock()
+        self._lastFlush = time.time()
+        self.recordCount = 0
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            readHeader(path)
+            # a record cut short by a crash would shift everything after it
+            extra = (os.path.getsize(path) - FILE_HEADER_DTYPE.itemsize) % ARCHIVE_DTYPE.itemsize
+            if extra > 0:
+                print("{}: dropping {} bytes of an incomplete record".format(path, extra))
+                with open(path, "r+b") as f:
+                    f.truncate(os.path.getsize(path) - extra)
+        self._file = open(path, "ab")
+        if not exists:
+            header = np.zeros(1, dtype=FILE_HEADER_DTYPE)
+            header['magic'] = FILE_MAGIC
+            header['version'] = FILE_VERSION
+            header['recordSize'] = ARCHIVE_DTYPE.itemsize
+            self._file.write(header.tobytes())
+            self._file.flush()
+
+    def write(self, frames, t, sequence=None, boardTime=None):
+        self.append(archiveRecords(frames, t, sequence, boardTime))
+
+    def append(self, records):
+        if len(records) == 0:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(np.ascontiguousarray(records, dtype=ARCHIVE_DTYPE).tobytes())
+            self.recordCount += len(records)
+            if time.time() - self._lastFlush > self.flushInterval:
+                self._file.flush()
+                self._lastFlush = time.time()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+
+
+def readHeader(path):
+    with open(path, "rb") as f:
+        header = np.frombuffer(f.read(FILE_HEADER_DTYPE.itemsize), dtype=FILE_HEADER_DTYPE)
+    if len(header) == 0 or header['magic'][0] != FILE_MAGIC:
+        raise ValueError("{} isn't a glove session archive".format(path))
+    if header['version'][0] != FILE_VERSION or header['recordSize'][0] != ARCHIVE_DTYPE.itemsize:
+        raise ValueError("{} is archive version {}, expected {}".format(path, header['version'][0], FILE_VERSION))
+    return header[0]
+
+
+class SessionArchive:
+    """
+    Read only view of an archive. records is the whole file as a memmap, slicing it reads nothing
+    until the values are used. Times are host time.time() seconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        readHeader(path)
+        self.records = np.empty(0, dtype=ARCHIVE_DTYPE)
+        self._index = np.empty(0)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Picks up records written since the archive was opened
+        """
+        n = (os.path.getsize(self.path) - FILE_HEADER_DTYPE.itemsize) // ARCHIVE_DTYPE.itemsize
+        if n == len(self.records):
+            return
+        if n == 0:
+            self.records = np.empty(0, dtype=ARCHIVE_DTYPE)
+        else:
+            self.records = np.memmap(self.path, dtype=ARCHIVE_DTYPE, mode='r', offset=FILE_HEADER_DTYPE.itemsize,
+                                     shape=(n,))
+        # only the blocks that are new need reading
+        first = len(self._index) * INDEX_STRIDE
+        self._index = np.concatenate((self._index, np.array(self.records['t'][first::INDEX_STRIDE])))
+
+    def __len__(self):
+        return len(self.records)
+
+    def timeRange(self):
+        if len(self.records) == 0:
+            return None
+        return float(self.records['t'][0]), float(self.records['t'][-1])
+
+    def seek(self, t):
+        """
+        Index of the first record at or after time t
+        """
+        block = max(int(np.searchsorted(self._index, t, side='left')) - 1, 0)
+        start = block * INDEX_STRIDE
+        # the record can only be in this block, or be the first of the next one
+        ts = np.array(self.records['t'][start:start + INDEX_STRIDE])
+        return start + int(np.searchsorted(ts, t, side='left'))
+
+    def window(self, t0=None, t1=None):
+        """
+        Records from t0 up to t1, a memmap slice
+        """
+        i0 = 0 if t0 is None else self.seek(t0)
+        i1 = len(self.records) if t1 is None else self.seek(t1)
+        return self.records[i0:i1]
+
+    def chunks(self, t0=None, t1=None, chunkRecords=65536):
+        """
+        Yields the window from t0 to t1 in pieces of at most chunkRecords, read into memory one at a time
+        """
+        w = self.window(t0, t1)
+        for i in range(0, len(w), chunkRecords):
+            yield np.array(w[i:i + chunkRecords])
+
+    def sideWindow(self, side, t0=None, t1=None, fields=('t', 'rpy')):
+        """
+        The given fields of one glove's records from t0 to t1, as arrays in memory
+        """
+        parts = {f: [] for f in fields}
+        key = side.encode()
+        for c in self.chunks(t0, t1):
+            c = c[c['side'] == key]
+            for f in fields:
+                parts[f].append(c[f])
+        return {f: np.concatenate(p) if len(p) > 0 else np.empty((0,) + ARCHIVE_DTYPE[f].shape, dtype=ARCHIVE_DTYPE[f].base)
+                for f, p in parts.items()}
+
+    def stats(self, t0=None, t1=None, side=None, chunkRecords=65536):
+        """
+        Per side record count, rate and roll/pitch/yaw mean, circular spread, min and max from t0
+        to t1, streamed a chunk at a time so memory use doesn't depend on the window's length
+        """
+        acc = dict()
+        for c in self.chunks(t0, t1, chunkRecords):
+            for s in ("L", "R") if side is None else (side,):
+                cs = c[c['side'] == s.encode()]
+                if len(cs) == 0:
+                    continue
+                rpy = cs['rpy'].astype(float)
+                a = 2.0 * np.pi * rpy
+                if s not in acc:
+                    acc[s] = {"count": 0, "t0": cs['t'][0], "sin": np.zeros(3), "cos": np.zeros(3),
+                              "min": np.full(3, np.inf), "max": np.full(3, -np.inf)}
+                d = acc[s]
+                d["count"] += len(cs)
+                d["t1"] = cs['t'][-1]
+                d["sin"] += np.sum(np.sin(a), axis=0)
+                d["cos"] += np.sum(np.cos(a), axis=0)
+                d["min"] = np.minimum(d["min"], np.min(rpy, axis=0))
+                d["max"] = np.maximum(d["max"], np.max(rpy, axis=0))
+
+        ret = dict()
+        for s, d in acc.items():
+            # circular, a glove sitting where the IMU wraps still gets its real mean and spread
+            r = np.hypot(d["sin"], d["cos"]) / d["count"]
+            duration = d["t1"] - d["t0"]
+            ret[s] = {"count": d["count"], "duration": duration,
+                      "rate": (d["count"] - 1) / duration if duration > 0 else None,
+                      "mean": Orientation.wrapTurns(np.arctan2(d["sin"], d["cos"]) / (2.0 * np.pi)),
+                      "std": np.sqrt(-2.0 * np.log(np.clip(r, 1e-12, 1.0))) / (2.0 * np.pi),
+                      "min": d["min"], "max": d["max"]}
+        return ret
+
+
+def fromRecording(recordingPath, archivePath):
+    """
+    Converts a SessionRecording file to an archive
+    """
+    import SessionRecording
+
+    writer = SessionArchiveWriter(archivePath)
+    for records in SessionRecording.readRecording(recordingPath):
+        writer.append(archiveRecords(records['frame'], records['t'], records['seq'], records['boardTime']))
+    writer.close()
+    return SessionArchive(archivePath)
+
+
+def benchmark(path="./benchmarkSession.arc", hours=2.0, rate=100.0):
+    """
+    Writes hours of synthetic two glove data and times seeking, windows and stats over it
+    """
+    n = int(hours * 3600 * rate)
+    if not os.path.exists(path):
+        writer = SessionArchiveWriter(path)
+        chunk = 360000
+        rng = np.random.default_rng(0)
+        for i in range(0, n, chunk):
+            m = min(chunk, n - i)
+            r = np.zeros(2 * m, dtype=ARCHIVE_DTYPE)
+            t = 1.7e9 + (i + np.arange(m)) / rate
+            r['t'] = np.repeat(t, 2)
+            r['side'] = np.tile(np.array([b"L", b"R"]), m)
+            r['rpy'] = 0.5 + 0.1 * np.sin(r['t'][:, None] * [0.3, 0.5, 0.7]) + rng.normal(0, 0.01, (2 * m, 3))
+            writer.append(r)
+        writer.close()
+
+    t0 = time.perf_counter()
+    a = SessionArchive(path)
+    topen = time.perf_counter() - t0
+    start, end = a.timeRange()
+    t0 = time.perf_counter()
+    targets = np.random.default_rng(1).uniform(start, end, 1000)
+    for t in targets:
+        a.seek(t)
+    tseek = (time.perf_counter() - t0) / len(targets)
+    t0 = time.perf_counter()
+    w = a.sideWindow("L", start + 1800, start + 1860)
+    twin = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    s = a.stats()
+    tstats = time.perf_counter() - t0
+    print("{} records, {:.0f} MB".format(len(a), os.path.getsize(path) / 1e6))
+    print("open {:.1f} ms, seek {:.1f} us, 60 s window ({} samples) {:.1f} ms, stats over everything {:.2f} s".format(
+        topen * 1e3, tseek * 1e6, len(w['t']), twin * 1e3, tstats))
+    print(s["L"])
+
+
+if __name__ == "__main__":
+    # python SessionArchive.py in.rec out.arc   converts a recording
+    # python SessionArchive.py                  benchmark
+    if len(sys.argv) == 3:
+        a = fromRecording(sys.argv[1], sys.argv[2])
+        print("{} records, {}".format(len(a), a.timeRange()))
+        print(a.stats())
+    else:
+        benchmark()
@@ -0,0 +1,285 @@
+"""
+Records the decoded board stream to a file and plays it back through the same publish path.
+
+A recording is append only: a short file header, then chunks of records, each chunk with its
+record count and a CRC32 of its records. Chunks are written as they fill up (or every
+flushInterval seconds), so a session cut short by a crash loses at most the last chunk, and
+readRecording stops at the first incomplete or corrupt one.
+
+Every record is one frame as PacketDecoder.decode returned it (FRAME_DTYPE, so raw accel/gyro
+shorts, finger routes, orientation and side/flags are all there) plus the host time its read
+arrived and, for version 2 frames, the sequence number and board time. Frames that arrived in the
+same read share a host time, replay hands them out as one batch again.
+
+ReplayConnection is a BoardTransport.BoardConnection that reads a recording instead of a board,
+at real time (speed 1), faster or slower, or as fast as possible (speed None). Its publish is the
+same as a real board's, so everything from pubsub on runs as it would with the gloves plugged in.
+BoardManager takes recordPath and replayPath to do either.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import BoardTransport
+import PacketDecoder
+
+FILE_MAGIC = b"GLOVEREC"
+FILE_VERSION = 1
+RECORD_DTYPE = np.dtype([('t', '<f8'),
+                         ('seq', '<i4'),
+                         ('boardTime', '<f8'),
+                         ('frame', PacketDecoder.FRAME_DTYPE)])
+# magic, version, record size
+FILE_HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u2'), ('recordSize', '<u2')])
+CHUNK_MAGIC = b"CHNK"
+# magic, record count, CRC32 of the records
+CHUNK_HEADER_DTYPE = np.dtype([('magic', 'S4'), ('count', '<u4'), ('crc', '<u4')])
+
+
+class SessionRecorder:
+    """
+    Appends decoded frames to a recording. write can be called from any thread, several boards can
+    share one recorder.
+    """
+
+    def __init__(self, path, chunkSize=256, flushInterval=1.0):
+        self.path = path
+        self.chunkSize = chunkSize
+        self.flushInterval = flushInterval
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pendingCount = 0
+        self._lastFlush = time.time()
+        self.recordCount = 0
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            readHeader(path)
+        self._file = open(path, "ab")
+        if not exists:
+            header = np.zeros(1, dtype=FILE_HEADER_DTYPE)
+            header['magic'] = FILE_MAGIC
+            header['version'] = FILE_VERSION
+            header['recordSize'] = RECORD_DTYPE.itemsize
+            self._file.write(header.tobytes())
+            self._file.flush()
+
+    def write(self, frames, t, sequence=None, boardTime=None):
+        """
+        frames from PacketDecoder.decode, t the host time they arrived (one for all or one each),
+        sequence and boardTime as the decoder leaves them
+        """
+        n = len(frames)
+        if n == 0:
+            return
+        records = np.empty(n, dtype=RECORD_DTYPE)
+        records['t'] = t
+        records['seq'] = -1 if sequence is None else sequence
+        records['boardTime'] = np.nan if boardTime is None else boardTime
+        records['frame'] = frames
+
+        with self._lock:
+            if self._file is None:
+                return
+            self._pending.append(records)
+            self._pendingCount += n
+            if self._pendingCount >= self.chunkSize or time.time() - self._lastFlush > self.flushInterval:
+                self._flush()
+
+    def _flush(self):
+        # called with _lock held
+        if self._pendingCount > 0:
+            records = np.concatenate(self._pending)
+            payload = records.tobytes()
+            header = np.zeros(1, dtype=CHUNK_HEADER_DTYPE)
+            header['magic'] = CHUNK_MAGIC
+            header['count'] = len(records)
+            header['crc'] = zlib.crc32(payload)
+            self._file.write(header.tobytes() + payload)
+            self._file.flush()
+            self.recordCount += len(records)
+        self._pending = []
+        self._pendingCount = 0
+        self._lastFlush = time.time()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.close()
+            self._file = None
+
+
+def readHeader(path):
+    with open(path, "rb") as f:
+        header = np.frombuffer(f.read(FILE_HEADER_DTYPE.itemsize), dtype=FILE_HEADER_DTYPE)
+    if len(header) == 0 or header['magic'][0] != FILE_MAGIC:
+        raise ValueError("{} isn't a glove recording".format(path))
+    if header['version'][0] != FILE_VERSION or header['recordSize'][0] != RECORD_DTYPE.itemsize:
+        raise ValueError("{} is recording version {}, expected {}".format(path, header['version'][0], FILE_VERSION))
+    return header[0]
+
+
+def readRecording(path):
+    """
+    Yields the records of each chunk in turn, stops at the first incomplete or corrupt chunk
+    """
+    readHeader(path)
+    with open(path, "rb") as f:
+        f.seek(FILE_HEADER_DTYPE.itemsize)
+        while True:
+            b = f.read(CHUNK_HEADER_DTYPE.itemsize)
+            if len(b) == 0:
+                return
+            if len(b) < CHUNK_HEADER_DTYPE.itemsize:
+                print("{}: recording ends mid chunk".format(path))
+                return
+            header = np.frombuffer(b, dtype=CHUNK_HEADER_DTYPE)[0]
+            if header['magic'] != CHUNK_MAGIC:
+                print("{}: bad chunk at byte {}".format(path, f.tell() - len(b)))
+                return
+            payload = f.read(int(header['count']) * RECORD_DTYPE.itemsize)
+            if len(payload) < int(header['count']) * RECORD_DTYPE.itemsize:
+                print("{}: recording ends mid chunk".format(path))
+                return
+            if zlib.crc32(payload) != header['crc']:
+                print("{}: chunk at byte {} is corrupt".format(path, f.tell() - len(payload) - len(b)))
+                return
+            yield np.frombuffer(payload, dtype=RECORD_DTYPE)
+
+
+def loadRecording(path):
+    chunks = list(readRecording(path))
+    if len(chunks) == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.concatenate(chunks)
+
+
+def recordBatches(path):
+    """
+    Yields (side, recorded t, frames) for each read the recording was made from
+    """
+    for records in readRecording(path):
+        sides = records['frame']['trailer'][:, 3] & PacketDecoder.SIDE_MASK
+        # a new batch wherever the arrival time or the glove changes
+        breaks = np.flatnonzero((np.diff(records['t']) != 0) | (np.diff(sides) != 0)) + 1
+        for b in np.split(np.arange(len(records)), breaks):
+            frames = records['frame'][b]
+            yield PacketDecoder.frameSide(frames[-1]), records['t'][b[0]], frames
+
+
+class ReplayConnection(BoardTransport.BoardConnection):
+    """
+    A board connection playing back a recording. speed 1 is real time, 2 twice as fast, None as
+    fast as possible. Batches get the time they're handed out as their arrival time, so latencies
+    measured downstream are those of the replay, not of the session that was recorded.
+    """
+
+    def __init__(self, path, speed=1.0, side=None):
+        super().__init__(None, self)
+        self.path = path
+        self.speed = speed
+        # same as BoardProtocol, None takes the side from the frames
+        self.fixedSide = side
+        self._side = side
+        self._batches = recordBatches(path)
+        self._closed = False
+        self._start = None
+        self.framesReceived = 0
+        self.batchesReplayed = 0
+
+    @property
+    def side(self):
+        return self._side
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            side, recordedT, frames = next(self._batches)
+        except StopIteration:
+            raise StopAsyncIteration
+
+        if self.speed is not None:
+            now = time.time()
+            if self._start is None:
+                self._start = (now, recordedT)
+            due = self._start[0] + (recordedT - self._start[1]) / self.speed
+            # in short steps so close doesn't wait out a long pause in the recording
+            while due > now and not self._closed:
+                await asyncio.sleep(min(due - now, 0.1))
+                now = time.time()
+        else:
+            # let the rest of the loop run, stopping included
+            await asyncio.sleep(0)
+
+        if self.fixedSide is None:
+            self._side = side
+        self.framesReceived += len(frames)
+        self.batchesReplayed += 1
+        return BoardTransport.frameBatch(frames, time.time(), self._side)
+
+    def sendHaptic(self, hapticState):
+        pass
+
+    def close(self):
+        self._closed = True
+
+    def getFrameCounts(self):
+        return {"received": self.framesReceived, "batches": self.batchesReplayed}
+
+
+async def _replayMain(path, speed):
+    from EventBus import pub
+
+    counts = {"LGyroBatch": 0, "RGyroBatch": 0}
+
+    def countBatch(topic):
+        def f(t, rpy, connections, quat):
+            counts[topic] += len(t)
+        return f
+
+    listeners = {topic: countBatch(topic) for topic in counts}
+    for topic, l in listeners.items():
+        pub.subscribe(l, topic)
+    c = ReplayConnection(path, speed=speed)
+    t0 = time.perf_counter()
+    await c.publish()
+    dt = time.perf_counter() - t0
+    for topic, l in listeners.items():
+        pub.unsubscribe(l, topic)
+    n = c.framesReceived
+    print("replayed {} frames in {} batches in {:.3f} s, {:.0f} frames/s, {}".format(
+        n, c.batchesReplayed, dt, n / max(dt, 1e-9), counts))
+
+
+if __name__ == "__main__":
+    # python SessionRecording.py record out.rec [port ...]
+    # python SessionRecording.py replay in.rec [speed, 0 for as fast as possible]
+    if len(sys.argv) >= 3 and sys.argv[1] == "record":
+        from BoardManager import BoardManager
+
+        b = BoardManager(ports=sys.argv[3:] or None, recordPath=sys.argv[2])
+        b.start()
+        input("Recording, press Enter to stop")
+        b.stop()
+        b.join()
+        print(b.getFrameCounts())
+    elif len(sys.argv) >= 3 and sys.argv[1] == "replay":
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        asyncio.run(_replayMain(sys.argv[2], speed if speed > 0 else None))
+    else:
+        print("usage: SessionRecording.py record out.rec [port ...] | replay in.rec [speed]")
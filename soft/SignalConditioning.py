@@ -0,0 +1,302 @@
+"""
+Conditioning of calibrated glove values (0.0-1.0, 0.5 at the center) before they reach the mappings.
+
+A FilterChain runs filters in order over a batch: t (n,) in seconds and x (n, 3) of roll, pitch and
+yaw, so a whole lossless batch goes through in one call and a single sample is a batch of one. Every
+filter keeps its state and parameters as (3,) arrays, one entry per axis. Parameters can be given as a
+scalar for all axes or as 3 values, and each filter has an enabled mask that passes its disabled axes
+through untouched. ConfigWindow keeps one chain per hand.
+
+    EMA         exponential moving average with a time constant, so the rate doesn't change it
+    OneEuro     1 euro filter: smooths hard when still, follows fast movement with little lag
+    Median      running median, removes single sample spikes
+    Deadzone    values near the center snap to it, the rest is stretched to keep the full range
+    Curve       response curve around the center, gamma > 1 is finer near the center
+
+Recursive filters (EMA, OneEuro) step through a batch row by row. On 3 values numpy's per call
+overhead is most of the cost, so their recursion runs on plain floats. Median, Deadzone and Curve
+work on the whole batch at once.
+
+Smoothing trails the input, and the board stops sending while the hand is still, so the output
+would stop short of where the hand came to rest. Until isSettled, the owner of a chain calls hold
+every HOLD_PERIOD to step it on with the last input, which is what the board would have sent.
+"""
+
+import math
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def axisParam(v):
+    return np.array(np.broadcast_to(np.asarray(v, dtype=float), (3,)))
+
+
+class Filter:
+    def __init__(self, enabled=True):
+        self.setEnabled(enabled)
+
+    def setEnabled(self, enabled):
+        self.enabled = np.array(np.broadcast_to(np.asarray(enabled, dtype=bool), (3,)))
+
+    def process(self, t, x):
+        y = self.apply(t, x)
+        if not self.enabled.all():
+            y = np.where(self.enabled, y, x)
+        return y
+
+    def apply(self, t, x):
+        return x
+
+    def reset(self):
+        pass
+
+    def isSettled(self):
+        """
+        True if running on with the last input wouldn't change the output any more
+        """
+        return True
+
+
+# how close a smoothed output has to be to its input to count as caught up
+SETTLE_TOLERANCE = 1e-5
+
+
+class EMA(Filter):
+    def __init__(self, tau=0.02, enabled=True):
+        """
+        tau is the time constant in seconds
+        """
+        super().__init__(enabled)
+        self.tau = axisParam(tau)
+        self.reset()
+
+    def reset(self):
+        self.y = None
+        self.xPrev = None
+        self.tPrev = None
+
+    def isSettled(self):
+        return self.y is None or np.all(np.abs(self.y - self.xPrev) < SETTLE_TOLERANCE)
+
+    def apply(self, t, x):
+        if len(x) == 0:
+            return x
+        out = []
+        y = None if self.y is None else self.y.tolist()
+        tPrev = self.tPrev
+        taus = np.maximum(self.tau, 1e-9).tolist()
+        for ti, xi in zip(np.asarray(t, dtype=float).tolist(), x.tolist()):
+            if y is None:
+                y = xi
+            else:
+                dt = max(ti - tPrev, 0.0)
+                y = [yk + (1.0 - math.exp(-dt / tau)) * (xk - yk) for xk, yk, tau in zip(xi, y, taus)]
+            tPrev = ti
+            out.append(y)
+        self.y, self.xPrev, self.tPrev = np.array(y), x[-1].copy(), tPrev
+        return np.array(out)
+
+
+def _smoothing(dt, cutoff):
+    r = 2 * math.pi * cutoff * dt
+    return r / (r + 1)
+
+
+class OneEuro(Filter):
+    def __init__(self, minCutoff=1.0, beta=0.0, dCutoff=1.0, enabled=True):
+        """
+        minCutoff (Hz) sets the smoothing when still, beta how fast the cutoff rises with speed
+        """
+        super().__init__(enabled)
+        self.minCutoff = axisParam(minCutoff)
+        self.beta = axisParam(beta)
+        self.dCutoff = axisParam(dCutoff)
+        self.reset()
+
+    def reset(self):
+        self.y = None
+        self.dy = np.zeros(3)
+        self.xPrev = None
+        self.tPrev = None
+
+    def isSettled(self):
+        return self.y is None or np.all(np.abs(self.y - self.xPrev) < SETTLE_TOLERANCE)
+
+    def apply(self, t, x):
+        if len(x) == 0:
+            return x
+        out = []
+        y = None if self.y is None else self.y.tolist()
+        dy = self.dy.tolist()
+        tPrev = self.tPrev
+        params = list(zip(self.minCutoff.tolist(), self.beta.tolist(), self.dCutoff.tolist()))
+        for ti, xi in zip(np.asarray(t, dtype=float).tolist(), x.tolist()):
+            if y is None:
+                y = xi
+            else:
+                # samples merged on the way can arrive with the same time, treat them as 1 ms apart
+                dt = max(ti - tPrev, 1e-3)
+                newY, newDy = [], []
+                for xk, yk, dyk, (minCutoff, beta, dCutoff) in zip(xi, y, dy, params):
+                    dyk += _smoothing(dt, dCutoff) * ((xk - yk) / dt - dyk)
+                    newDy.append(dyk)
+                    newY.append(yk + _smoothing(dt, minCutoff + beta * abs(dyk)) * (xk - yk))
+                y, dy = newY, newDy
+            tPrev = ti
+            out.append(y)
+        self.y, self.dy, self.xPrev, self.tPrev = np.array(y), np.array(dy), x[-1].copy(), tPrev
+        return np.array(out)
+
+
+class Median(Filter):
+    def __init__(self, size=5, enabled=True):
+        """
+        size is rounded up to an odd number of samples
+        """
+        super().__init__(enabled)
+        self.size = size | 1
+        self.reset()
+
+    def reset(self):
+        # the last size - 1 inputs, filled with the first sample until there are enough
+        self.history = None
+
+    def isSettled(self):
+        return self.history is None or np.all(self.history == self.history[-1])
+
+    def apply(self, t, x):
+        if len(x) == 0:
+            return x
+        if self.history is None:
+            self.history = np.repeat(x[:1], self.size - 1, axis=0)
+        window = np.concatenate((self.history, x))
+        self.history = window[len(window) - (self.size - 1):]
+        # a sort is quicker than np.median for a few samples
+        return np.sort(sliding_window_view(window, self.size, axis=0), axis=-1)[..., self.size // 2]
+
+
+class Deadzone(Filter):
+    def __init__(self, width=0.02, center=0.5, enabled=True):
+        """
+        width is how far from center still counts as the center
+        """
+        super().__init__(enabled)
+        self.width = axisParam(width)
+        self.center = axisParam(center)
+        # the part outside the dead zone is stretched back over the whole half range on each side
+        self.scales = np.array([self.center, 1.0 - self.center]) / np.maximum(
+            np.array([self.center, 1.0 - self.center]) - self.width, 1e-9)
+
+    def apply(self, t, x):
+        d = x - self.center
+        m = np.maximum(np.abs(d) - self.width, 0.0)
+        return self.center + np.copysign(m, d) * self.scales[(d >= 0).view(np.int8), [0, 1, 2]]
+
+
+class Curve(Filter):
+    def __init__(self, gamma=1.0, center=0.5, enabled=True):
+        super().__init__(enabled)
+        self.gamma = axisParam(gamma)
+        self.center = axisParam(center)
+        self.halves = np.array([self.center, 1.0 - self.center])
+
+    def apply(self, t, x):
+        d = x - self.center
+        half = self.halves[(d >= 0).view(np.int8), [0, 1, 2]]
+        r = np.minimum(np.abs(d) / np.maximum(half, 1e-9), 1.0)
+        return self.center + np.copysign(half * r ** self.gamma, d)
+
+
+class FilterChain:
+    # seconds between hold steps while the chain settles
+    HOLD_PERIOD = 0.005
+
+    def __init__(self, filters=()):
+        self.filters = list(filters)
+        self.lastInput = None
+        self.lastTime = None
+
+    def process(self, t, x):
+        """
+        t (n,) and x (n, 3), returns the conditioned (n, 3)
+        """
+        x = np.asarray(x, dtype=float)
+        if len(x) > 0:
+            self.lastInput = x[-1].copy()
+            self.lastTime = t[-1]
+        for f in self.filters:
+            x = f.process(t, x)
+        return x
+
+    def processSample(self, t, values):
+        """
+        One (roll, pitch, yaw) sample at time t, returns the conditioned (3,)
+        """
+        return self.process(np.array([t]), np.asarray(values, dtype=float).reshape((1, 3)))[0]
+
+    def hold(self, t):
+        """
+        Steps the chain on to time t with the last input, returns the conditioned (3,)
+        """
+        return self.processSample(max(t, self.lastTime), self.lastInput)
+
+    def isSettled(self):
+        return self.lastInput is None or all(f.isSettled() for f in self.filters)
+
+    def setEnabled(self, enabled):
+        """
+        Which axes the filters work on, a bool for all of them or 3 of them
+        """
+        for f in self.filters:
+            f.setEnabled(enabled)
+
+    def isEmpty(self):
+        return len(self.filters) == 0
+
+    def reset(self):
+        self.lastInput = None
+        self.lastTime = None
+        for f in self.filters:
+            f.reset()
+
+
+# chains ConfigWindow offers, built fresh for each hand
+PRESETS = {
+    "None": lambda: FilterChain(),
+    "Light": lambda: FilterChain([OneEuro(minCutoff=2.0, beta=5.0)]),
+    "Heavy": lambda: FilterChain([Median(5), OneEuro(minCutoff=0.5, beta=2.0), Deadzone(0.02)]),
+}
+PRESET_NAMES = list(PRESETS)
+
+
+if __name__ == "__main__":
+    # per sample cost at 1 kHz, one sample at a time and in lossless batches of 10, and how much of
+    # the sensor jitter is left
+    rng = np.random.default_rng(0)
+    n = 10000
+    t = np.arange(n) * 0.001
+    clean = 0.5 + 0.3 * np.sin(2 * np.pi * 0.5 * t)[:, None] * np.array([1.0, 0.5, 0.2])
+    x = clean + rng.normal(0, 0.005, (n, 3))
+
+    def makeChain():
+        return FilterChain([Median(5), OneEuro(minCutoff=1.0, beta=2.0), Deadzone(0.02), Curve(1.5)])
+
+    chain = makeChain()
+    t0 = time.perf_counter()
+    for i in range(n):
+        chain.processSample(t[i], x[i])
+    single = (time.perf_counter() - t0) / n
+
+    chain = makeChain()
+    t0 = time.perf_counter()
+    for i in range(0, n, 10):
+        chain.process(t[i:i + 10], x[i:i + 10])
+    batched = (time.perf_counter() - t0) / n
+
+    smoothed = FilterChain([Median(5), OneEuro(minCutoff=1.0, beta=2.0)]).process(t, x)
+    print("single samples: {:.1f} us per sample, batches of 10: {:.1f} us per sample".format(
+        single * 1e6, batched * 1e6))
+    print("step jitter: {:.5f} raw, {:.5f} smoothed".format(
+        np.std(np.diff(x - clean, axis=0)), np.std(np.diff(smoothed - clean, axis=0))))
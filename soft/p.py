@@ -1,7 +1,29 @@
 import matplotlib.pyplot as plt
+import sys
 import time
 import numpy as np
 
+from SessionArchive import SessionArchive
+
+# python p.py session.arc [start s] [length s] [L|R]
+# plots a window of a session archive, only the window is read from the file
+if len(sys.argv) > 1:
+    a = SessionArchive(sys.argv[1])
+    start, end = a.timeRange()
+    t0 = start + (float(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    t1 = t0 + float(sys.argv[3]) if len(sys.argv) > 3 else end
+    side = sys.argv[4] if len(sys.argv) > 4 else "R"
+    w = a.sideWindow(side, t0, t1)
+    print(a.stats(t0, t1, side=side))
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    for i, name in enumerate(["roll", "pitch", "yaw"]):
+        ax.plot(w['t'] - start, w['rpy'][:, i], label=name)
+    ax.legend(loc='lower left')
+    plt.show()
+    sys.exit()
+
 plt.ion()
 fig = plt.figure()
 ax = fig.add_subplot(111)
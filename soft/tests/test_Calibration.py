@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from Calibration import CalibrationTransform, OnlineRecalibrator, fromUnmixing
+
+OFFSET = np.array([0.5, 0.45, 0.55])
+UNMIXING = np.array([[1.0, 0.1, -0.05], [0.08, 0.9, 0.1], [-0.1, 0.05, 1.1]])
+# [min, 0, max] of each coordinate, the second one flipped
+AXISRANGES = np.array([[-0.3, 0.0, 0.25], [0.35, 0.0, -0.2], [-0.28, 0.0, 0.3]])
+AXISFLIP = [False, True, False]
+AXES = [2, 0, 1]
+
+
+def makeTransform(center=None):
+    return fromUnmixing(OFFSET, UNMIXING, AXISRANGES, AXES, center)
+
+
+def oldCalibration():
+    """
+    What CalibrationDialog did for every sample: center, unmix, interp1d each coordinate, then
+    permute, with the flips in the ranges and fill values
+    """
+    interp1d = pytest.importorskip("scipy.interpolate").interp1d
+    interps = [interp1d(AXISRANGES[i, :], [0.0, 0.5, 1.0], bounds_error=False,
+                        fill_value=(1.0, 0.0) if AXISFLIP[i] else (0.0, 1.0)) for i in range(3)]
+
+    def calibrate(rpy):
+        t = (np.asarray(rpy) - OFFSET) @ UNMIXING.T
+        v = np.array([float(interps[i](t[i])) for i in range(3)])
+        return v[AXES]
+
+    return calibrate
+
+
+def samples(n, spread=0.5, seed=0):
+    # past the ends of the ranges as well as inside them
+    return OFFSET + np.random.default_rng(seed).uniform(-spread, spread, (n, 3))
+
+
+def test_matchesTheOldPath():
+    old = oldCalibration()
+    transform = makeTransform()
+    rpy = samples(2000)
+    expected = np.array([old(r) for r in rpy])
+    for r, e in zip(rpy, expected):
+        assert np.allclose(transform.apply(r), e, atol=1e-12)
+    assert np.allclose(transform.apply(rpy), expected, atol=1e-12)
+    # the breakpoints and the ends exactly
+    ends = OFFSET + np.linalg.solve(UNMIXING, AXISRANGES).T
+    assert np.allclose(transform.apply(ends), [old(r) for r in ends], atol=1e-12)
+
+
+def test_batchShapes():
+    transform = makeTransform()
+    rpy = samples(10)
+    assert transform.apply(rpy[0]).shape == (3,)
+    assert transform.apply(rpy).shape == (10, 3)
+    assert np.array_equal(transform.apply(rpy[:1]), transform.apply(rpy[0])[None, :])
+
+
+def test_centerTakesSamplesAcrossTheWrap():
+    old = oldCalibration()
+    transform = makeTransform(center=OFFSET)
+    rpy = samples(500, spread=0.45)
+    expected = np.array([old(r) for r in rpy])
+    # the same directions a whole turn off, as the IMU sends them either side of a wrap
+    turns = np.random.default_rng(1).integers(-1, 2, rpy.shape)
+    assert np.allclose(transform.apply(rpy + turns), expected, atol=1e-12)
+    assert np.allclose([transform.apply(r) for r in rpy + turns], expected, atol=1e-12)
+    # without a center the wraps go straight through
+    assert not np.allclose(makeTransform().apply(rpy + turns), expected)
+
+
+def test_copyAndBreakpoints():
+    transform = makeTransform()
+    c = transform.copy()
+    bp = c.breakpoints.copy()
+    bp[:, 0] -= 0.1
+    c.setBreakpoints(bp)
+    assert not np.allclose(c.breakpoints, transform.breakpoints)
+    rpy = samples(200)
+    assert np.allclose(c.apply(rpy), CalibrationTransform(c.offset, c.unmixing, bp, c.values).apply(rpy))
+
+
+def rawAt(transform, coords):
+    # raw samples the transform maps onto coords
+    return transform.offset + np.asarray(coords) @ np.linalg.pinv(transform._unmixingT)
+
+
+def test_recalibratorFollowsDriftAtRest():
+    transform = makeTransform()
+    r = OnlineRecalibrator(transform, warmup=100, maxStep=1e-4)
+    assert np.allclose(transform.apply(r.restRaw), 0.5)
+    drift = np.array([0.01, -0.008, 0.005])
+    noise = np.random.default_rng(2).normal(0.0, 1e-4, (4000, 3))
+    out = r.apply(r.restRaw + drift + noise)
+    assert np.allclose(r.drift(), drift, atol=1e-3)
+    # the drifted rest pose is back in the middle
+    assert np.allclose(np.mean(out[-100:], axis=0), 0.5, atol=2e-3)
+    # while the outputs glided there
+    assert np.max(np.abs(np.diff(out[200:], axis=0))) < 0.01
+
+
+def test_recalibratorLeavesMovementAndOtherPosesAlone():
+    transform = makeTransform()
+    rng = np.random.default_rng(3)
+    r = OnlineRecalibrator(transform, warmup=100, maxStep=1e-4)
+    # moving all over the calibrated ranges
+    coords = rng.uniform(0.8 * transform.breakpoints[:, 0], 0.8 * transform.breakpoints[:, -1], (3000, 3))
+    rpy = rawAt(transform, coords)
+    assert np.array_equal(r.apply(rpy), transform.apply(rpy))
+    assert np.array_equal(r.drift(), np.zeros(3))
+    # a pose held still away from the rest pose
+    held = rawAt(transform, 0.5 * transform.breakpoints[:, -1]) + rng.normal(0.0, 1e-4, (3000, 3))
+    assert np.array_equal(r.apply(held), transform.apply(held))
+    assert np.array_equal(r.drift(), np.zeros(3))
+    assert np.array_equal(r.transform.breakpoints, transform.breakpoints)
+
+
+def test_recalibratorBatchesMatchSingleSamples():
+    transform = makeTransform()
+    rng = np.random.default_rng(4)
+    rpy = np.concatenate((samples(500, spread=0.4, seed=5),
+                          OnlineRecalibrator(transform).restRaw + 0.01 + rng.normal(0.0, 1e-4, (1500, 3))))
+    single = OnlineRecalibrator(transform, warmup=100, maxStep=1e-4)
+    batched = OnlineRecalibrator(transform, warmup=100, maxStep=1e-4)
+    expected = np.array([single.apply(x) for x in rpy])
+    got = np.concatenate([batched.apply(b) for b in np.array_split(rpy, 37)])
+    assert np.array_equal(got, expected)
+    assert np.array_equal(batched.drift(), single.drift()) and np.any(single.drift() != 0.0)
+    single.reset()
+    assert np.array_equal(single.drift(), np.zeros(3))
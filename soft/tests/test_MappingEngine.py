@@ -0,0 +1,156 @@
+import numpy as np
+
+import MappingEngine
+from MappingEngine import Router, RoutingTable, ccPreset, scalePreset, TARGET_CC, TARGET_VELOCITY, VELOCITY_LEFT
+from PacketDecoder import Fingers
+
+# ToyMidiMap's Major Pentatonic
+SCALE = [0, 2, 4, 7, 9, 12, 14, 16, 24, 26, 28, 31, 33, 36, 38, 40]
+
+
+class Sink:
+    """
+    Stands in for a MIDIMapping, keeps what it's sent
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def ccValue(self, resolution, cc, val, channel=0):
+        self.sent.append(("cc", cc, int(val * 127)))
+
+    def startNote(self, pitch=60, vel=112):
+        self.sent.append(("on", pitch, vel))
+
+    def stopNote(self, pitch=60):
+        self.sent.append(("off", pitch))
+
+
+def oldCCs(side, values, changed, last):
+    """
+    What the old per axis M1 and ToyMidiMap sent for a sample, after MIDIMapping.cc skipped repeats
+    """
+    ccnums = (25, 26, 27) if side == "L" else (22, 23, 24)
+    sent = []
+    for cc, v, c in zip(ccnums, values, changed):
+        if c and last.get(cc) != int(v * 127):
+            last[cc] = int(v * 127)
+            sent.append(("cc", cc, int(v * 127)))
+    return sent
+
+
+def oldNoteIndex(finger):
+    # ToyMidiMap.getNoteIdxForFingerName before the tables
+    return (8 if finger[0] == "R" else 0) + (4 if finger[2] == "P" else 0) + "IMRP".index(finger[1])
+
+
+def walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.clip(0.5 + np.cumsum(rng.normal(0, 0.01, (n, 3)), axis=0), 0.0, 1.0)
+
+
+def test_ccPresetSendsWhatM1Sent():
+    r = Router(ccPreset())
+    out = Sink()
+    expected = []
+    last = dict()
+    rng = np.random.default_rng(1)
+    for i, v in enumerate(walk(300)):
+        side = "L" if i % 3 else "R"
+        changed = rng.random(3) < 0.7
+        expected += oldCCs(side, v, changed, last)
+        r.update(side, v, changed, out)
+    assert out.sent == expected
+
+
+def test_scalePresetPlaysToyMidiMapsNotes():
+    table = scalePreset(60, SCALE, ccPreset())
+    # left notes take their velocity from right pitch, like ToyMidiMap's velocity control
+    table.add(4, TARGET_VELOCITY, VELOCITY_LEFT)
+    r = Router(table)
+    out = Sink()
+    r.update("R", (0.2, 0.3, 0.4), (True, True, True), out)
+    out.sent = []
+    for f in Fingers:
+        r.finger(f.value, True, out)
+        r.finger(f.value, False, out)
+    expected = []
+    for f in Fingers:
+        note = 60 + SCALE[oldNoteIndex(f.name)]
+        expected += [("on", note, int(0.3 * 127) if f.name[0] == "L" else 127), ("off", note)]
+    assert out.sent == expected
+
+
+def test_noteOffAfterTheTableChanges():
+    table = scalePreset(60, SCALE)
+    r = Router(table)
+    out = Sink()
+    r.finger(0, True, out)
+    table.setNote(0, 72)
+    r.finger(0, False, out)
+    assert out.sent == [("on", 60, 127), ("off", 60)]
+
+
+def test_unchangedStepsAreNotSentAgain():
+    r = Router(ccPreset())
+    out = Sink()
+    r.update("R", (0.5, 0.5, 0.5), (True, True, True), out)
+    assert len(out.sent) == 3
+    # the same values and values that land on the same step
+    r.update("R", (0.5, 0.5, 0.5), (True, True, True), out)
+    r.update("R", (0.501, 0.5, 0.502), (True, True, True), out)
+    assert len(out.sent) == 3
+    r.update("R", (0.6, 0.5, 0.5), (True, True, True), out)
+    assert out.sent[3:] == [("cc", 22, int(0.6 * 127))]
+
+
+def test_stagedSamplesAreSentOnEvaluate():
+    r = Router(ccPreset())
+    out = Sink()
+    r.stage("R", (0.1, 0.2, 0.3), (True, False, False))
+    r.stage("L", (0.4, 0.5, 0.6), (False, False, True))
+    assert out.sent == []
+    r.evaluate(out)
+    assert sorted(out.sent) == [("cc", 22, int(0.1 * 127)), ("cc", 27, int(0.6 * 127))]
+    # nothing staged since
+    r.evaluate(out)
+    assert len(out.sent) == 2
+
+
+def test_scalarPathMatchesNumPy():
+    rng = np.random.default_rng(2)
+    table = RoutingTable()
+    for i in range(40):
+        lo = rng.uniform(0.0, 0.5)
+        table.add(i % MappingEngine.NUM_SOURCES, TARGET_CC if i % 5 else TARGET_VELOCITY, i % 2 if i % 5 == 0 else i,
+                  inRange=(lo, lo + rng.uniform(0.1, 0.5)), outRange=(rng.uniform(0.0, 0.3), rng.uniform(0.7, 1.0)))
+    scalar, vector = Router(table), Router(table)
+    scalar.SCALAR_ROUTES = 1000
+    vector.SCALAR_ROUTES = 0
+    outs = Sink(), Sink()
+    for i, v in enumerate(walk(200, seed=3)):
+        side = "L" if i % 2 else "R"
+        changed = rng.random(3) < 0.8
+        for r, out in zip((scalar, vector), outs):
+            r.update(side, v, changed, out)
+        assert np.array_equal(scalar.velocity, vector.velocity)
+    assert len(outs[0].sent) > 0 and outs[0].sent == outs[1].sent
+
+
+def test_setResendsEverything():
+    table = ccPreset()
+    r = Router(table)
+    out = Sink()
+    r.update("R", (0.1, 0.2, 0.3), (True, True, True), out)
+    version = table.version
+    table.set(0, number=40)
+    assert table.version > version
+    out.sent = []
+    # the same values, each route is sent again, the changed one to its new cc
+    r.update("R", (0.1, 0.2, 0.3), (True, True, True), out)
+    assert out.sent == [("cc", 40, int(0.1 * 127)), ("cc", 23, int(0.2 * 127)), ("cc", 24, int(0.3 * 127))]
+    # and a disabled route not at all
+    table.set(1, enabled=False)
+    out.sent = []
+    r.update("R", (0.1, 0.2, 0.3), (True, True, True), out)
+    assert out.sent == [("cc", 40, int(0.1 * 127)), ("cc", 24, int(0.3 * 127))]
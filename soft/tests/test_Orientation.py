@@ -0,0 +1,101 @@
+import numpy as np
+
+from Orientation import OrientationNormalizer, centerTurns, circularMean, nearestTurns, unwrapTurns, wrapTurns
+from Orientation import (poseAngles, quatFromQ123, quatMultiply, quatToYPR, relativeRotation, swingTwist,
+                         twistAngle, yprToQuat, QUAT_SCALE)
+from PacketDecoder import normalizeGyro
+
+
+def test_wrapTurnsAtZeroAndOne():
+    assert np.allclose(wrapTurns([-0.25, 0.0, 1.0, 1.25]), [0.75, 0.0, 0.0, 0.25])
+
+
+def test_centerTurnsAcrossTheWrap():
+    assert np.allclose(centerTurns([0.99, 0.01, 0.5], 0.0), [0.49, 0.51, 0.0])
+    assert np.allclose(centerTurns([-0.25, 0.75], 0.6), [0.65, 0.65])
+    # exactly on the center and exactly half a turn away
+    assert np.allclose(centerTurns([0.0, 1.0, 0.5], 0.0), [0.5, 0.5, 0.0])
+
+
+def test_nearestTurns():
+    assert np.allclose(nearestTurns([0.95, 0.05], 0.0), [-0.05, 0.05])
+    assert np.allclose(nearestTurns([0.05, 0.95], 1.0), [1.05, 0.95])
+
+
+def test_unwrapTurns():
+    assert np.allclose(unwrapTurns([[0.7], [0.74], [-0.24], [-0.2]]).ravel(), [0.7, 0.74, 0.76, 0.8])
+    assert np.allclose(unwrapTurns([[0.74], [-0.24]], previous=[1.7]).ravel(), [1.74, 1.76])
+    # going down through 0 as well as up through 1
+    assert np.allclose(unwrapTurns([[0.02], [0.98], [0.95]]).ravel(), [0.02, -0.02, -0.05])
+
+
+def test_circularMeanAcrossTheWrap():
+    m = circularMean([0.98, 0.02])
+    assert np.isclose(m, 0.0) or np.isclose(m, 1.0)
+    assert np.isclose(circularMean([0.9, 0.96]), 0.93)
+
+
+def test_normalizerYawCrossingPi():
+    # yaw as the board sends it crossing +-pi, centered near there the output doesn't jump
+    n = OrientationNormalizer()
+    yaw = np.linspace(0.7, 0.8, 11)
+    raw = np.stack((np.full(11, 0.5), np.full(11, 0.5), np.where(yaw > 0.75, yaw - 1.0, yaw)), axis=1)
+    n.setCenter("L", raw[5])
+    out = n.normalize("L", raw)
+    assert np.all(np.abs(np.diff(out[:, 2])) < 0.02), out
+    # single samples and batches agree
+    assert all(np.allclose(n.normalize("L", r), o) for r, o in zip(raw, out))
+
+
+def test_normalizerCenterOnLastSample():
+    n = OrientationNormalizer()
+    n.setCenter("R")
+    assert np.allclose(n.centers, 0.5)
+    n.normalize("R", [0.1, 0.99, 0.0])
+    # only yaw is centered, the other axes keep the default center and stay as they are
+    n.setCenter("R", axes=[2])
+    assert np.allclose(n.normalize("R", [0.1, 0.99, 0.0]), [0.1, 0.99, 0.5])
+
+
+def test_quaternionRoundTrips():
+    rng = np.random.default_rng(0)
+    ypr = np.stack((rng.uniform(-3, 3, 100), rng.uniform(-3, 3, 100), rng.uniform(-1.5, 1.5, 100)), axis=1)
+    q = yprToQuat(ypr)
+    assert np.allclose(quatToYPR(q), ypr)
+    # the board only sends Q1-Q3 and w >= 0, q and -q are the same rotation
+    q = q * np.where(q[:, 0:1] < 0, -1.0, 1.0)
+    assert np.allclose(quatFromQ123(np.round(q[:, 1:] * QUAT_SCALE)), q, atol=1e-6)
+    assert np.allclose(relativeRotation(q, q), [1.0, 0.0, 0.0, 0.0])
+    swing, twist = swingTwist(q, [1.0, 0.0, 0.0])
+    assert np.allclose(quatMultiply(swing, twist), q)
+    assert np.allclose(swing[:, 1], 0.0)
+
+
+def test_twistThroughThePole():
+    # twist around x stays put while pitching (y) through 90 degrees, where the Euler x angle flips
+    pitch = np.linspace(1.3, 1.7, 9)
+    pose = quatMultiply(yprToQuat(np.stack((np.zeros(9), np.zeros(9), pitch), axis=1)),
+                        yprToQuat([0.0, 0.3, 0.0]))
+    assert np.allclose(twistAngle(pose, [1.0, 0.0, 0.0]), 0.3)
+
+
+def test_poseAnglesFromTheReference():
+    reference = yprToQuat([0.4, -0.3, 0.2])
+    assert np.allclose(poseAngles(reference, reference), 0.5)
+    # close to the reference they're the board's angles centered on it
+    rng = np.random.default_rng(0)
+    ypr = rng.uniform(-0.05, 0.05, (10, 3))
+    euler = normalizeGyro(ypr) - normalizeGyro(np.zeros((1, 3))) + 0.5
+    assert np.allclose(poseAngles(yprToQuat(ypr), [1.0, 0.0, 0.0, 0.0]), euler, atol=1e-3)
+
+
+def test_poseAnglesThroughThePole():
+    # the same pitch through 90 degrees as test_twistThroughThePole, where the board's angles flip
+    pitch = np.linspace(1.3, 1.7, 9)
+    pose = quatMultiply(yprToQuat(np.stack((np.zeros(9), np.zeros(9), pitch), axis=1)),
+                        yprToQuat([0.0, 0.3, 0.0]))
+    assert np.any(np.abs(np.diff(normalizeGyro(quatToYPR(pose)), axis=0)) > 0.4)
+    angles = poseAngles(pose, [1.0, 0.0, 0.0, 0.0])
+    assert np.allclose(angles[:, 0], pitch / (2.0 * np.pi) + 0.5)
+    assert np.allclose(angles[:, 1], 0.3 / (2.0 * np.pi) + 0.5)
+    assert np.allclose(angles[:, 2], 0.5)
@@ -0,0 +1,151 @@
+import numpy as np
+
+import PacketDecoder
+from PacketDecoder import PacketDecoder as Decoder, FRAME_DTYPE
+from PacketDecoder import V2_VERSION, crc16, encodeFrameV2, frameSide
+from PacketDecoder import frameTimes
+
+
+def v1Frame(rng, flags=0):
+    f = np.zeros(1, dtype=FRAME_DTYPE)
+    f['routes'] = [1, -1, -1, -1]
+    f['ypr'] = rng.uniform(-3, 3, 3)
+    f['raw'] = np.arange(6)
+    f['trailer'] = [3, 2, 1, flags]
+    return f.tobytes()
+
+
+def v2Frame(rng, seq, boardTime=None, flags=0):
+    if boardTime is None:
+        boardTime = 1000 * seq
+    return encodeFrameV2([1, -1, -1, -1], rng.uniform(-3, 3, 3), np.arange(6), flags, seq, boardTime)
+
+
+def test_decodesEveryWholeFrame():
+    rng = np.random.default_rng(0)
+    data = b"".join(v1Frame(rng) for _ in range(11))
+    d = Decoder()
+    d.feed(data[:-5])
+    frames = d.decode()
+    assert len(frames) == 10
+    assert np.all(frames['trailer'][:, 0:3] == [3, 2, 1])
+    assert frames.tobytes() == data[:10 * FRAME_DTYPE.itemsize]
+    # the partial frame is kept for the next call
+    assert len(d.decode()) == 0
+    d.feed(data[-5:])
+    assert d.decode().tobytes() == data[-FRAME_DTYPE.itemsize:]
+
+
+def test_v1SyncMidFrame():
+    rng = np.random.default_rng(0)
+    d = Decoder()
+    d.feed(bytes(5) + b"".join(v1Frame(rng) for _ in range(10)))
+    frames = d.decode()
+    assert len(frames) == 10
+    assert d.droppedBytes == 5 and d.framesDropped == 1
+
+
+def test_v1CorruptTrailerResyncs():
+    rng = np.random.default_rng(0)
+    data = [v1Frame(rng) for _ in range(6)]
+    bad = bytearray(data[2])
+    bad[-2] = 7
+    data[2] = bytes(bad)
+    d = Decoder()
+    d.feed(b"".join(data))
+    assert len(d.decode()) == 5
+    assert d.resyncCount == 1 and d.framesDropped == 1
+
+
+def test_crc16CheckValue():
+    # the standard check value of CRC-16/CCITT-FALSE
+    data = np.frombuffer(b"123456789", dtype=np.uint8)
+    assert crc16(data.reshape((1, -1)))[0] == 0x29B1
+    # every row on its own
+    rows = np.stack((data, data[::-1]))
+    assert crc16(rows)[0] == 0x29B1 and crc16(rows)[1] != 0x29B1
+
+
+def test_v1FramesStillDecode():
+    rng = np.random.default_rng(0)
+    d = Decoder()
+    d.feed(bytes(5) + b"".join(v1Frame(rng, flags=1) for _ in range(10)))
+    frames = d.decode()
+    assert len(frames) == 10 and d.version == 1 and np.all(d.sequence == -1)
+    assert frameSide(frames[0]) == "L"
+
+
+def test_v2FlippedBitOnlyCostsItsFrame():
+    rng = np.random.default_rng(0)
+    seqs = [0, 1, 2, 4, 3, 5, 6, 7, 8, 9]
+    data = [v2Frame(rng, s, 1000 * s + 4294960000) for s in seqs]
+    bad = bytearray(data[7])
+    bad[20] ^= 4
+    data[7] = bytes(bad)
+    stream = bytes(3) + b"".join(data)
+
+    d = Decoder()
+    got = []
+    t = 0.0
+    # in pieces that don't line up with the frames
+    for i in range(0, len(stream), 17):
+        d.feed(stream[i:i + 17])
+        t += 0.001
+        d.decode(hostTime=t)
+        got.extend(d.sequence.tolist())
+    assert d.version == V2_VERSION
+    assert got == [0, 1, 2, 4, 3, 5, 6, 8, 9]
+    stats = d.stats.getStats()
+    assert stats["received"] == 9 and stats["lost"] == 1 and stats["reordered"] == 1, stats
+    # the board time wraps in the middle of the stream
+    assert np.isclose(stats["boardRate"], 1000.0), stats
+    assert d.resyncCount == 1
+
+
+def test_v2PartialFrameWaits():
+    rng = np.random.default_rng(0)
+    frame = v2Frame(rng, 0, flags=1)
+    d = Decoder()
+    d.feed(frame[:-5])
+    assert len(d.decode()) == 0
+    d.feed(frame[-5:])
+    frames = d.decode()
+    assert len(frames) == 1 and d.version == V2_VERSION
+    assert frameSide(frames[0]) == "L"
+
+
+def test_v2StaysOnV2PastATrailerInDamagedData():
+    rng = np.random.default_rng(1)
+    frames = [v2Frame(rng, s) for s in range(6)]
+    # a damaged frame whose last bytes look like a version 1 trailer
+    bad = bytearray(frames[3])
+    bad[36:40] = bytes([3, 2, 1, 1])
+    frames[3] = bytes(bad)
+    d = Decoder()
+    d.feed(b"".join(frames[:3]))
+    assert len(d.decode()) == 3
+    d.feed(b"".join(frames[3:]))
+    d.decode()
+    assert d.version == V2_VERSION and d.sequence.tolist() == [4, 5]
+
+
+def test_v2FallsBackAfterSeveralV1Frames():
+    rng = np.random.default_rng(1)
+    d = Decoder()
+    d.feed(b"".join(v2Frame(rng, s) for s in range(3)))
+    d.decode()
+    n = PacketDecoder.V1_FALLBACK_FRAMES
+    got = []
+    for i in range(n + 2):
+        d.feed(v1Frame(rng))
+        got.append(len(d.decode()))
+    # the first frame after the switch is lost to the resync, the run starts with the next one
+    assert got == [0] * n + [n, 1]
+    assert d.version == 1 and not d.preferV2
+
+
+def test_frameTimes():
+    assert np.allclose(frameTimes(10.0, 3), [9.98, 9.99, 10.0])
+    # board times across the 32 bit wrap
+    w = PacketDecoder.BOARD_TIME_WRAP
+    assert np.allclose(frameTimes(10.0, 3, np.array([w - 0.002, w - 0.001, 0.0])), [9.998, 9.999, 10.0])
@@ -0,0 +1,52 @@
+from RateLimiter import RateLimiter
+
+
+def makeLimiter(interval=0.033, **kwargs):
+    sent = []
+    return RateLimiter(lambda key, value: sent.append((key, value)), interval=interval, **kwargs), sent
+
+
+def test_firstValueGoesStraightOut():
+    r, sent = makeLimiter()
+    r.submit("a", 1, now=0.0)
+    assert sent == [("a", 1)]
+    assert r.flush(now=0.0) is None
+
+
+def test_burstEndsWithItsLastValue():
+    # a 1 kHz gesture through a 30 Hz limit, its end value has to come out of flush
+    r, sent = makeLimiter()
+    r.setInterval(0.2, key="slow")
+    for i in range(90):
+        r.submit("fast", i, now=i * 0.001)
+        r.submit("slow", i, now=i * 0.001)
+    assert sent[-1] != ("fast", 89)
+    assert r.nextDeadline() == r.flush(now=0.05)
+    assert r.flush(now=0.1) == 0.2
+    assert sent[-1] == ("fast", 89)
+    assert r.flush(now=0.2) is None
+    assert sent[-1] == ("slow", 89)
+    counts = r.getCounts()
+    assert counts["sent"] == len(sent) and counts["flushed"] == 2
+    assert counts["held"] > counts["sent"]
+
+
+def test_keysHaveTheirOwnBudget():
+    r, sent = makeLimiter(interval=0.1)
+    r.submit("a", 1, now=0.0)
+    r.submit("b", 1, now=0.01)
+    assert sent == [("a", 1), ("b", 1)]
+    r.submit("a", 2, now=0.05)
+    assert r.nextDeadline() == 0.1
+    r.submit("a", 3, now=0.11)
+    # due, so it goes out straight away instead of waiting for flush
+    assert sent[-1] == ("a", 3) and r.nextDeadline() is None
+
+
+def test_heldValuesAreMerged():
+    r, sent = makeLimiter(interval=0.1, merge=lambda old, new: old + new)
+    r.submit("a", [1], now=0.0)
+    r.submit("a", [2], now=0.01)
+    r.submit("a", [3], now=0.02)
+    r.flush(now=0.1)
+    assert sent == [("a", [1]), ("a", [2, 3])]
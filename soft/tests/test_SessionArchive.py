@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+import PacketDecoder
+import SessionArchive
+from SessionArchive import ARCHIVE_DTYPE, FILE_HEADER_DTYPE, SessionArchiveWriter
+
+
+@pytest.fixture
+def smallBlocks(monkeypatch):
+    # a block index over a few records instead of a few thousand
+    monkeypatch.setattr(SessionArchive, "INDEX_STRIDE", 4)
+
+
+def makeRecords(t, side="L", rpy=0.5):
+    r = np.zeros(len(t), dtype=ARCHIVE_DTYPE)
+    r['t'] = t
+    r['side'] = side.encode()
+    r['rpy'] = rpy
+    return r
+
+
+def writeArchive(path, records):
+    w = SessionArchiveWriter(str(path))
+    w.append(records)
+    w.close()
+    return SessionArchive.SessionArchive(str(path))
+
+
+def test_seekOnAndBetweenIndexEntries(tmp_path, smallBlocks):
+    t = np.arange(18) * 0.1
+    a = writeArchive(tmp_path / "s.arc", makeRecords(t))
+    assert len(a._index) == 5
+    for i in range(18):
+        # exactly on a record, index entries (every 4th) included
+        assert a.seek(t[i]) == i
+        # past the last record of a block lands on the first of the next
+        assert a.seek(t[i] + 0.05) == i + 1
+    assert a.seek(-1.0) == 0 and a.seek(100.0) == 18
+    assert np.array_equal(a.window(0.4, 0.8)['t'], t[4:8])
+
+
+def test_seekWithRepeatedTimesAcrossBlocks(tmp_path, smallBlocks):
+    # both gloves' records of a read share its time, here one runs over two block boundaries
+    t = np.array([0.0, 0.1, 0.2, 0.3, 0.3, 0.3, 0.3, 0.3, 0.3, 0.3, 0.4])
+    a = writeArchive(tmp_path / "s.arc", makeRecords(t))
+    assert a.seek(0.3) == 3
+    assert a.seek(0.35) == 10
+
+
+def test_refreshFollowsAnOpenArchive(tmp_path, smallBlocks):
+    path = tmp_path / "s.arc"
+    w = SessionArchiveWriter(str(path))
+    w.append(makeRecords(np.arange(6) * 0.1))
+    w.flush()
+    a = SessionArchive.SessionArchive(str(path))
+    assert len(a) == 6 and len(a._index) == 2
+
+    w.append(makeRecords(0.6 + np.arange(7) * 0.1))
+    w.flush()
+    assert len(a) == 6
+    a.refresh()
+    assert len(a) == 13
+    assert np.allclose(a._index, [0.0, 0.4, 0.8, 1.2])
+    assert a.seek(1.0) == 10
+    assert np.allclose(a.timeRange(), (0.0, 1.2))
+    w.close()
+
+
+def test_writerDropsAPartialTrailingRecord(tmp_path):
+    path = tmp_path / "s.arc"
+    writeArchive(path, makeRecords(np.arange(3) * 0.1))
+    # a crash in the middle of writing a record
+    with open(path, "ab") as f:
+        f.write(makeRecords([0.3]).tobytes()[:17])
+    w = SessionArchiveWriter(str(path))
+    w.append(makeRecords([0.4, 0.5], side="R"))
+    w.close()
+    a = SessionArchive.SessionArchive(str(path))
+    assert (path.stat().st_size - FILE_HEADER_DTYPE.itemsize) % ARCHIVE_DTYPE.itemsize == 0
+    assert np.allclose(a.records['t'], [0.0, 0.1, 0.2, 0.4, 0.5])
+    assert a.records['side'].tolist() == [b"L", b"L", b"L", b"R", b"R"]
+
+
+def test_statsAcrossTheWrap(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 1000
+    # the left glove sits where its values wrap, the right one in the middle
+    left = np.mod(rng.normal(0.0, 0.01, (n, 3)), 1.0)
+    right = 0.5 + rng.normal(0.0, 0.01, (n, 3))
+    t = np.arange(n) * 0.01
+    records = np.concatenate((makeRecords(t, "L", left), makeRecords(t, "R", right)))
+    records = records[np.argsort(records['t'], kind='stable')]
+    a = writeArchive(tmp_path / "s.arc", records)
+
+    # in chunks smaller than the window, so the sums carry over between them
+    s = a.stats(chunkRecords=300)
+    assert s["L"]["count"] == n and s["R"]["count"] == n
+    assert np.isclose(s["L"]["rate"], 100.0)
+    # a plain mean of the left glove's values would be near 0.5
+    assert np.all(np.minimum(s["L"]["mean"], 1.0 - s["L"]["mean"]) < 0.002)
+    assert np.allclose(s["L"]["std"], 0.01, atol=0.002)
+    assert np.allclose(s["R"]["mean"], 0.5, atol=0.002) and np.allclose(s["R"]["std"], 0.01, atol=0.002)
+    assert np.allclose(a.stats(side="R")["R"]["mean"], s["R"]["mean"])
+    assert list(a.stats(side="R")) == ["R"]
+
+
+def test_archiveRecordsFromFrames():
+    f = np.zeros(2, dtype=PacketDecoder.FRAME_DTYPE)
+    f['trailer'] = [[3, 2, 1, 1], [3, 2, 1, 0]]
+    f['raw'] = np.arange(12).reshape((2, 6))
+    r = SessionArchive.archiveRecords(f, 5.0, sequence=np.array([7, 8]), boardTime=np.array([0.1, 0.2]))
+    assert r['side'].tolist() == [b"L", b"R"]
+    assert np.array_equal(r['seq'], [7, 8]) and np.allclose(r['t'], 5.0)
+    assert np.array_equal(r['raw'], f['raw'])
+    assert np.allclose(r['quat'], [1.0, 0.0, 0.0, 0.0])
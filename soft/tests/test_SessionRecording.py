@@ -0,0 +1,144 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import PacketDecoder
+import SessionRecording
+from EventBus import pub
+from SessionRecording import (SessionRecorder, ReplayConnection, readHeader, readRecording, recordBatches,
+                              loadRecording, FILE_HEADER_DTYPE, CHUNK_HEADER_DTYPE, RECORD_DTYPE)
+
+
+def frames(n, side, start=0):
+    f = np.zeros(n, dtype=PacketDecoder.FRAME_DTYPE)
+    f['ypr'][:, 0] = 0.01 * (start + np.arange(n))
+    f['routes'][:, 0] = np.where((start + np.arange(n)) % 2 == 0, PacketDecoder.ROUTE_THUMB, PacketDecoder.ROUTE_NONE)
+    f['trailer'] = [3, 2, 1, PacketDecoder.SIDE_LEFT if side == "L" else PacketDecoder.SIDE_RIGHT]
+    return f
+
+
+def record(path, reads, chunkSize=256):
+    """
+    reads is a list of (side, t, n), written as they'd arrive
+    """
+    r = SessionRecorder(str(path), chunkSize=chunkSize)
+    start = 0
+    for side, t, n in reads:
+        r.write(frames(n, side, start), t)
+        start += n
+    r.close()
+    return start
+
+
+def test_batchesComeBackAsTheyWereRead(tmp_path):
+    path = tmp_path / "s.rec"
+    # both gloves interleaved, and a read of each with the same arrival time
+    reads = [("L", 1.0, 3), ("R", 1.0, 2), ("L", 1.01, 1), ("R", 1.02, 4), ("R", 1.03, 2)]
+    n = record(path, reads, chunkSize=4)
+    assert len(loadRecording(str(path))) == n
+    got = [(side, t, len(f)) for side, t, f in recordBatches(str(path))]
+    # chunks split a read in two, the rest comes back as it was written
+    merged = []
+    for side, t, m in got:
+        if merged and merged[-1][0] == side and merged[-1][1] == t:
+            merged[-1] = (side, t, merged[-1][2] + m)
+        else:
+            merged.append((side, t, m))
+    assert merged == reads
+
+
+def test_replayPublishesLikeABoard(tmp_path):
+    path = tmp_path / "s.rec"
+    reads = [("L", 1.0, 3), ("R", 1.0, 2), ("L", 1.01, 1), ("R", 1.02, 4)]
+    record(path, reads)
+
+    batches = {"L": [], "R": []}
+    fingers = []
+    listeners = {
+        'LGyroBatch': lambda t, rpy, connections, quat: batches["L"].append((len(t), rpy, quat)),
+        'RGyroBatch': lambda t, rpy, connections, quat: batches["R"].append((len(t), rpy, quat)),
+        'FingerConnection': lambda con, finger: fingers.append((con, finger))}
+    for topic, l in listeners.items():
+        pub.subscribe(l, topic)
+    try:
+        c = ReplayConnection(str(path), speed=None)
+        asyncio.run(c.publish())
+    finally:
+        for topic, l in listeners.items():
+            pub.unsubscribe(l, topic)
+
+    assert c.framesReceived == 10 and c.batchesReplayed == 4
+    assert [b[0] for b in batches["L"]] == [3, 1] and [b[0] for b in batches["R"]] == [2, 4]
+    # the angles made it through, frame i has yaw 0.01 i
+    allL = np.concatenate([b[1] for b in batches["L"]])
+    expected = PacketDecoder.normalizeGyro(frames(10, "L")['ypr'])[[0, 1, 2, 5]]
+    assert np.allclose(allL, expected)
+    assert all(b[2].shape == (b[0], 4) for side in batches for b in batches[side])
+    # frames alternate the index thumb, only each batch's last frame counts and each glove is compared
+    # with its own last batch
+    assert fingers == [(True, "LIT"), (True, "RIT"), (False, "LIT"), (False, "RIT")]
+
+
+def test_truncatedLastChunkStopsCleanly(tmp_path):
+    path = tmp_path / "s.rec"
+    record(path, [("L", 1.0, 4), ("L", 1.01, 4), ("L", 1.02, 4)], chunkSize=4)
+    size = path.stat().st_size
+    with open(path, "r+b") as f:
+        f.truncate(size - 10)
+    chunks = list(readRecording(str(path)))
+    assert [len(c) for c in chunks] == [4, 4]
+    # even one cut in its header
+    with open(path, "r+b") as f:
+        f.truncate(FILE_HEADER_DTYPE.itemsize + 2 * (CHUNK_HEADER_DTYPE.itemsize + 4 * RECORD_DTYPE.itemsize) + 5)
+    assert [len(c) for c in readRecording(str(path))] == [4, 4]
+
+
+def test_corruptChunkStopsCleanly(tmp_path):
+    path = tmp_path / "s.rec"
+    record(path, [("L", 1.0, 4), ("L", 1.01, 4), ("L", 1.02, 4)], chunkSize=4)
+    # a flipped bit in the second chunk's records
+    at = FILE_HEADER_DTYPE.itemsize + CHUNK_HEADER_DTYPE.itemsize + 4 * RECORD_DTYPE.itemsize + \
+        CHUNK_HEADER_DTYPE.itemsize + 20
+    with open(path, "r+b") as f:
+        f.seek(at)
+        b = f.read(1)
+        f.seek(at)
+        f.write(bytes([b[0] ^ 1]))
+    assert [len(c) for c in readRecording(str(path))] == [4]
+
+
+def test_recorderAppendsToAnExistingRecording(tmp_path):
+    path = tmp_path / "s.rec"
+    record(path, [("L", 1.0, 2)])
+    record(path, [("R", 2.0, 3)])
+    assert [(side, len(f)) for side, t, f in recordBatches(str(path))] == [("L", 2), ("R", 3)]
+
+
+def test_headerMismatchRaises(tmp_path):
+    path = tmp_path / "s.rec"
+    record(path, [("L", 1.0, 2)])
+    header = readHeader(str(path))
+    assert header['version'] == SessionRecording.FILE_VERSION
+
+    def rewrite(**fields):
+        h = np.zeros(1, dtype=FILE_HEADER_DTYPE)
+        h['magic'] = SessionRecording.FILE_MAGIC
+        h['version'] = SessionRecording.FILE_VERSION
+        h['recordSize'] = RECORD_DTYPE.itemsize
+        for k, v in fields.items():
+            h[k] = v
+        with open(path, "r+b") as f:
+            f.write(h.tobytes())
+
+    rewrite(version=SessionRecording.FILE_VERSION + 1)
+    with pytest.raises(ValueError):
+        readHeader(str(path))
+    rewrite(recordSize=RECORD_DTYPE.itemsize - 4)
+    with pytest.raises(ValueError):
+        readHeader(str(path))
+    with pytest.raises(ValueError):
+        list(readRecording(str(path)))
+    rewrite(magic=b"NOTAREC!")
+    with pytest.raises(ValueError):
+        readHeader(str(path))
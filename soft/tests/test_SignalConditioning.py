@@ -0,0 +1,92 @@
+import numpy as np
+
+from SignalConditioning import EMA, Curve, Deadzone, FilterChain, Median, OneEuro, PRESETS
+
+
+def test_batchesMatchSingleSamples():
+    rng = np.random.default_rng(0)
+    t = np.arange(100) * 0.001
+    x = 0.5 + rng.normal(0, 0.01, (100, 3))
+
+    def makeChain():
+        return FilterChain([Median(5), OneEuro(minCutoff=1.0, beta=2.0), EMA(0.01), Deadzone(0.02), Curve(1.5)])
+
+    batched = makeChain()
+    out = np.concatenate([batched.process(t[i:i + 10], x[i:i + 10]) for i in range(0, 100, 10)])
+    single = makeChain()
+    assert np.allclose([single.processSample(t[i], x[i]) for i in range(100)], out)
+
+
+def test_emaFollowsItsTimeConstant():
+    f = EMA(tau=0.1)
+    f.process(np.array([0.0]), np.zeros((1, 3)))
+    y = f.process(np.array([0.1]), np.ones((1, 3)))
+    assert np.allclose(y, 1.0 - np.exp(-1.0))
+
+
+def test_oneEuroFollowsFastMovement():
+    t = np.arange(200) * 0.001
+    x = np.repeat(np.linspace(0.0, 1.0, 200)[:, None], 3, axis=1)
+    slow = OneEuro(minCutoff=1.0, beta=0.0).process(t, x)
+    fast = OneEuro(minCutoff=1.0, beta=10.0).process(t, x)
+    assert np.all(np.abs(fast[-1] - x[-1]) < np.abs(slow[-1] - x[-1]))
+
+
+def test_medianRemovesASpike():
+    x = np.full((9, 3), 0.5)
+    x[4] = 1.0
+    y = Median(3).process(np.arange(9) * 0.001, x)
+    assert np.allclose(y, 0.5)
+
+
+def test_deadzoneKeepsTheFullRange():
+    f = Deadzone(0.1)
+    y = f.process(None, np.array([[0.5, 0.55, 0.45], [0.0, 1.0, 0.6], [0.6, 0.6, 0.6]]))
+    assert np.allclose(y[0], 0.5)
+    assert np.allclose(y[1, :2], [0.0, 1.0])
+    assert np.allclose(y[2], 0.5)
+
+
+def test_curveKeepsCenterAndEnds():
+    f = Curve(2.0)
+    y = f.process(None, np.array([[0.0, 0.5, 1.0], [0.75, 0.25, 0.5]]))
+    assert np.allclose(y[0], [0.0, 0.5, 1.0])
+    assert np.allclose(y[1, :2], [0.625, 0.375])
+
+
+def test_perAxisParametersAndEnabled():
+    f = EMA(tau=[0.1, 1.0, 0.1], enabled=[True, True, False])
+    f.process(np.array([0.0]), np.zeros((1, 3)))
+    y = f.process(np.array([0.1]), np.ones((1, 3)))[0]
+    assert y[0] > y[1] > 0.0 and y[2] == 1.0
+
+
+def test_chainSetEnabled():
+    chain = PRESETS["Heavy"]()
+    chain.setEnabled([False, False, False])
+    x = np.array([[0.2, 0.5, 0.9]])
+    assert np.allclose(chain.process(np.array([0.0]), x), x)
+
+
+def test_holdSettlesOnTheLastInput():
+    chain = PRESETS["Heavy"]()
+    assert chain.isSettled()
+    t = 0.0
+    for i in range(20):
+        t = i * 0.01
+        chain.processSample(t, (0.5 + 0.015 * i,) * 3)
+    assert not chain.isSettled()
+    target = chain.filters[-1].process(None, np.full((1, 3), 0.5 + 0.015 * 19))[0]
+    steps = 0
+    while not chain.isSettled():
+        t += chain.HOLD_PERIOD
+        out = chain.hold(t)
+        steps += 1
+        assert steps < 1000
+    assert np.allclose(out, target, atol=1e-4)
+
+
+def test_statelessChainIsAlwaysSettled():
+    chain = FilterChain([Deadzone(0.02), Curve(1.5)])
+    chain.processSample(0.0, (0.3, 0.5, 0.7))
+    assert chain.isSettled()